@@ -5,6 +5,9 @@ Copies the mosaiic diretories that are used in the DR1 data stuff to a new direc
 """
 
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
 
 import numpy as np
 
@@ -24,17 +27,21 @@ mosaic_names = np.sort(list(set(l_objects["Mosaic_ID"])))
 print("Mosaic IDs: ")
 print(mosaic_names)
 
-for mosaic in mosaic_names:
+
+def copy_mosaic(mosaic):
     m_path = os.path.join(source_loc, mosaic)
     m_dest = os.path.join(dest_loc, mosaic)
-    try:
-        os.system(f"mkdir -p {m_dest} && cp -r {m_path}/* {m_dest}")
-        if "Hetde" in mosaic:
-            os.system(f"mkdir -p {m_dest} && cp -r {m_path}*/* {m_dest}")
-    except Exception as s:
-        print(s)
-        os.system(f"mkdir -p {m_dest} && cp -r {m_path}*/* {m_dest}")
-    # try:
-    #    destination = shutil.copytree(m_path, m_dest)
-    # except Exception as e:
-    #    print(e)
+    # Hetdex mosaics can be split over multiple directories starting with the mosaic name
+    sources = glob(f"{m_path}*") if "Hetde" in mosaic else [m_path]
+    for source in sources:
+        try:
+            shutil.copytree(source, m_dest, dirs_exist_ok=True)
+        except Exception as e:
+            print(e)
+    return mosaic
+
+
+# Copying is bound by the disks, so copy several mosaics at once to keep them busy
+with ThreadPoolExecutor(max_workers=8) as executor:
+    for mosaic in executor.map(copy_mosaic, mosaic_names):
+        print(f"Copied: {mosaic}")
@@ -1,49 +1,26 @@
-import os
-
-import numpy as np
-
 from lofarnn.data.datasets import create_source_dataset
+from lofarnn.models.dataloaders.utils import get_lotss_objects
 
 # from lofarnn.data.datasets import create_source_dataset
 from lofarnn.utils.cnn import create_cnn_dataset
+from lofarnn.config import SIZE_DEG, get_env_config
 
-try:
-    environment = os.environ["LOFARNN_ARCH"]
-except:
-    os.environ["LOFARNN_ARCH"] = "XPS"
-    environment = os.environ["LOFARNN_ARCH"]
-
-if environment == "ALICE":
-    dr_two = (
-        "/home/s2153246/data/data/LoTSS_DR2/lofar-surveys.org/downloads/DR2/mosaics/"
-    )
-    vac = "/home/s2153246/data/catalogues/LOFAR_HBA_T1_DR1_merge_ID_optical_f_v1.2_restframe.fits"
-    comp_cat = "/home/s2153246/data/catalogues/LOFAR_HBA_T1_DR1_merge_ID_v1.2.comp.fits"
-    cutout_directory = "/home/s2153246/data/processed/fixed_lgz_cnn_final/"
-    pan_wise_location = "/home/s2153246/data/dr2_combined.fits"
-    multi_process = True
-else:
-    pan_wise_location = "/home/jacob/combined_panstarr_allwise_flux.fits"
-    dr_two = "/run/media/jacob/SSD_Backup/mosaics/"
-    comp_cat = "/run/media/jacob/SSD_Backup/LOFAR_HBA_T1_DR1_merge_ID_v1.2.comp.fits"
-    vac = "/run/media/jacob/SSD_Backup/LOFAR_HBA_T1_DR1_merge_ID_optical_f_v1.2_restframe.fits"
-    cutout_directory = "/run/media/jacob/T7/fixed_sqrt_flux"
-    multi_process = True
-
+paths = get_env_config()
+# Load the VAC once for all the steps
+vac = get_lotss_objects(paths.vac)
 rotation = 0
-size = (300.0 / 3600.0) * np.sqrt(2)
-print(size)
+print(SIZE_DEG)
 
 create_source_dataset(
-    cutout_directory=cutout_directory,
-    pan_wise_location=pan_wise_location,
+    cutout_directory=paths.cutout_directory,
+    pan_wise_location=paths.pan_wise_location,
     value_added_catalog_location=vac,
-    dr_two_location=dr_two,
-    component_catalog_location=comp_cat,
-    use_multiprocessing=multi_process,
+    dr_two_location=paths.dr_two,
+    component_catalog_location=paths.comp_cat,
+    use_multiprocessing=paths.multi_process,
     all_channels=True,
     filter_lgz=False,
-    fixed_size=size,
+    fixed_size=SIZE_DEG,
     no_source=True,
     filter_optical=False,
     strict_filter=False,
@@ -52,25 +29,13 @@ create_source_dataset(
 )
 
 create_cnn_dataset(
-    root_directory=cutout_directory,
-    counterpart_catalog=pan_wise_location,
-    rotation=rotation,
-    convert=False,
-    all_channels=True,
-    vac_catalog=vac,
-    normalize=True,
-    segmentation=False,
-    multi_rotate_only=vac,
-    resize=None,
-)
-create_cnn_dataset(
-    root_directory=cutout_directory,
-    counterpart_catalog=pan_wise_location,
+    root_directory=paths.cutout_directory,
+    counterpart_catalog=paths.pan_wise_location,
     rotation=rotation,
     convert=False,
     all_channels=True,
     vac_catalog=vac,
-    normalize=False,
+    normalize=[True, False],
     segmentation=False,
     multi_rotate_only=vac,
     resize=None,
@@ -11,7 +11,13 @@ from lofarnn.models.base.cnn import (
     RadioSingleSourceModel,
     RadioMultiSourceModel,
 )
-from lofarnn.models.base.utils import default_argument_parser, setup, test, train
+from lofarnn.models.base.utils import (
+    default_argument_parser,
+    loader_worker_init,
+    setup,
+    test,
+    train,
+)
 from torch.optim.lr_scheduler import ReduceLROnPlateau, CyclicLR
 from torch.utils.data import dataset, dataloader
 import torch
@@ -36,8 +42,9 @@ def main(gpu, args):
         "gamma": 2,
         "alpha_1": 0.12835728,
     }
+    config["alpha_2"] = 1.0 - config["alpha_1"]
 
-    train_dataset, train_test_dataset, val_dataset = setup(args)
+    train_dataset, train_test_dataset, val_dataset, _ = setup(args)
 
     if config["single"]:
         model = RadioSingleSourceModel(1, 12, config=config)
@@ -56,6 +63,8 @@ def main(gpu, args):
         )
     else:
         scheduler = None
+    # Every GPU runs its own loaders, so split the CPUs between the GPUs, and the training loader gets most of them
+    num_workers = max(2, os.cpu_count() // args.gpus // 3)
     train_sampler = torch.utils.data.distributed.DistributedSampler(
         train_dataset, num_replicas=args.world_size, rank=rank
     )
@@ -63,11 +72,14 @@ def main(gpu, args):
         train_dataset,
         batch_size=args.batch,
         shuffle=False,
-        num_workers=os.cpu_count(),
+        num_workers=num_workers,
         pin_memory=True,
         collate_fn=collate_variable_fn,
         drop_last=True,
         sampler=train_sampler,
+        persistent_workers=True,
+        prefetch_factor=4,
+        worker_init_fn=loader_worker_init,
     )
     train_test_sampler = torch.utils.data.distributed.DistributedSampler(
         train_test_dataset, num_replicas=args.world_size, rank=rank
@@ -76,9 +88,11 @@ def main(gpu, args):
         train_test_dataset,
         batch_size=1,
         shuffle=False,
-        num_workers=os.cpu_count(),
+        num_workers=2,
         pin_memory=True,
         sampler=train_test_sampler,
+        persistent_workers=True,
+        worker_init_fn=loader_worker_init,
     )
     test_sampler = torch.utils.data.distributed.DistributedSampler(
         val_dataset, num_replicas=args.world_size, rank=rank
@@ -87,9 +101,11 @@ def main(gpu, args):
         val_dataset,
         batch_size=1,
         shuffle=False,
-        num_workers=os.cpu_count(),
+        num_workers=2,
         pin_memory=True,
         sampler=test_sampler,
+        persistent_workers=True,
+        worker_init_fn=loader_worker_init,
     )
     experiment_name = (
         args.experiment
@@ -101,15 +117,37 @@ def main(gpu, args):
         output_dir = os.path.join("/home/s2153246/data/", "reports", experiment_name)
     os.makedirs(output_dir, exist_ok=True)
 
+    model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(model)
     model.cuda(gpu)
-    model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[gpu])
+    model = torch.nn.parallel.DistributedDataParallel(
+        model, device_ids=[gpu], find_unused_parameters=False
+    )
+    scaler = torch.cuda.amp.GradScaler()
     print("Model created")
     for epoch in range(args.epochs):
         train(
-            args, model, train_loader, optimizer, scheduler, epoch, output_dir, config
+            args,
+            model,
+            gpu,
+            train_loader,
+            optimizer,
+            scheduler,
+            epoch,
+            output_dir,
+            config,
+            scaler=scaler,
+        )
+        test(
+            args,
+            model,
+            gpu,
+            train_test_loader,
+            epoch,
+            "Train_test",
+            output_dir,
+            config,
         )
-        test(args, model, train_test_loader, epoch, "Train_test", output_dir, config)
-        test(args, model, test_loader, epoch, "Test", output_dir, config)
+        test(args, model, gpu, test_loader, epoch, "Test", output_dir, config)
 
 
 if __name__ == "__main__":
@@ -1,7 +1,6 @@
-from detectron2.utils.logger import setup_logger
-
-setup_logger()
 import os
+
+from detectron2.utils.logger import setup_logger
 import numpy as np
 from lofarnn.models.dataloaders.utils import get_lofar_dicts, get_only_mutli_dicts
 
@@ -188,6 +187,9 @@ def main(args):
 
 
 if __name__ == "__main__":
+    # Only set up the logger in the launching process, the processes spawned by launch re-import this module, and
+    # default_setup sets up the logger of each of them
+    setup_logger()
     args = default_argument_parser().parse_args()
     print("Command Line Args:", args)
     launch(
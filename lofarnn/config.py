@@ -0,0 +1,100 @@
+"""
+Locations of the data on the machines the datasets are made on, chosen with the LOFARNN_ARCH environment variable,
+and constants shared by the dataset scripts
+"""
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+# Fixed cutout size in degrees, 300 arcseconds times sqrt(2), so every rotation of the cutout stays filled
+SIZE_DEG = 300.0 / 3600.0 * 1.4142135623730951
+
+
+@dataclass(frozen=True)
+class Paths:
+    """
+    Locations of the catalogues, mosaics, and output of a machine
+    """
+
+    dr_two: str
+    vac: str
+    comp_cat: str
+    pan_wise_location: str
+    cutout_directory: str
+    multi_process: bool = True
+
+
+ENVIRONMENT_PATHS = {
+    "ALICE": Paths(
+        dr_two="/home/s2153246/data/data/LoTSS_DR2/lofar-surveys.org/downloads/DR2/mosaics/",
+        vac="/home/s2153246/data/catalogues/LOFAR_HBA_T1_DR1_merge_ID_optical_f_v1.2_restframe.fits",
+        comp_cat="/home/s2153246/data/catalogues/LOFAR_HBA_T1_DR1_merge_ID_v1.2.comp.fits",
+        pan_wise_location="/home/s2153246/data/dr2_combined.fits",
+        cutout_directory="/home/s2153246/data/processed/fixed_lgz_cnn_final/",
+    ),
+    "XPS": Paths(
+        dr_two="/run/media/jacob/SSD_Backup/mosaics/",
+        vac="/run/media/jacob/SSD_Backup/LOFAR_HBA_T1_DR1_merge_ID_optical_f_v1.2_restframe.fits",
+        comp_cat="/run/media/jacob/SSD_Backup/LOFAR_HBA_T1_DR1_merge_ID_v1.2.comp.fits",
+        pan_wise_location="/home/jacob/combined_panstarr_allwise_flux.fits",
+        cutout_directory="/run/media/jacob/T7/fixed_sqrt_flux",
+    ),
+}
+
+
+# Locations for the datasets whose scripts use other catalogues or outputs than ENVIRONMENT_PATHS
+DATASET_PATHS = {
+    "variable_source": {
+        "ALICE": Paths(
+            dr_two=ENVIRONMENT_PATHS["ALICE"].dr_two,
+            vac=ENVIRONMENT_PATHS["ALICE"].vac,
+            comp_cat=ENVIRONMENT_PATHS["ALICE"].comp_cat,
+            pan_wise_location="/home/s2153246/data/catalogues/pan_allwise.fits",
+            cutout_directory="/home/s2153246/data/processed/variable_lgz_rotated/",
+        ),
+        "XPS": Paths(
+            dr_two="/mnt/LargeSSD/mosaics/",
+            vac="/mnt/LargeSSD/LOFAR_HBA_T1_DR1_merge_ID_optical_f_v1.2_restframe.fits",
+            comp_cat="/mnt/LargeSSD/LOFAR_HBA_T1_DR1_merge_ID_v1.2.comp.fits",
+            pan_wise_location="/mnt/LargeSSD/hetdex_ps1_allwise_photoz_v0.6.fits",
+            cutout_directory="/mnt/HDD/fixed_lgz_rotated/",
+        ),
+    },
+    "cnn": {
+        "ALICE": Paths(
+            dr_two=ENVIRONMENT_PATHS["ALICE"].dr_two,
+            vac=ENVIRONMENT_PATHS["ALICE"].vac,
+            comp_cat=ENVIRONMENT_PATHS["ALICE"].comp_cat,
+            pan_wise_location="/home/s2153246/data/combined_panstarr_allwise.fits",
+            cutout_directory=ENVIRONMENT_PATHS["ALICE"].cutout_directory,
+        ),
+        "XPS": Paths(
+            dr_two="/data/Research/LOFAR/mosaics/",
+            vac="/data/Research/LOFAR/LOFAR_HBA_T1_DR1_merge_ID_optical_f_v1.2b_restframe.fits",
+            comp_cat="/data/Research/LOFAR/LOFAR_HBA_T1_DR1_merge_ID_v1.2.comp.fits",
+            pan_wise_location="/data/Research/LOFAR/combined_panstarr_allwise_flux.fits",
+            cutout_directory="/data/Research/LoTSS_DR1_Cleaned/",
+            multi_process=False,
+        ),
+    },
+}
+
+
+@lru_cache()
+def get_environment() -> str:
+    """
+    Get the machine being run on from LOFARNN_ARCH, defaulting to XPS if it is not set
+    """
+    return os.environ.get("LOFARNN_ARCH", "XPS")
+
+
+@lru_cache()
+def get_env_config(dataset: Optional[str] = None) -> Paths:
+    """
+    Get the data locations for the machine being run on
+    :param dataset: Name of a dataset in DATASET_PATHS with its own locations, the ENVIRONMENT_PATHS ones if not given
+    """
+    if dataset is None:
+        return ENVIRONMENT_PATHS[get_environment()]
+    return DATASET_PATHS[dataset][get_environment()]
@@ -1,8 +1,10 @@
+import os
+from functools import lru_cache
 from typing import Union, Optional, List, Tuple, Any
 
-import imgaug as ia
-import imgaug.augmenters as iaa
-import matplotlib.pyplot as plt
+import cv2
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
 from astropy.coordinates import SkyCoord
 from astropy.modeling import models
@@ -14,7 +16,7 @@ from astropy.visualization import (
 )
 from astropy.visualization import PercentileInterval
 from astropy.wcs.utils import skycoord_to_pixel
-from imgaug.augmentables.bbs import BoundingBox, BoundingBoxesOnImage
+from scipy.spatial import cKDTree
 from skimage.transform import rotate
 from astropy.nddata import Cutout2D
 from astropy.wcs import WCS
@@ -99,6 +101,55 @@ def make_bounding_box(
     return xmin, ymin, xmax, ymax, source_location[4], source_location[5]
 
 
+@lru_cache(maxsize=128)
+def _rotation_matrix(
+    height: int, width: int, angle: float, center_shift: float
+) -> np.ndarray:
+    """
+    Affine matrix rotating by angle degrees clockwise around the center, the same as imgaug's Affine
+    :param center_shift: 0.5 for the pixel grid of the image, 0 for the continuous coordinates of the boxes
+    """
+    matrix = cv2.getRotationMatrix2D(
+        (width / 2.0 - center_shift, height / 2.0 - center_shift), -angle, 1.0
+    )
+    matrix.setflags(write=False)
+    return matrix
+
+
+def _transform_boxes(
+    boxes: np.ndarray, matrix: np.ndarray, height: int, width: int
+) -> np.ndarray:
+    """
+    Transform (x1, y1, x2, y2) boxes by the affine matrix, taking the box enclosing the transformed corners, then
+    remove the boxes fully out of the image and clip the rest to it, the same as imgaug does
+    """
+    if len(boxes) == 0:
+        return np.zeros((0, 4))
+    x1, y1, x2, y2 = boxes.T
+    corners = np.stack(
+        [
+            np.stack([x1, y1], axis=-1),
+            np.stack([x2, y1], axis=-1),
+            np.stack([x2, y2], axis=-1),
+            np.stack([x1, y2], axis=-1),
+        ],
+        axis=1,
+    )
+    corners = corners @ matrix[:, :2].T + matrix[:, 2]
+    boxes = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+    eps = np.finfo(np.float32).eps
+    keep = (
+        (boxes[:, 0] <= width - eps)
+        & (boxes[:, 2] >= 0)
+        & (boxes[:, 1] <= height - eps)
+        & (boxes[:, 3] >= 0)
+    )
+    boxes = boxes[keep]
+    boxes[:, [0, 2]] = np.clip(boxes[:, [0, 2]], 0, width - eps)
+    boxes[:, [1, 3]] = np.clip(boxes[:, [1, 3]], 0, height - eps)
+    return boxes
+
+
 def augment_image_and_bboxes(
     image: np.ndarray,
     cutouts: Union[List[Tuple[float]], np.ndarray, None],
@@ -107,76 +158,84 @@ def augment_image_and_bboxes(
     new_size: Optional[Union[int, Tuple[int]]],
     verbose: bool = False,
 ) -> Tuple[Any, Union[List[Tuple[float]], np.ndarray], np.ndarray]:
-    bounding_boxes = []
-    prop_boxes = []
-    seg_boxes = []
+    """
+    Rotate the image and its boxes around the center, then resize them
+
+    Rotating uses cv2.warpAffine with bilinear interpolation and zeros outside the image, and the boxes are converted
+    from the (y1, x1, y2, x2) pixel indices in the cutouts to (x1, y1, x2, y2) coordinates
+    :param image: Image with the spatial dimensions first, it is rotated as float32
+    :param cutouts: Source bounding boxes, these are updated in place
+    :param proposal_boxes: Proposal bounding boxes
+    :param angle: Angle to rotate by, in degrees clockwise
+    :param new_size: Size to resize to, currently always the size of the image
+    :return: The rotated image, the source boxes, and the proposal boxes
+    """
+    # cv2 can't warp float16, which the cutouts can be saved as
+    image = np.asarray(image, dtype=np.float32)
     new_size = image.shape[0]
-    new_crop = int(
-        np.ceil(image.shape[0])
-    )  # Is 200 for 282, which is what is wanted, and works for others
-    seq = iaa.Sequential(
-        [
-            iaa.Affine(rotate=angle),
-            iaa.CropToFixedSize(width=new_crop, height=new_crop, position="center"),
-        ]
-    )
-    for cutout in cutouts:
-        bounding_boxes.append(
-            BoundingBox(
-                cutout[1] + 0.5, cutout[0] + 0.5, cutout[3] + 0.5, cutout[2] + 0.5
-            )
+    height, width = image.shape[:2]
+    # Boxes are stored as (y1, x1, y2, x2) pixel indices, the centers of the pixels are at +0.5
+    bounding_boxes = np.zeros((0, 4))
+    if cutouts is not None and len(cutouts) > 0:
+        bounding_boxes = (
+            np.asarray([cutout[:4] for cutout in cutouts], dtype=float)[:, [1, 0, 3, 2]]
+            + 0.5
         )
-    for pbox in proposal_boxes:
-        prop_boxes.append(
-            BoundingBox(pbox[1] + 0.5, pbox[0] + 0.5, pbox[3] + 0.5, pbox[2] + 0.5)
+    prop_boxes = np.zeros((0, 4))
+    if proposal_boxes is not None and len(proposal_boxes) > 0:
+        prop_boxes = (
+            np.asarray([pbox[:4] for pbox in proposal_boxes], dtype=float)[
+                :, [1, 0, 3, 2]
+            ]
+            + 0.5
         )
-
-    bbs = BoundingBoxesOnImage(bounding_boxes, shape=image.shape)
-    pbbs = BoundingBoxesOnImage(prop_boxes, shape=image.shape)
-    if seg_boxes:
-        sbbs = BoundingBoxesOnImage(seg_boxes, shape=image.shape)
-        _, sbbs = seq(image=image, bounding_boxes=sbbs)
-    _, bbs = seq(image=image, bounding_boxes=bbs)
-    image, pbbs = seq(image=image, bounding_boxes=pbbs)
+    # Make sure that x1 <= x2 and y1 <= y2
+    bounding_boxes = np.concatenate(
+        [
+            np.minimum(bounding_boxes[:, :2], bounding_boxes[:, 2:]),
+            np.maximum(bounding_boxes[:, :2], bounding_boxes[:, 2:]),
+        ],
+        axis=1,
+    )
+    prop_boxes = np.concatenate(
+        [
+            np.minimum(prop_boxes[:, :2], prop_boxes[:, 2:]),
+            np.maximum(prop_boxes[:, :2], prop_boxes[:, 2:]),
+        ],
+        axis=1,
+    )
+    if angle:
+        image = cv2.warpAffine(
+            image,
+            _rotation_matrix(height, width, float(angle), 0.5),
+            (width, height),
+            flags=cv2.INTER_LINEAR,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=0,
+        ).reshape(image.shape)
+    box_matrix = _rotation_matrix(height, width, float(angle or 0), 0.0)
     # Rescale image and bounding boxes
-    if type(new_size) == int:
-        image_rescaled = ia.imresize_single_image(image, (new_size, new_size))
-    else:
-        image_rescaled = ia.imresize_single_image(
-            image, (image.shape[0], image.shape[1])
-        )
-    bbs_rescaled = bbs.on(image_rescaled)
-    pbbs_rescaled = pbbs.on(image_rescaled)
-    if seg_boxes:
-        sbbs_rescaled = sbbs.on(image_rescaled)
-        sbbs_rescaled = sbbs_rescaled.remove_out_of_image(
-            partly=False
-        ).clip_out_of_image()
-
-    # Remove bounding boxes that go out of bounds
-    pbbs_rescaled = pbbs_rescaled.remove_out_of_image(partly=False).clip_out_of_image()
-    # But only clip source bounding boxes that are partly out of frame, so that no sources are lost
-    bbs_rescaled = bbs_rescaled.remove_out_of_image(partly=False).clip_out_of_image()
-    # Also remove those and clip of segmentation maps
-    for index, bbox in enumerate(bbs_rescaled):
-        cutouts[index][0] = bbox.x1
-        cutouts[index][1] = bbox.y1
-        cutouts[index][2] = bbox.x2
-        cutouts[index][3] = bbox.y2
+    if (new_size, new_size) != (height, width):
+        image = cv2.resize(
+            image,
+            (new_size, new_size),
+            interpolation=cv2.INTER_AREA if new_size < height else cv2.INTER_CUBIC,
+        ).reshape((new_size, new_size) + image.shape[2:])
+        scale = np.array([new_size / width, new_size / height])[:, None]
+        box_matrix = box_matrix * scale
+        height, width = new_size, new_size
+    # Remove bounding boxes that go out of bounds, and clip those partly out of frame, so that no sources are lost
+    bounding_boxes = _transform_boxes(bounding_boxes, box_matrix, height, width)
+    pbs = _transform_boxes(prop_boxes, box_matrix, height, width)
+    for index, bbox in enumerate(bounding_boxes):
+        cutouts[index][0] = bbox[0]
+        cutouts[index][1] = bbox[1]
+        cutouts[index][2] = bbox[2]
+        cutouts[index][3] = bbox[3]
     # Convert proposal boxes as well
-    pbs = []
-    for index, bbox in enumerate(pbbs_rescaled):
-        pbs.append(np.asarray((bbox.x1, bbox.y1, bbox.x2, bbox.y2)))
-    pbs = np.asarray(pbs)
-    sbs = []
-    try:
-        for index, bbox in enumerate(sbbs_rescaled):
-            sbs.append(np.asarray((bbox.x1, bbox.y1, bbox.x2, bbox.y2)))
-    except:
-        if verbose:
-            print("Empty sbbs_rescaled")
-    sbs = np.asarray(sbs)
-    return image_rescaled, cutouts, pbs
+    if len(pbs) == 0:
+        pbs = np.asarray([])
+    return image, cutouts, pbs
 
 
 def FWHM_to_sigma_for_gaussian(fwhm):
@@ -221,13 +280,29 @@ def extract_gaussian_parameters_from_component_catalogue(
     return gaussians
 
 
+def _gaussian_stamp(gaussian, shape):
+    """
+    Part of the image that a Gaussian is evaluated on, its 5.5 sigma bounding box clipped to the image, or the whole
+    image if its bounding box isn't finite
+    """
+    (y_low, y_high), (x_low, x_high) = gaussian.bounding_box.bounding_box()
+    if not np.all(np.isfinite([y_low, y_high, x_low, x_high])):
+        return np.s_[:, :]
+    y_low, x_low = np.clip([np.floor(y_low), np.floor(x_low)], 0, shape).astype(int)
+    high = np.ceil([y_high, x_high]) + 1
+    y_high, x_high = np.clip(high, 0, shape).astype(int)
+    return np.s_[y_low:y_high, x_low:x_high]
+
+
 def subtract_gaussians_from_data(gaussians, astropy_cutout):
     # Create indices
     yi, xi = np.indices(astropy_cutout.shape)
 
     model = np.zeros(astropy_cutout.shape)
     for g in gaussians:
-        model += g(xi, yi)
+        # Each Gaussian only adds to the stamp around it, not the whole cutout
+        stamp = _gaussian_stamp(g, model.shape)
+        model[stamp] += g(xi[stamp], yi[stamp])
     residual = astropy_cutout - model
     return model, residual
 
@@ -243,6 +318,29 @@ for s,idx in zip(gauss_cat['Source_Name'].values, gauss_cat.index):
 """
 
 
+@lru_cache(maxsize=1)
+def _residual_figure() -> Tuple[Figure, np.ndarray]:
+    """
+    Figure for the residual plots, made once and reused for every source, and drawn straight with Agg, not pyplot
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig, fig.subplots(1, 3)
+
+
+@lru_cache(maxsize=2)
+def _load_gaussian_catalogue(gauss_catalog: str, mtime: float) -> Tuple[Any, dict]:
+    """
+    Load the Gaussian component catalogue as a DataFrame, and the Source Name to Gaussian indicies dict, once per file
+    The modification time is part of the key so a changed catalogue is read again
+    """
+    gauss_cat = Table.read(gauss_catalog).to_pandas()
+    gauss_dict = {}
+    for s, idx in zip(gauss_cat["Source_Name"].values, gauss_cat.index):
+        gauss_dict.setdefault(str(s, "utf-8"), []).append(idx)
+    return gauss_cat, gauss_dict
+
+
 def remove_unresolved_sources_from_view(
     source_name: str,
     min_ra: float,
@@ -252,28 +350,38 @@ def remove_unresolved_sources_from_view(
     image: np.ndarray,
     wcs: WCS,
     gauss_catalog: str,
-    component_catalog: Table,
+    component_catalog: Union[Table, Any],
     debug: bool = False,
+    component_tree: Optional[cKDTree] = None,
 ):
     """Given a path to a fits file and the corresponding cutout object,
     for all sources in the cutout object marked as unresolved we will find
     the constituent gaussian components and subtract those from the fits image.
-    Finally we write the image back to the fits file."""
+    Finally we write the image back to the fits file.
+    The component catalogue can be given as a Table, or already converted to a pandas DataFrame, and
+    component_tree, a cKDTree of its (RA, DEC), can be given to only check the components near the view"""
 
     relevant_idxs = []
 
-    # Load gaussian component cat
-    gauss_cat = Table.read(gauss_catalog).to_pandas()
-    component_catalog = component_catalog.to_pandas()
-    # Turn Gauss cat into dict
-    gauss_dict = {str(s, "utf-8"): [] for s in gauss_cat["Source_Name"].values}
-    for s, idx in zip(gauss_cat["Source_Name"].values, gauss_cat.index):
-        gauss_dict[str(s, "utf-8")].append(idx)
+    # Load gaussian component cat, and turn it into a dict, only the first time it is used
+    gauss_cat, gauss_dict = _load_gaussian_catalogue(
+        gauss_catalog, os.path.getmtime(gauss_catalog)
+    )
+    if isinstance(component_catalog, Table):
+        component_catalog = component_catalog.to_pandas()
     # print(gauss_dict)
     # For each unresolved source
     # UNnresolved source is from a special cutout lofarnn_things stuff, have to change for here
     # Mostly need to change input, take all those that have the same Source Name areas, and keep those, subtract out
     # All others in cutout that don't have the same Source Name as the source
+    if component_tree is not None:
+        # Square search around the center that covers the view, then cut to the view exactly
+        near = component_tree.query_ball_point(
+            [(min_ra + max_ra) / 2, (min_dec + max_dec) / 2],
+            r=max(max_ra - min_ra, max_dec - min_dec) / 2 + 1e-9,
+            p=np.inf,
+        )
+        component_catalog = component_catalog.iloc[np.sort(np.asarray(near, dtype=int))]
     box_dim = (
             (component_catalog["RA"] >= min_ra)
             & (component_catalog["RA"] <= max_ra)
@@ -281,7 +389,8 @@ def remove_unresolved_sources_from_view(
             & (component_catalog["DEC"] <= max_dec)
     )
     component_cat = component_catalog[box_dim]
-    print(f"Source: {source_name} {str.encode(source_name)}")
+    if debug:
+        print(f"Source: {source_name} {str.encode(source_name)}")
     #print(f"Compcat: {compcat_subset.Source_Name}")
     comp_non_sources = component_cat[
         component_cat.Source_Name != source_name
@@ -289,12 +398,14 @@ def remove_unresolved_sources_from_view(
     comp_sources = component_cat[
         component_cat.Source_Name == source_name
         ]
-    print(f"Component Sources: {len(comp_sources)}")
-    print(f"Component Non Sources: {len(comp_non_sources)}")
+    if debug:
+        print(f"Component Sources: {len(comp_sources)}")
+        print(f"Component Non Sources: {len(comp_non_sources)}")
     if len(comp_non_sources) >= 1:
         for unresolved_source in comp_non_sources["Component_Name"]:
             # Get relevant catalogue entries
-            print(unresolved_source)
+            if debug:
+                print(unresolved_source)
             try:
                 relevant_idxs.append(gauss_dict[unresolved_source])
             except KeyError:
@@ -317,13 +428,13 @@ def remove_unresolved_sources_from_view(
             norm = ImageNormalize(
                 image, interval=PercentileInterval(99.0), stretch=SqrtStretch()
             )
-            fig, ax = plt.subplots(1, 3)
+            fig, ax = _residual_figure()
+            for a in ax:
+                a.clear()
             ax[0].imshow(image, norm=norm)
             ax[1].imshow(residual, norm=norm)
             ax[2].imshow(model, norm=norm)
-            plt.savefig(f"{source_name}.png", dpi=300)
-            plt.cla()
-            plt.clf()
+            fig.savefig(f"{source_name}.png", dpi=300)
     else:
         residual = image
     return residual, image
@@ -353,21 +464,39 @@ def get_zoomed_image(
     img_center_h = int(image.shape[0] / 2)
     img_center_w = int(image.shape[1] / 2)
 
+    # Summed area table, with a leading row and column of zeros, so the flux in each square is four lookups
+    # instead of summing the whole square again every time it grows
+    summed_area = np.zeros((image.shape[0] + 1, image.shape[1] + 1))
+    np.cumsum(
+        np.cumsum(np.nan_to_num(image, nan=0.0), axis=0, dtype=np.float64),
+        axis=1,
+        out=summed_area[1:, 1:],
+    )
+
     current_flux = -100
     central_size = 15
-    print(threshold)
     # Convert threshold from mJy to Jy, same as image
     while current_flux <= threshold:
-        print(f"Current Flux: {current_flux} <= {threshold}")
         central_size += 1
         if img_center_w - central_size < 0:
             # Too large, not have all the flux, so just return the original image, not the residual
             return image, wcs, None, None, rms_img
-        center = image[
-            img_center_h - central_size : img_center_h + central_size,
-            img_center_w - central_size : img_center_w + central_size,
+        # Same rows and columns as slicing image[h - size : h + size, w - size : w + size]
+        rows = range(image.shape[0])[
+            img_center_h - central_size : img_center_h + central_size
+        ]
+        cols = range(image.shape[1])[
+            img_center_w - central_size : img_center_w + central_size
         ]
-        current_flux = np.nansum(center)
+        if len(rows) == 0 or len(cols) == 0:
+            current_flux = 0.0
+        else:
+            current_flux = (
+                summed_area[rows.stop, cols.stop]
+                - summed_area[rows.start, cols.stop]
+                - summed_area[rows.stop, cols.start]
+                + summed_area[rows.start, cols.start]
+            )
 
     cutout = Cutout2D(
         image,
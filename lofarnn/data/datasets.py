@@ -1,20 +1,33 @@
 import multiprocessing
 import os
-from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
 from typing import List, Union, Optional, Tuple
 
 import numpy as np
-from astropy.coordinates import SkyCoord
-from astropy.io import fits
+import pandas as pd
 from astropy.table import Table
 from astropy.wcs import WCS
 from astropy.wcs.utils import proj_plane_pixel_scales
-from astropy.wcs.utils import skycoord_to_pixel
 import astropy.units as u
+from scipy.spatial import cKDTree
 
 from lofarnn.models.dataloaders.utils import get_lotss_objects
-from lofarnn.utils.common import create_coco_style_directory_structure
-from lofarnn.utils.fits import extract_subimage, determine_visible_catalogue_sources
+from lofarnn.utils.common import create_coco_style_directory_structure, save_cutout
+from lofarnn.utils.kernels import NUMBA_AVAILABLE, scatter_layer
+from lofarnn.utils.fits import (
+    extract_subimage,
+    catalogue_footprint,
+    sort_catalogue_by_dec,
+    cutout_wcs,
+    open_mosaic,
+    build_catalogue_tree,
+    determine_visible_catalogue_indices,
+    load_fits_table,
+    open_catalogue,
+    share_table,
+    attach_shared_table,
+)
 from lofarnn.visualization.cutouts import plot_three_channel_debug
 from lofarnn.data.cutouts import (
     remove_unresolved_sources_from_view,
@@ -68,6 +81,8 @@ def make_catalogue_layer(
     shape: Union[Tuple[int], int],
     catalogue: Table,
     verbose: bool = False,
+    coords: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+    out: Optional[np.ndarray] = None,
 ):
     """
     Create a layer based off the data in
@@ -75,61 +90,103 @@ def make_catalogue_layer(
     :param shape: Shape of the image data
     :param wcs: WCS of the Radio data, so catalog data can be translated correctly
     :param catalogue: Catalogue to query
+    :param coords: Pixel coordinates of the catalogue sources, computed from the catalogue if not given
+    :param out: Array of the shape of the image to write the layer into, such as a channel of the cutout, instead of
+    allocating a new one
     :return: A Numpy array that holds the information in the correct location
     """
 
-    ra_array = np.array(catalogue["ra"], dtype=float)
-    dec_array = np.array(catalogue["dec"], dtype=float)
-    sky_coords = SkyCoord(ra_array, dec_array, unit="deg")
-
     # Now have the objects, need to convert those RA and Decs to pixel coordinates
-    layer = np.zeros(shape=shape)
-    coords = skycoord_to_pixel(sky_coords, wcs, 0)
-    for index, x in enumerate(coords[0]):
-        try:
-            if (
-                ~np.isnan(catalogue[index][column_name])
-                and catalogue[index][column_name] > 0.0
-            ):  # Make sure not putting in NaNs
-                layer[int(np.floor(coords[0][index]))][
-                    int(np.floor(coords[1][index]))
-                ] = catalogue[index][column_name]
-        except Exception as e:
-            if verbose:
-                print(f"Failed: {e}")
+    if out is None:
+        layer = np.zeros(shape=shape)
+    else:
+        layer = out
+        layer[...] = 0
+    if coords is None:
+        coords = catalogue_to_pixel(wcs, catalogue)
+    values = np.asarray(catalogue[column_name], dtype=float)
+    x = np.asarray(coords[0], dtype=float)
+    y = np.asarray(coords[1], dtype=float)
+    if NUMBA_AVAILABLE and layer.dtype in (np.float32, np.float64):
+        written = scatter_layer(x, y, values, layer)
+        if verbose and written < len(values):
+            print(f"Skipped {len(values) - written} sources for {column_name}")
+        return layer
+    # Make sure not putting in NaNs, or sources that fall outside the layer
+    in_layer = np.isfinite(values) & (values > 0.0) & np.isfinite(x) & np.isfinite(y)
+    x_index = np.floor(np.where(in_layer, x, 0)).astype(np.intp)
+    y_index = np.floor(np.where(in_layer, y, 0)).astype(np.intp)
+    in_layer &= (x_index >= 0) & (x_index < layer.shape[0])
+    in_layer &= (y_index >= 0) & (y_index < layer.shape[1])
+    if verbose and not np.all(in_layer):
+        print(f"Skipped {np.count_nonzero(~in_layer)} sources for {column_name}")
+    layer[x_index[in_layer], y_index[in_layer]] = values[in_layer]
     return layer
 
 
-def make_proposal_boxes(wcs: WCS, catalogue: Table):
+def make_proposal_boxes(
+    wcs: WCS,
+    catalogue: Table,
+    coords: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+):
     """
     Create Faster RCNN proposal boxes for all sources in the image
 
     The sky_coords seems to be swapped x and y on the boxes, so should be swapped here too
     :param wcs: WCS of the Radio data, so catalog data can be translated correctly
     :param catalogue: Catalogue to query
+    :param coords: Pixel coordinates of the catalogue sources, computed from the catalogue if not given
     :return: A Numpy array that holds the information in the correct location
     """
 
-    ra_array = np.array(catalogue["ra"], dtype=float)
-    dec_array = np.array(catalogue["dec"], dtype=float)
-    sky_coords = SkyCoord(ra_array, dec_array, unit="deg")
-
     # Now have the objects, need to convert those RA and Decs to pixel coordinates
-    proposals = []
-    coords = skycoord_to_pixel(sky_coords, wcs, 0)
-    for index, x in enumerate(coords[0]):
-        try:
-            proposals.append(
-                make_bounding_box(
-                    ra_array[index],
-                    dec_array[index],
-                    wcs=wcs,
-                    class_name="Proposal Box",
-                )
-            )
-        except Exception as e:
-            print(f"Failed Proposal: {e}")
-    return proposals
+    if coords is None:
+        coords = catalogue_to_pixel(wcs, catalogue)
+    x = np.asarray(coords[0], dtype=float)
+    y = np.asarray(coords[1], dtype=float)
+    # Same boxes as make_bounding_box, but from the one transform of all the sources, not a transform per source
+    xmins = np.floor(x) - 0.5
+    ymins = np.floor(y) - 0.5
+    # One mask for the sources that fell off the projection, instead of testing each one
+    valid = np.isfinite(xmins) & np.isfinite(ymins)
+    for index in np.flatnonzero(~valid):
+        print(f"Failed Proposal: {catalogue['ra'][index]}, {catalogue['dec'][index]}")
+    return [
+        (xmin, ymin, xmin + 1, ymin + 1, "Proposal Box", (x_center, y_center))
+        for xmin, ymin, x_center, y_center in zip(
+            xmins[valid].tolist(),
+            ymins[valid].tolist(),
+            x[valid].tolist(),
+            y[valid].tolist(),
+        )
+    ]
+
+
+def catalogue_to_pixel(
+    wcs: WCS,
+    catalogue: Table = None,
+    ra_array: Optional[np.ndarray] = None,
+    dec_array: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Convert the RA and Decs of catalogue sources to pixel coordinates in one transform
+    :param wcs: WCS of the Radio data, so catalog data can be translated correctly
+    :param catalogue: Catalogue to convert, only used if ra_array and dec_array are not given
+    :param ra_array: RA of the sources in degrees
+    :param dec_array: DEC of the sources in degrees
+    :return: x and y pixel coordinates of the sources
+    """
+    if ra_array is None or dec_array is None:
+        ra_array = np.array(catalogue["ra"], dtype=float)
+        dec_array = np.array(catalogue["dec"], dtype=float)
+    # Straight through the WCS, without building SkyCoord frames for every call
+    pixels = wcs.wcs_world2pix(
+        np.column_stack(
+            [np.asarray(ra_array, dtype=float), np.asarray(dec_array, dtype=float)]
+        ),
+        0,
+    )
+    return pixels[:, 0], pixels[:, 1]
 
 
 def make_bounding_box(
@@ -146,22 +203,49 @@ def make_bounding_box(
     :param wcs: WCS to convert to pixel coordinates
     :return: Bounding box coordinates for COCO style annotation
     """
-    source_skycoord = SkyCoord(ra, dec, unit="deg")
-    box_center = skycoord_to_pixel(source_skycoord, wcs, 0)
-    # Now create box, which will be accomplished by taking int to get xmin, ymin, and int + 1 for xmax, ymax
-    xmin = int(np.floor(box_center[0])) - 0.5
-    ymin = int(np.floor(box_center[1])) - 0.5
+    x, y = catalogue_to_pixel(
+        wcs, ra_array=np.atleast_1d(ra), dec_array=np.atleast_1d(dec)
+    )
+    box_center = (x[0], y[0])
+    # Now create box, which will be accomplished by taking int to get xmin, ymin, and int + 1 for xmax, ymax, a
+    # position that isn't finite gives a NaN box
+    xmin = float(np.floor(box_center[0])) - 0.5
+    ymin = float(np.floor(box_center[1])) - 0.5
     ymax = ymin + 1
     xmax = xmin + 1
 
     return xmin, ymin, xmax, ymax, class_name, box_center
 
 
+def _close_mosaics(*mosaics):
+    """
+    Close the mosaics opened with open_mosaic, skipping any that failed to open
+    """
+    for opened in mosaics:
+        if opened is not None:
+            opened.close()
+
+
+def load_component_catalogue(
+    component_catalog: Union[Table, str]
+) -> Tuple[pd.DataFrame, cKDTree]:
+    """
+    Load the component catalogue as the DataFrame remove_unresolved_sources_from_view uses, with a KD tree of its
+    positions, so it only has to be done once for all the mosaics
+    :param component_catalog: The component catalogue of the LoTSS data release, or its location
+    :return: The component catalogue as a DataFrame, and the KD tree of its RA and DEC
+    """
+    if isinstance(component_catalog, str):
+        component_catalog = Table.read(component_catalog)
+    component_catalog = component_catalog.to_pandas()
+    return component_catalog, cKDTree(component_catalog[["RA", "DEC"]].to_numpy())
+
+
 def create_cutouts(
     mosaic: Union[str, List[str], set],
     value_added_catalog: Union[Table, str],
-    pan_wise_catalog: Union[Table, str],
-    component_catalog: Union[Table, str],
+    pan_wise_catalog: Union[np.ndarray, Table, str, tuple],
+    component_catalog: Union[Table, str, pd.DataFrame],
     mosaic_location: str,
     save_cutout_directory: str,
     bands: List[str] = (
@@ -177,6 +261,9 @@ def create_cutouts(
     ),
     source_size: Optional[bool] = None,
     verbose: Optional[bool] = False,
+    source_indices: Optional[np.ndarray] = None,
+    pan_wise_tree: Optional[cKDTree] = None,
+    component_tree: Optional[cKDTree] = None,
     **kwargs,
 ):
     """
@@ -184,223 +271,395 @@ def create_cutouts(
 
     :param mosaic: Name of the field to use
     :param value_added_catalog: The VAC of the LoTSS data release
-    :param pan_wise_catalog: The PanSTARRS-ALLWISE catalogue used for Williams, 2018, the LoTSS III paper
+    :param pan_wise_catalog: The PanSTARRS-ALLWISE catalogue used for Williams, 2018, the LoTSS III paper, its location,
+    or a handle to it in shared memory
     :param mosaic_location: The location of the LoTSS DR2 mosaics
     :param save_cutout_directory: Where to save the cutout npy files
     :param bands: Whether to include all possible channels (grizy,W1,2,3,4 bands) in npy file or just (radio,i,W1)
     :param fixed_size: Whether to use fixed size cutouts, in arcseconds, or the LGZ size (default: LGZ)
     :param verbose: Whether to print extra information or not
+    :param source_indices: Rows of value_added_catalog to make cutouts of, all the sources in the field if not given
+    :param pan_wise_tree: KD tree of the whole PanSTARRS-ALLWISE catalogue from build_catalogue_tree, if not given, one
+    is built here of only the part of the catalogue around the sources
+    :param component_tree: KD tree of the component catalogue from load_component_catalogue, in which case
+    component_catalog is its DataFrame, if not given, the component catalogue is loaded here when it is needed
+    :param kwargs: compress_cutouts, True by default, compresses the saved .npz cutouts. dec_sorted says the PanSTARRS-ALLWISE catalogue is sorted by DEC with sort_catalogue_by_dec, so only
+    the rows in the DEC range of the sources are read. half_precision saves the cutouts as float16 instead of float32, halving their size on disk, where
+    Radio/RMS values above 65504 become inf, which make_single_coco_annotation_set clips anyway
     :return:
     """
     lofar_data_location = os.path.join(mosaic_location, mosaic, "mosaic-blanked.fits")
     lofar_rms_location = os.path.join(mosaic_location, mosaic, "mosaic.rms.fits")
     print(mosaic)
-    if type(pan_wise_catalog) == str:
-        print("Trying To Open")
-        pan_wise_catalog = fits.open(pan_wise_catalog, memmap=True)
-        pan_wise_catalog = pan_wise_catalog[1].data
-        print("Opened Catalog")
+    pan_wise_catalog = open_catalogue(
+        pan_wise_catalog,
+        columns=["ra", "dec"] + list(bands),
+        cache_dir=kwargs.get("cache_dir", None),
+    )
+    if source_indices is None:
+        mosaic_cutouts = value_added_catalog[value_added_catalog["Mosaic_ID"] == mosaic]
+    else:
+        mosaic_cutouts = value_added_catalog[source_indices]
+    if pan_wise_tree is None:
+        # Only copy the part of the catalogue around these sources, half of the largest cutout size of each
+        size_name = kwargs.get("size_name", "LGZ_Size")
+        sizes = np.asarray(mosaic_cutouts[size_name], dtype=float) * 1.5 / 3600.0
+        footprint = catalogue_footprint(
+            pan_wise_catalog,
+            mosaic_cutouts["RA"],
+            mosaic_cutouts["DEC"],
+            2 * np.fmax(sizes, 30.0 / 3600.0),
+            dec_sorted=kwargs.get("dec_sorted", False),
+        )
+        pan_wise_catalog = pan_wise_catalog[footprint]
+    # RA and DEC of the catalogue are only read once per mosaic, not for every source and layer
+    pan_wise_ra = np.array(pan_wise_catalog["ra"], dtype=float)
+    pan_wise_dec = np.array(pan_wise_catalog["dec"], dtype=float)
     # Load the data once, then do multiple cutouts
+    lofar_data = None
+    lofar_rms = None
     try:
-        fits.open(lofar_data_location, memmap=True)
-        fits.open(lofar_rms_location, memmap=True)
+        lofar_data = open_mosaic(lofar_data_location)
+        lofar_rms = open_mosaic(lofar_rms_location)
     except:
         if verbose:
             print(f"Mosaic {mosaic} does not exist!")
 
-    mosaic_cutouts = value_added_catalog[value_added_catalog["Mosaic_ID"] == mosaic]
-    # Go through each cutout for that mosaic
-    for l, source in enumerate(mosaic_cutouts):
-        if not os.path.exists(
-            os.path.join(save_cutout_directory, f"{source['Source_Name']}.npy")
-        ):
-            img_array = []
-            # Get the ra and dec of the radio source
-            source_ra = source["RA"]
-            source_dec = source["DEC"]
-            # Get the size of the cutout needed
-            source_size = None
-            if source_size is None or source_size is False:
-                source_size = 4*np.max([(
-                    source[kwargs.get("size_name", "LGZ_Size")] * 1.5
-                ) / 3600.0, 30.0/3600.])  # in arcseconds converted to archours
-                print(f"Source Size Original: Arc: {source_size}")
-            try:
-                lhdu = extract_subimage(
-                    lofar_data_location,
-                    source_ra,
-                    source_dec,
-                    source_size,
-                    verbose=verbose,
-                )
-            except:
-                if verbose:
-                    print(
-                        f"Failed to make data cutout for source: {source['Source_Name']}"
+    comp_cat = None
+    mosaic_wcs = None
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Go through each cutout for that mosaic
+            for l, source in enumerate(mosaic_cutouts):
+                # Cutouts from before they were saved as .npz are kept too
+                if not any(
+                    os.path.exists(
+                        os.path.join(
+                            save_cutout_directory, f"{source['Source_Name']}{extension}"
+                        )
                     )
-                #exit()
-                continue
-            try:
-                lrms = extract_subimage(
-                    lofar_rms_location,
-                    source_ra,
-                    source_dec,
-                    source_size,
-                    verbose=verbose,
-                )
-            except:
-                if verbose:
-                    print(
-                        f"Failed to make rms cutout for source: {source['Source_Name']}"
+                    for extension in (".npz", ".npy")
+                ):
+                    # Get the ra and dec of the radio source
+                    source_ra = source["RA"]
+                    source_dec = source["DEC"]
+                    # Get the size of the cutout needed
+                    source_size = None
+                    if source_size is None or source_size is False:
+                        source_size = 4 * np.max(
+                            [
+                                (source[kwargs.get("size_name", "LGZ_Size")] * 1.5)
+                                / 3600.0,
+                                30.0 / 3600.0,
+                            ]
+                        )  # in arcseconds converted to archours
+                        print(f"Source Size Original: Arc: {source_size}")
+                    # Cut out the data and rms at the same time, as each mostly waits on reading its mosaic
+                    lhdu_future = executor.submit(
+                        extract_subimage,
+                        lofar_data_location,
+                        source_ra,
+                        source_dec,
+                        source_size,
+                        verbose=verbose,
+                        mosaic=lofar_data,
+                    )
+                    lrms_future = executor.submit(
+                        extract_subimage,
+                        lofar_rms_location,
+                        source_ra,
+                        source_dec,
+                        source_size,
+                        verbose=verbose,
+                        mosaic=lofar_rms,
+                    )
+                    # Wait for both, so a failed data cutout doesn't leave the rms one reading the mosaic while the
+                    # next source starts reading through the same handle
+                    wait([lhdu_future, lrms_future])
+                    try:
+                        lhdu = lhdu_future.result()
+                    except:
+                        if verbose:
+                            print(
+                                f"Failed to make data cutout for source: {source['Source_Name']}"
+                            )
+                        # exit()
+                        continue
+                    try:
+                        lrms = lrms_future.result()
+                    except:
+                        if verbose:
+                            print(
+                                f"Failed to make rms cutout for source: {source['Source_Name']}"
+                            )
+                        # exit()
+                        continue
+                    header = lhdu[0].header
+                    # Only the first cutout of the mosaic parses its header, the others copy its WCS
+                    wcs = cutout_wcs(header, mosaic_wcs)
+                    if mosaic_wcs is None:
+                        mosaic_wcs = wcs
+                    # Remove unresolved sources here
+                    if kwargs.get("remove_other_sources", False):
+                        if comp_cat is None:
+                            if component_tree is not None:
+                                comp_cat, comp_tree = component_catalog, component_tree
+                            else:
+                                # Only read and convert the component catalogue once per call
+                                comp_cat, comp_tree = load_component_catalogue(
+                                    component_catalog
+                                )
+                        gauss_catalog = kwargs.get("gauss_catalog", None)
+                        if gauss_catalog is None:
+                            return ValueError(
+                                "Missing Gaussian Catalog for removing sources"
+                            )
+                        residual, lhdu[0].data = remove_unresolved_sources_from_view(
+                            source_name=source["Source_Name"],
+                            min_ra=source_ra - (source_size / 2),
+                            max_ra=source_ra + (source_size / 2),
+                            min_dec=source_dec - (source_size / 2),
+                            max_dec=source_dec + (source_size / 2),
+                            image=lhdu[0].data,
+                            wcs=wcs,
+                            gauss_catalog=gauss_catalog,
+                            component_catalog=comp_cat,
+                            debug=verbose,
+                            component_tree=comp_tree,
+                        )
+
+                        # if np.sum(residual) >= np.sum(lhdu[0]): # convert to Jy for flux
+                        # Source is most likely in view, so use it
+                        lhdu[0].data = residual
+                        # Need 1/4th of it now,
+                        new_source_size = source_size / 4
+                        psize = int((new_source_size / lhdu[0].header["CDELT2"]))
+                        orig = int((source_size / lhdu[0].header["CDELT2"]))
+                        print(
+                            f"LHDU Size: {lhdu[0].data.shape} Original Size: Pixels: {source_size} Arc: {orig} \n New Size: Pixels: {new_source_size} Arc: {psize}"
+                        )
+                        new_source_size_arc = psize
+                        lhdu[0].data, lrms[0].data, wcs = get_central_image(
+                            lhdu[0].data,
+                            lrms[0].data,
+                            wcs,
+                            new_size=new_source_size_arc,
+                        )
+                        print(lhdu[0].data.shape)
+                        source_size = new_source_size
+                        # Get size of where there is 90% of the flux of the image
+                        if kwargs.get("zoom_image", False):
+                            (
+                                lhdu[0].data,
+                                wcs,
+                                central_size,
+                                center,
+                                lrms[0].data,
+                            ) = get_zoomed_image(
+                                lhdu[0].data,
+                                rms_img=lrms[0].data,
+                                wcs=wcs,
+                                threshold=0.999 * np.nansum(lhdu[0].data),
+                            )
+                    if lrms[0].data.shape != lhdu[0].data.shape:
+                        continue
+                    # Channels last cutout, filled in place, with the Radio/RMS channel first and then the catalogue layers
+                    radio_only = kwargs.get("radio_only", False)
+                    img_array = np.empty(
+                        lhdu[0].data.shape + (1 if radio_only else 1 + len(bands),),
+                        dtype=np.float16
+                        if kwargs.get("half_precision", False)
+                        else np.float32,
+                    )
+                    radio = img_array[..., 0]
+                    # Makes the Radio/RMS channel, divided in float32 straight into the cutout, whatever the mosaic dtype
+                    np.divide(
+                        lhdu[0].data,
+                        lrms[0].data,
+                        out=radio,
+                        dtype=np.float32,
+                        casting="unsafe",
+                    )
+                    # if wanted, set all those below certain value to 0, S/N, which is the above
+                    sigma_cutoff = kwargs.get("sigma_cutoff", -1)
+                    if sigma_cutoff >= 0:
+                        radio[radio < sigma_cutoff] = 0
+                    # if is_image_artifact(image=img_array[0], central_size=10):
+                    #    print(f"Skipping b/c Artifact: {source['Source_Name']}")
+                    #    continue
+                    if radio_only:
+                        bounding_boxes = np.array([])
+                        proposal_boxes = np.array([])
+                        # Radio only cutouts are saved channels first
+                        img_array = np.moveaxis(img_array, 2, 0)
+                        try:
+                            save_cutout(
+                                os.path.join(
+                                    save_cutout_directory, source["Source_Name"]
+                                ),
+                                img_array,
+                                bounding_boxes,
+                                proposal_boxes,
+                                wcs,
+                                compress=kwargs.get("compress_cutouts", True),
+                            )
+                        except Exception as e:
+                            if verbose:
+                                print(f"Failed to save: {e}")
+                        continue
+                    # Now change source_size to size of cutout, or root(2)*source_size so all possible sources are included
+                    # exit()
+
+                    # Now time to get the data from the catalogue and add that in their own channels
+                    if verbose:
+                        print(f"Image Shape: {radio.shape}")
+                    if pan_wise_tree is None:
+                        # Build the tree of the catalogue once per call, so each cutout only queries its neighbourhood
+                        pan_wise_tree = build_catalogue_tree(pan_wise_ra, pan_wise_dec)
+                    # cuts size in two to only get sources that fall within the cutout, instead of ones that go twice as large
+                    cutout_indices = determine_visible_catalogue_indices(
+                        source_ra, source_dec, source_size / 2, pan_wise_tree
+                    )
+                    cutout_catalog = pan_wise_catalog[cutout_indices]
+                    # Pixel coordinates of the visible sources, shared by the proposal boxes and every layer
+                    cutout_coords = catalogue_to_pixel(
+                        wcs,
+                        ra_array=pan_wise_ra[cutout_indices],
+                        dec_array=pan_wise_dec[cutout_indices],
                     )
-                #exit()
-                continue
-            header = lhdu[0].header
-            wcs = WCS(header)
-            # Remove unresolved sources here
-            if kwargs.get("remove_other_sources", False):
-                if isinstance(component_catalog, str):
-                    comp_cat = Table.read(component_catalog)
-                else:
-                    comp_cat = component_catalog
-                gauss_catalog = kwargs.get("gauss_catalog", None)
-                if gauss_catalog is None:
-                    return ValueError("Missing Gaussian Catalog for removing sources")
-                residual, lhdu[0].data = remove_unresolved_sources_from_view(
-                    source_name=source["Source_Name"],
-                    min_ra=source_ra - (source_size / 2),
-                    max_ra=source_ra + (source_size / 2),
-                    min_dec=source_dec - (source_size / 2),
-                    max_dec=source_dec + (source_size / 2),
-                    image=lhdu[0].data,
-                    wcs=wcs,
-                    gauss_catalog=gauss_catalog,
-                    component_catalog=comp_cat,
-                    debug=verbose,
-                )
 
-                #if np.sum(residual) >= np.sum(lhdu[0]): # convert to Jy for flux
-                # Source is most likely in view, so use it
-                lhdu[0].data = residual
-                # Need 1/4th of it now,
-                new_source_size = (source_size/4)
-                psize = int((new_source_size / lhdu[0].header["CDELT2"]))
-                orig = int((source_size / lhdu[0].header["CDELT2"]))
-                print(f"LHDU Size: {lhdu[0].data.shape} Original Size: Pixels: {source_size} Arc: {orig} \n New Size: Pixels: {new_source_size} Arc: {psize}")
-                new_source_size_arc = psize
-                lhdu[0].data, lrms[0].data, wcs = get_central_image(lhdu[0].data, lrms[0].data, wcs, new_size=new_source_size_arc)
-                print(lhdu[0].data.shape)
-                source_size = new_source_size
-                # Get size of where there is 90% of the flux of the image
-                if kwargs.get("zoom_image", False):
-                    lhdu[0].data, wcs, central_size, center, lrms[0].data = get_zoomed_image(
-                        lhdu[0].data, rms_img=lrms[0].data, wcs=wcs, threshold=0.999*np.nansum(lhdu[0].data)
+                    # Now make proposal boxes
+                    proposal_boxes = np.asarray(
+                        make_proposal_boxes(wcs, cutout_catalog, coords=cutout_coords),
+                        dtype=object,
                     )
-            if lrms[0].data.shape != lhdu[0].data.shape:
-                continue
-            img_array.append(lhdu[0].data / lrms[0].data)  # Makes the Radio/RMS channel
-            # if wanted, set all those below certain value to 0, S/N, which is the above
-            sigma_cutoff = kwargs.get("sigma_cutoff", -1)
-            if sigma_cutoff >= 0:
-                img_array[0] = np.where(img_array[0] < sigma_cutoff, 0, img_array[0])
-            #if is_image_artifact(image=img_array[0], central_size=10):
-            #    print(f"Skipping b/c Artifact: {source['Source_Name']}")
-            #    continue
-            if kwargs.get("radio_only", False):
-                bounding_boxes = np.array([])
-                proposal_boxes = np.array([])
-                img_array = np.array(img_array)
-                combined_array = [
-                    img_array,
-                    bounding_boxes,
-                    proposal_boxes,
-                    wcs,
-                ]
-                try:
-                    np.save(
-                        os.path.join(save_cutout_directory, source["Source_Name"]),
-                        combined_array,
+                    for channel, layer in enumerate(bands, start=1):
+                        make_catalogue_layer(
+                            layer,
+                            wcs,
+                            radio.shape,
+                            cutout_catalog,
+                            coords=cutout_coords,
+                            out=img_array[..., channel],
+                        )
+
+                    if verbose:
+                        print(img_array.shape)
+                    # Include another array giving the bounding box for the source
+                    bounding_boxes = []
+                    source_bbox = make_bounding_box(
+                        source[kwargs.get("optical_ra", "ID_ra")],
+                        source[kwargs.get("optical_dec", "ID_dec")],
+                        wcs,
                     )
-                except Exception as e:
+                    # One compare of the whole box, which is also False for a NaN box from a missing optical position
+                    xmin, ymin, xmax, ymax = source_bbox[:4]
+                    if (
+                        xmin >= 0
+                        and ymin >= 0
+                        and ymax < img_array.shape[0]
+                        and xmax < img_array.shape[1]
+                    ):
+                        bounding_boxes.append(list(source_bbox))
+                    else:
+                        print("Source not in bounds")
                     if verbose:
-                        print(f"Failed to save: {e}")
-                continue
-            # Now change source_size to size of cutout, or root(2)*source_size so all possible sources are included
-            # exit()
-
-            # Now time to get the data from the catalogue and add that in their own channels
-            if verbose:
-                print(f"Image Shape: {img_array[0].data.shape}")
-            # cuts size in two to only get sources that fall within the cutout, instead of ones that go twice as large
-            cutout_catalog = determine_visible_catalogue_sources(
-                source_ra, source_dec, source_size / 2, pan_wise_catalog
-            )
+                        plot_three_channel_debug(
+                            img_array, bounding_boxes, 1, bounding_boxes[0][5]
+                        )
+                    # Now save out the combined file
+                    bounding_boxes = np.array(bounding_boxes, dtype=object)
 
-            # Now make proposal boxes
-            proposal_boxes = np.asarray(make_proposal_boxes(wcs, cutout_catalog))
-            for layer in bands:
-                tmp = make_catalogue_layer(
-                    layer,
-                    wcs,
-                    img_array[0].shape,
-                    cutout_catalog,
-                )
-                img_array.append(tmp)
-
-            img_array = np.array(img_array)
-            if verbose:
-                print(img_array.shape)
-            img_array = np.moveaxis(img_array, 0, 2)
-            # Include another array giving the bounding box for the source
-            bounding_boxes = []
-            try:
-                source_bbox = make_bounding_box(
-                    source[kwargs.get("optical_ra", "ID_ra")],
-                    source[kwargs.get("optical_dec", "ID_dec")],
-                    wcs,
-                )
-                assert source_bbox[1] >= 0
-                assert source_bbox[0] >= 0
-                assert source_bbox[3] < img_array.shape[0]
-                assert source_bbox[2] < img_array.shape[1]
-                source_bounding_box = list(source_bbox)
-                bounding_boxes.append(source_bounding_box)
-            except:
-                print("Source not in bounds")
-            if verbose:
-                plot_three_channel_debug(
-                    img_array, bounding_boxes, 1, bounding_boxes[0][5]
-                )
-            # Now save out the combined file
-            bounding_boxes = np.array(bounding_boxes)
-
-            # Save out the IDs of the cutout catalog and other catalog, for reverse indexing into optical catalogs from
-            # results
-
-            if verbose:
-                print(bounding_boxes)
-            combined_array = [
-                img_array,
-                bounding_boxes,
-                proposal_boxes,
-                wcs,
-            ]
-            try:
-                np.save(
-                    os.path.join(save_cutout_directory, source["Source_Name"]),
-                    combined_array,
+                    # Save out the IDs of the cutout catalog and other catalog, for reverse indexing into optical catalogs from
+                    # results
+
+                    if verbose:
+                        print(bounding_boxes)
+                    try:
+                        save_cutout(
+                            os.path.join(save_cutout_directory, source["Source_Name"]),
+                            img_array,
+                            bounding_boxes,
+                            proposal_boxes,
+                            wcs,
+                            compress=kwargs.get("compress_cutouts", True),
+                        )
+                    except Exception as e:
+                        if verbose:
+                            print(f"Failed to save: {e}")
+                else:
+                    print(f"Skipped: {l}")
+    finally:
+        _close_mosaics(lofar_data, lofar_rms)
+
+
+# Catalogues of a worker process, set once by _init_cutout_worker so tasks only need the mosaic name
+_worker_catalogues = {}
+
+
+def _init_cutout_worker(
+    value_added_catalog: Table,
+    pan_wise_handle: tuple,
+    component_catalog: Union[Table, pd.DataFrame],
+    component_tree: Optional[cKDTree] = None,
+):
+    """
+    Set the catalogues used by every create_cutouts call in this worker process
+    :param value_added_catalog: The VAC of the LoTSS data release
+    :param pan_wise_handle: Shared memory handle of the PanSTARRS-ALLWISE catalogue
+    :param component_catalog: The component catalogue of the LoTSS data release
+    :param component_tree: KD tree of the component catalogue, if it was loaded with load_component_catalogue
+    """
+    _worker_catalogues["value_added_catalog"] = value_added_catalog
+    _worker_catalogues["pan_wise_catalog"] = attach_shared_table(pan_wise_handle)
+    _worker_catalogues["component_catalog"] = component_catalog
+    _worker_catalogues["component_tree"] = component_tree
+
+
+def _create_worker_cutouts(task: Tuple[str, np.ndarray], **kwargs) -> str:
+    """
+    Create the cutouts of part of a mosaic with the catalogues of this worker process
+    :param task: Name of the field to use, and the rows of the VAC in that field to make cutouts of
+    :return: The name of the mosaic, once its cutouts are saved
+    """
+    mosaic, source_indices = task
+    create_cutouts(
+        mosaic=mosaic, source_indices=source_indices, **_worker_catalogues, **kwargs
+    )
+    return mosaic
+
+
+def _split_mosaic_sources(
+    mosaic_ids: np.ndarray, sources_per_task: int
+) -> List[Tuple[str, np.ndarray]]:
+    """
+    Split the sources of every mosaic into chunks, so one large mosaic is spread over many workers
+    :param mosaic_ids: Mosaic_ID of each source
+    :param sources_per_task: Number of sources in each chunk
+    :return: List of the mosaic name and row indices of each chunk
+    """
+    mosaic_ids = np.asarray(mosaic_ids)
+    if mosaic_ids.dtype.kind == "S":
+        mosaic_ids = np.char.decode(mosaic_ids)
+    order = np.argsort(mosaic_ids, kind="stable")
+    names, starts = np.unique(mosaic_ids[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    tasks = []
+    for name, start, end in zip(names, starts, ends):
+        for chunk_start in range(start, end, sources_per_task):
+            tasks.append(
+                (
+                    str(name),
+                    order[chunk_start : min(chunk_start + sources_per_task, end)],
                 )
-            except Exception as e:
-                if verbose:
-                    print(f"Failed to save: {e}")
-        else:
-            print(f"Skipped: {l}")
+            )
+    return tasks
 
 
 def create_source_dataset(
     cutout_directory: str,
     pan_wise_location: str,
-    value_added_catalog_location: str,
+    value_added_catalog_location: Union[str, Table],
     component_catalog_location: str,
     dr_two_location: str,
     bands: List[str] = (
@@ -422,19 +681,21 @@ def create_source_dataset(
     filter_optical: bool = True,
     no_source: bool = False,
     num_threads: Optional[int] = os.cpu_count(),
+    cache_dir: Optional[str] = None,
     **kwargs,
 ):
     """
 
     :param cutout_directory: Directory to store the cutouts
     :param pan_wise_location: The location of the PanSTARRS-ALLWISE catalog
-    :param value_added_catalog_location: Location of the LoTSS Value Added Catalog
+    :param value_added_catalog_location: Location of the LoTSS Value Added Catalog, or the already loaded catalog
     :param dr_two_location: The location of the LoTSS DR2 Mosaic Locations
     :param use_multiprocessing: Whether to use multiprocessing
     :param num_threads: Number of threads to use, if multiprocessing is true
     :param strict_filter: Use the same filtering as for Jelle's subsample, with total flux > 10 mJy, and size > 15 arcseconds
     :param filter_optical: Whether to filter out sources with only optical sources or not
     :param filter_lgz: Whether to filter on LGZ_Size
+    :param cache_dir: Directory to keep the decoded PanSTARRS-ALLWISE catalog in, so later runs skip decoding the FITS file
     :return:
     """
     l_objects = get_lotss_objects(value_added_catalog_location, False)
@@ -463,6 +724,10 @@ def create_source_dataset(
     print(mosaic_names)
     # exit()
     comp_catalog = get_lotss_objects(component_catalog_location, False)
+    comp_tree = None
+    if kwargs.get("remove_other_sources", False):
+        # Convert the component catalogue and build its tree once, instead of in every task
+        comp_catalog, comp_tree = load_component_catalogue(comp_catalog)
 
     # Go through each object, creating the cutout and saving to a directory
     # Create a directory structure identical for detectron2
@@ -479,30 +744,59 @@ def create_source_dataset(
     if fixed_size is False:
         fixed_size = None
 
+    # Load the catalogue once, sorted by DEC, so each call of create_cutouts only reads the part around its sources
+    pan_wise_catalog = sort_catalogue_by_dec(
+        load_fits_table(
+            pan_wise_location,
+            columns=["ra", "dec"] + list(bands),
+            cache_dir=cache_dir,
+        )
+    )
+    kwargs["dec_sorted"] = True
     if use_multiprocessing:
-        pool = multiprocessing.Pool(num_threads)
-        pool.starmap(
-            create_cutouts,
-            zip(
-                mosaic_names,
-                repeat(l_objects),
-                repeat(pan_wise_location),
-                repeat(comp_catalog),
-                repeat(dr_two_location),
-                repeat(all_directory),
-                repeat(bands),
-                repeat(fixed_size),
-                repeat(verbose),
-                repeat(**kwargs),
-            ),
+        # Share the catalogue, instead of every worker loading their own copy
+        shm, pan_wise_handle = share_table(pan_wise_catalog)
+        del pan_wise_catalog
+        # The sources of each mosaic are split into tasks, so one large mosaic does not run on a single worker, and
+        # workers write the cutouts to disk, only sending back the mosaic name
+        tasks = _split_mosaic_sources(
+            l_objects["Mosaic_ID"], kwargs.pop("sources_per_task", 32)
         )
+        # Largest tasks first, so the small leftover chunks of each mosaic fill in the end of the run, instead of
+        # a full chunk starting last and leaving the other workers idle
+        tasks.sort(key=lambda task: len(task[1]), reverse=True)
+        chunksize = kwargs.pop("task_chunksize", 1)
+        try:
+            with multiprocessing.Pool(
+                num_threads,
+                initializer=_init_cutout_worker,
+                initargs=(l_objects, pan_wise_handle, comp_catalog, comp_tree),
+            ) as pool:
+                for mosaic in pool.imap_unordered(
+                    partial(
+                        _create_worker_cutouts,
+                        mosaic_location=dr_two_location,
+                        save_cutout_directory=all_directory,
+                        bands=bands,
+                        source_size=fixed_size,
+                        verbose=verbose,
+                        **kwargs,
+                    ),
+                    tasks,
+                    chunksize=chunksize,
+                ):
+                    print(f"Finished: {mosaic}")
+        finally:
+            shm.close()
+            shm.unlink()
     else:
         for mosaic in mosaic_names:
             create_cutouts(
                 mosaic=mosaic,
                 value_added_catalog=l_objects,
-                pan_wise_catalog=pan_wise_location,
+                pan_wise_catalog=pan_wise_catalog,
                 component_catalog=comp_catalog,
+                component_tree=comp_tree,
                 mosaic_location=dr_two_location,
                 save_cutout_directory=all_directory,
                 bands=bands,
@@ -1,7 +1,6 @@
 import argparse
 import os
-import pickle
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 
 import numpy as np
 import torch
@@ -12,6 +11,7 @@ from torchvision import transforms
 from lofarnn.models.base.cnn import f1_loss
 from lofarnn.models.base.resnet import BinaryFocalLoss
 from lofarnn.models.dataloaders.datasets import RadioSourceDataset
+from lofarnn.utils.common import save_source_recalls
 
 
 def default_argument_parser():
@@ -113,6 +113,13 @@ def default_argument_parser():
     return parser
 
 
+def loader_worker_init(worker_id: int):
+    """
+    Limit each DataLoader worker to one thread, so the workers of every GPU process don't oversubscribe the CPUs
+    """
+    torch.set_num_threads(1)
+
+
 def only_image_transforms(
     image: np.ndarray, sources: List[str]
 ) -> Tuple[np.ndarray, List[str]]:
@@ -264,9 +271,9 @@ def test(
             100.0 * recall,
         )
     )
-    pickle.dump(
+    save_source_recalls(
+        os.path.join(output_dir, f"{name}_source_recall_epoch{epoch}.npz"),
         named_recalls,
-        open(os.path.join(output_dir, f"{name}_source_recall_epoch{epoch}.pkl"), "wb"),
     )
     a = np.asarray(save_test_loss)
     with open(os.path.join(output_dir, f"{name}_loss.csv"), "ab") as f:
@@ -290,7 +297,13 @@ def train(
     epoch: int,
     output_dir: str = "./",
     config: Dict[str, str] = {"loss": "cross-entropy"},
+    scaler: Optional[torch.cuda.amp.GradScaler] = None,
 ) -> None:
+    """
+    Train the model for one epoch
+
+    :param scaler: GradScaler to train with mixed precision, if None, trains in full precision
+    """
     total_loss = 0
     model.train()
     loss_fn = BinaryFocalLoss(
@@ -306,7 +319,10 @@ def train(
             data["names"],
         )
         optimizer.zero_grad()
-        output = model(image)
+        with torch.cuda.amp.autocast(enabled=scaler is not None):
+            output = model(image)
+        # Losses are computed in full precision, binary_cross_entropy is not safe to autocast
+        output = output.float()
         if config["loss"] == "cross-entropy":
             loss = F.binary_cross_entropy(F.softmax(output, dim=-1), labels)
         elif config["loss"] == "f1":
@@ -315,8 +331,13 @@ def train(
             loss = loss_fn(output, labels)
         else:
             raise Exception("Loss not one of 'cross-entropy', 'focal', 'f1' ")
-        loss.backward()
-        optimizer.step()
+        if scaler is not None:
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            loss.backward()
+            optimizer.step()
 
         if args.lr_type == "cyclical":
             scheduler.step()
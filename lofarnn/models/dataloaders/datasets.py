@@ -1,4 +1,5 @@
 import pickle
+from functools import lru_cache
 from typing import List, Union
 
 import numpy as np
@@ -8,6 +9,21 @@ from torch.utils.data import Dataset
 from lofarnn.data.datasets import get_lotss_objects
 
 
+@lru_cache(maxsize=256)
+def _load_radio_image(file_name: str, resize: bool = True) -> np.ndarray:
+    """
+    Load the radio channel of a cutout as float32, resized to 200x200 unless resize is False
+
+    Cached, as every optical source of a cutout is its own item needing the same radio image, so the array is
+    read only, and should be copied before being changed
+    """
+    image = np.load(file_name, fix_imports=True)[:, :, 0].astype(np.float32)
+    if resize:
+        image = cv2.resize(image, dsize=(200, 200), interpolation=cv2.INTER_CUBIC)
+    image.setflags(write=False)
+    return image
+
+
 class RadioSourceDataset(Dataset):
     """Radio Source dataset."""
 
@@ -91,10 +107,9 @@ class RadioSourceDataset(Dataset):
         Given a single index, get the single source, image, and label for it
         """
         anno = self.annotations[self.mapping[idx][0]]
-        image = np.load(anno["file_name"], fix_imports=True)[:,:,0]
-        image = cv2.resize(image, dsize=(200, 200), interpolation=cv2.INTER_CUBIC)
+        image = _load_radio_image(anno["file_name"])
         image = image.reshape((1, image.shape[0], image.shape[1]))
-        image = torch.from_numpy(image).float()
+        image = torch.from_numpy(image.copy()).float()
         radio_name = self._get_source_name(anno["file_name"])
         radio_source = self.vac[self.vac["Source_Name"] == radio_name]
         source = anno["optical_sources"][self.mapping[idx][1]]
@@ -127,7 +142,7 @@ class RadioSourceDataset(Dataset):
 
     def load_embedded_source(self, idx):
         anno = self.annotations[self.mapping[idx][0]]
-        image = np.load(anno["file_name"].replace("/data/Research/", "/home/bieker/"), fix_imports=True)[:,:,0]
+        image = _load_radio_image(anno["file_name"].replace("/data/Research/", "/home/bieker/"), resize=False)
         radio_name = self._get_source_name(anno["file_name"])
         radio_source = self.vac[self.vac["Source_Name"] == radio_name]
         source = anno["optical_sources"][self.mapping[idx][1]]
@@ -188,8 +203,7 @@ class RadioSourceDataset(Dataset):
         Given single index, get all the sources and labels, shuffling the order
         """
         anno = self.annotations[idx]
-        image = np.load(anno["file_name"], fix_imports=True)[:,:,0]
-        image = cv2.resize(image, dsize=(200, 200), interpolation=cv2.INTER_CUBIC)
+        image = _load_radio_image(anno["file_name"])
         image = image.reshape((1, image.shape[0], image.shape[1]))
         radio_name = self._get_source_name(anno["file_name"])
         radio_source = self.vac[self.vac["Source_Name"] == radio_name]
@@ -243,7 +257,7 @@ class RadioSourceDataset(Dataset):
             labels = labels.reshape(self.num_sources)
         else:
             sources = sources.reshape(1, sources.shape[0], sources.shape[1])
-        image = torch.from_numpy(image).float()
+        image = torch.from_numpy(image.copy()).float()
         if self.transform:
             image, sources = self.transform(image, sources)
         return {
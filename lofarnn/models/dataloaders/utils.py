@@ -1,15 +1,24 @@
+import os
 import pickle
-from typing import Dict, Tuple, Any, Optional
+from functools import lru_cache
+from typing import Dict, Tuple, Any, Optional, Union
 
 import numpy as np
 from astropy.io import fits
 from astropy.table import Table
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def get_lotss_objects(fname: str, verbose: bool = False) -> Table:
+
+def get_lotss_objects(fname: Union[str, Table], verbose: bool = False) -> Table:
     """
-    Load the LoTSS objects from a file
+    Load the LoTSS objects from a file, or return them as is if already loaded
     """
+    if isinstance(fname, Table):
+        return fname
 
     with fits.open(fname) as hdul:
         table = hdul[1].data
@@ -27,9 +36,77 @@ def get_source_from_dict(source: Dict[str, Any]) -> str:
         return source["file_name"].split("/")[-1].split(".png")[0]
 
 
-def get_lofar_dicts(annotation_filepath: str, fraction: float = 1.0) -> Dict[str, str]:
+def _orjson_annotation_path(annotation_filepath: str) -> str:
+    """
+    Location of the orjson copy of a pickled annotation file, next to it with a .json extension
+    """
+    return os.path.splitext(annotation_filepath)[0] + ".json"
+
+
+def _to_serializable(obj: Any) -> Any:
+    """
+    Convert the numpy values orjson can't serialize directly, such as non-contiguous arrays, to Python types
+    """
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj)}")
+
+
+def save_annotations(dataset_dicts: list, annotation_filepath: str) -> None:
+    """
+    Save the annotations as a pickle, and if orjson is installed, also as JSON next to it, which is much faster to
+    load for the lists of dicts of the annotations
+    :param dataset_dicts: The annotation dicts
+    :param annotation_filepath: Location of the pickle file
+    """
+    with open(annotation_filepath, "wb") as outfile:
+        pickle.dump(dataset_dicts, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+    if orjson is not None:
+        with open(_orjson_annotation_path(annotation_filepath), "wb") as outfile:
+            outfile.write(
+                orjson.dumps(
+                    dataset_dicts,
+                    default=_to_serializable,
+                    option=orjson.OPT_SERIALIZE_NUMPY,
+                )
+            )
+
+
+@lru_cache()
+def load_annotations(annotation_filepath: str) -> list:
+    """
+    Load the annotations once per process, so registered datasets that are asked for many times, such as for every
+    evaluation, don't load the file again, and forked workers share the loaded dicts
+
+    If orjson is installed, and the JSON copy made by save_annotations is at least as new as the pickle, it is loaded
+    instead, with the proposals converted back to arrays. The box modes are then the int values of the BoxMode, which
+    BoxMode.convert compares equal to the enum. The dicts are shared, so they should be copied before being changed,
+    as the dataset mappers do
+    """
+    json_path = _orjson_annotation_path(annotation_filepath)
+    if (
+        orjson is not None
+        and json_path != annotation_filepath
+        and os.path.exists(json_path)
+        and os.path.getmtime(json_path) >= os.path.getmtime(annotation_filepath)
+    ):
+        with open(json_path, "rb") as f:
+            dataset_dicts = orjson.loads(f.read())
+        for record in dataset_dicts:
+            if "proposal_boxes" in record:
+                record["proposal_boxes"] = np.asarray(
+                    record["proposal_boxes"], dtype=float
+                ).reshape(-1, 4)
+                record["proposal_objectness_logits"] = np.asarray(
+                    record["proposal_objectness_logits"], dtype=float
+                )
+        return dataset_dicts
     with open(annotation_filepath, "rb") as f:
-        dataset_dicts = pickle.load(f)
+        return pickle.load(f)
+
+
+def get_lofar_dicts(annotation_filepath: str, fraction: float = 1.0) -> Dict[str, str]:
+    dataset_dicts = list(load_annotations(annotation_filepath))
     if fraction < 0.99999:
         # Only take subset of the dataset
         num_entries = len(dataset_dicts)
@@ -54,16 +131,15 @@ def get_only_mutli_dicts(
     else:
         vac_catalog = vac_catalog[vac_catalog["LGZ_Assoc"] == 1]
     vac_catalog = vac_catalog["Source_Name"].data
-    with open(annotation_filepath, "rb") as f:
-        dataset_dicts = pickle.load(f)
-        new_dicts = []
-        for i in range(0, len(dataset_dicts)):
-            name = dataset_dicts[i]["file_name"].split("/")[-1].split(".npy")[0]
-            if (
-                name in vac_catalog or name.rpartition(".")[0] in vac_catalog
-            ):  # Needed for both rotated and non rotated
-                new_dicts.append(dataset_dicts[i])
-        dataset_dicts = new_dicts
+    dataset_dicts = load_annotations(annotation_filepath)
+    new_dicts = []
+    for i in range(0, len(dataset_dicts)):
+        name = dataset_dicts[i]["file_name"].split("/")[-1].split(".npy")[0]
+        if (
+            name in vac_catalog or name.rpartition(".")[0] in vac_catalog
+        ):  # Needed for both rotated and non rotated
+            new_dicts.append(dataset_dicts[i])
+    dataset_dicts = new_dicts
     return dataset_dicts
 
 
@@ -191,24 +267,31 @@ def get_physical_dicts(
     :return: Multiple dicts of sources for Detectron2, with the applied cuts, useful to calculating the recall for various physical issues
     These dicts might be empty
     """
-    with open(annotation_filepath, "rb") as f:
-        dataset_dicts = pickle.load(f)
+    dataset_dicts = load_annotations(annotation_filepath)
     vac_catalog = get_lotss_objects(vac_catalog)
     multi_large = []
     multi_small = []
     single_large = []
     single_small = []
+    # Look up each source's row once, instead of masking the whole VAC for every source
+    vac_rows = {
+        name: i
+        for i, name in enumerate(np.asarray(vac_catalog["Source_Name"]).astype(str))
+    }
+    num_components = np.asarray(vac_catalog["LGZ_Assoc"])
+    sizes = np.asarray(vac_catalog["LGZ_Size"])
     for element in dataset_dicts:
-        source_name = get_source_from_dict(element)
-        vac_entry = vac_catalog[vac_catalog["Source_Name"] == source_name]
-        if vac_entry["LGZ_Assoc"] > 1:
-            if vac_entry["LGZ_Size"] >= size:
+        row = vac_rows.get(get_source_from_dict(element))
+        if row is None:
+            continue
+        if num_components[row] > 1:
+            if sizes[row] >= size:
                 multi_large.append(element)
-            elif vac_entry["LGZ_Size"] < size:
+            elif sizes[row] < size:
                 multi_small.append(element)
-        elif vac_entry["LGZ_Assoc"] < 2:
-            if vac_entry["LGZ_Size"] >= size:
+        elif num_components[row] < 2:
+            if sizes[row] >= size:
                 single_large.append(element)
-            elif vac_entry["LGZ_Size"] < size:
+            elif sizes[row] < size:
                 single_small.append(element)
     return multi_large, multi_small, single_large, single_small
@@ -9,6 +9,7 @@ import numpy as np
 import os
 import pickle
 from collections import OrderedDict
+from functools import lru_cache
 import pycocotools.mask as mask_util
 import torch
 from fvcore.common.file_io import PathManager
@@ -19,11 +20,22 @@ from tabulate import tabulate
 import detectron2.utils.comm as comm
 from detectron2.data import MetadataCatalog
 from detectron2.data.datasets.coco import convert_to_coco_json
-from detectron2.structures import Boxes, BoxMode, pairwise_iou
+from detectron2.structures import BoxMode
 from detectron2.utils.logger import create_small_table
 
 from detectron2.evaluation.evaluator import DatasetEvaluator
 
+from lofarnn.utils.common import save_source_recalls
+from lofarnn.utils.kernels import greedy_match, sort_overlap_pairs
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Number of highest scoring predictions kept per image for the non-mAR recall
+RECALL_LIMITS = (1, 2, 5, 10, 100)
+
 
 class SourceEvaluator(DatasetEvaluator):
     """
@@ -64,6 +76,11 @@ class SourceEvaluator(DatasetEvaluator):
         self._distributed = distributed
         self._output_dir = output_dir
         self._physical_cuts = physical_cut_dict
+        # Unique Source Names in each cut, so the predictions can be masked against them in one go
+        self._physical_cut_names = {
+            cut: np.unique(np.asarray(names, dtype=str))
+            for cut, names in (physical_cut_dict or {}).items()
+        }
 
         self._cpu_device = torch.device("cpu")
         self._logger = logging.getLogger(__name__)
@@ -81,8 +98,7 @@ class SourceEvaluator(DatasetEvaluator):
             convert_to_coco_json(dataset_name, cache_path)
 
         json_file = PathManager.get_local_path(self._metadata.json_file)
-        with contextlib.redirect_stdout(io.StringIO()):
-            self._coco_api = COCO(json_file)
+        self._coco_api = _load_coco_api(json_file, os.path.getmtime(json_file))
 
         self._kpt_oks_sigmas = cfg.TEST.KEYPOINT_OKS_SIGMAS
         # Test set json files do not contain annotations (evaluation must be
@@ -129,6 +145,9 @@ class SourceEvaluator(DatasetEvaluator):
                 prediction["instances"] = instances_to_coco_json(
                     instances, input["image_id"]
                 )
+                # Keep the XYXY box and score tensors, so the recall does not rebuild them from the json
+                prediction["pred_boxes"] = instances.pred_boxes.tensor
+                prediction["scores"] = instances.scores
             if "proposals" in output:
                 prediction["proposals"] = output["proposals"].to(self._cpu_device)
             self._predictions.append(prediction)
@@ -136,6 +155,8 @@ class SourceEvaluator(DatasetEvaluator):
     def evaluate(self):
         if self._distributed:
             comm.synchronize()
+            # One storage per rank to pickle and send, rather than a small tensor per image
+            _stack_prediction_tensors(self._predictions)
             predictions = comm.gather(self._predictions, dst=0)
             predictions = list(itertools.chain(*predictions))
 
@@ -148,19 +169,23 @@ class SourceEvaluator(DatasetEvaluator):
             self._logger.warning("[COCOEvaluator] Did not receive valid predictions.")
             return {}
 
+        _stack_prediction_tensors(predictions)
+
         if self._output_dir:
             PathManager.mkdirs(self._output_dir)
             file_path = os.path.join(self._output_dir, "instances_predictions.pth")
             with PathManager.open(file_path, "wb") as f:
-                torch.save(predictions, f)
+                # The json instances are plain Python objects, which newer pickle protocols write faster
+                torch.save(predictions, f, pickle_protocol=pickle.HIGHEST_PROTOCOL)
 
         self._results = OrderedDict()
         if "proposals" in predictions[0]:
             self._eval_box_proposals(predictions)
         if "instances" in predictions[0]:
             self._eval_predictions(set(self._tasks), predictions)
-        # Copy so the caller can do whatever with results
-        return copy.deepcopy(self._results)
+        # Copy so the caller can do whatever with results, every result is a flat dict of
+        # numbers, so copying each dict is enough and avoids deepcopy walking every value
+        return OrderedDict((k, dict(v)) for k, v in self._results.items())
 
     def _eval_predictions(self, tasks, predictions):
         """
@@ -188,9 +213,16 @@ class SourceEvaluator(DatasetEvaluator):
         if self._output_dir:
             file_path = os.path.join(self._output_dir, "coco_instances_results.json")
             self._logger.info("Saving results to {}".format(file_path))
-            with PathManager.open(file_path, "w") as f:
-                f.write(json.dumps(coco_results))
-                f.flush()
+            if orjson is not None:
+                with PathManager.open(file_path, "wb") as f:
+                    f.write(
+                        orjson.dumps(coco_results, option=orjson.OPT_SERIALIZE_NUMPY)
+                    )
+                    f.flush()
+            else:
+                with PathManager.open(file_path, "w") as f:
+                    f.write(json.dumps(coco_results))
+                    f.flush()
 
         if not self._do_evaluation:
             self._logger.info("Annotations are not available for evaluation.")
@@ -198,86 +230,24 @@ class SourceEvaluator(DatasetEvaluator):
 
         # Calculate the recall based on general recall and precision, not COCO mAP, with single best prediction
         self._logger.info(f"Evaluating with non-mAR...")
-        all_recall = _evaluate_box_proposals(predictions, self._coco_api, limit=1)
-        pickle.dump(
-            all_recall["per_source"],
-            file=open(
-                os.path.join(
-                    self._output_dir, f"{self._dataset_name}_recall_limit1.pkl"
-                ),
-                "wb",
-            ),
-        )
-        self._results["own_recall"] = {
-            "ar": all_recall["ar"],
-            "ap": all_recall["ap"],
-            "precision": all_recall["precisions"][-1],
-            "recall": all_recall["recalls"][-1],
-        }
-        all_recall = _evaluate_box_proposals(predictions, self._coco_api, limit=2)
-        pickle.dump(
-            all_recall["per_source"],
-            file=open(
-                os.path.join(
-                    self._output_dir, f"{self._dataset_name}_recall_limit2.pkl"
-                ),
-                "wb",
-            ),
-        )
-        self._results["own_recall_2"] = {
-            "ar": all_recall["ar"],
-            "ap": all_recall["ap"],
-            "precision": all_recall["precisions"][-1],
-            "recall": all_recall["recalls"][-1],
-        }
-        all_recall = _evaluate_box_proposals(predictions, self._coco_api, limit=5)
-        pickle.dump(
-            all_recall["per_source"],
-            file=open(
-                os.path.join(
-                    self._output_dir, f"{self._dataset_name}_recall_limit5.pkl"
-                ),
-                "wb",
-            ),
+        # Every limit is evaluated in the same pass over the images
+        all_recalls = _evaluate_box_proposals(
+            predictions, self._coco_api, limit=RECALL_LIMITS
         )
-        self._results["own_recall_5"] = {
-            "ar": all_recall["ar"],
-            "ap": all_recall["ap"],
-            "precision": all_recall["precisions"][-1],
-            "recall": all_recall["recalls"][-1],
-        }
-        all_recall = _evaluate_box_proposals(predictions, self._coco_api, limit=10)
-        pickle.dump(
-            all_recall["per_source"],
-            file=open(
-                os.path.join(
-                    self._output_dir, f"{self._dataset_name}_recall_limit10.pkl"
-                ),
-                "wb",
-            ),
-        )
-        self._results["own_recall_10"] = {
-            "ar": all_recall["ar"],
-            "ap": all_recall["ap"],
-            "precision": all_recall["precisions"][-1],
-            "recall": all_recall["recalls"][-1],
-        }
-        all_recall = _evaluate_box_proposals(predictions, self._coco_api, limit=100)
-        pickle.dump(
-            all_recall["per_source"],
-            file=open(
+        for limit, all_recall in zip(RECALL_LIMITS, all_recalls):
+            save_source_recalls(
                 os.path.join(
-                    self._output_dir, f"{self._dataset_name}_recall_limit100.pkl"
+                    self._output_dir, f"{self._dataset_name}_recall_limit{limit}.npz"
                 ),
-                "wb",
-            ),
-        )
-        self._results["own_recall_100"] = {
-            "ar": all_recall["ar"],
-            "ap": all_recall["ap"],
-            "precision": all_recall["precisions"][-1],
-            "recall": all_recall["recalls"][-1],
-        }
+                all_recall["per_source"],
+            )
+            recall_name = "own_recall" if limit == 1 else f"own_recall_{limit}"
+            self._results[recall_name] = {
+                "ar": all_recall["ar"],
+                "ap": all_recall["ap"],
+                "precision": all_recall["precisions"][-1],
+                "recall": all_recall["recalls"][-1],
+            }
         for physical_cut in self._physical_cuts.keys():
             self._logger.info(
                 f"Evaluating with non-mAR on physical cut {physical_cut}..."
@@ -286,56 +256,21 @@ class SourceEvaluator(DatasetEvaluator):
                 physical_cut, predictions
             )
             # physical_coco_results = list(itertools.chain(*[x["instances"] for x in prediction_cut]))
-            phys_recall = _evaluate_box_proposals(
-                prediction_cut, self._coco_api, limit=1
-            )
-            recall_name = f"own_recall_{physical_cut}"
-            self._results[recall_name] = {
-                "ar": phys_recall["ar"],
-                "ap": phys_recall["ap"],
-                "precision": phys_recall["precisions"][-1],
-                "recall": phys_recall["recalls"][-1],
-            }
-            phys_recall = _evaluate_box_proposals(
-                prediction_cut, self._coco_api, limit=2
-            )
-            recall_name = f"own_recall_2_{physical_cut}"
-            self._results[recall_name] = {
-                "ar": phys_recall["ar"],
-                "ap": phys_recall["ap"],
-                "precision": phys_recall["precisions"][-1],
-                "recall": phys_recall["recalls"][-1],
-            }
-            phys_recall = _evaluate_box_proposals(
-                prediction_cut, self._coco_api, limit=5
+            phys_recalls = _evaluate_box_proposals(
+                prediction_cut, self._coco_api, limit=RECALL_LIMITS
             )
-            recall_name = f"own_recall_5_{physical_cut}"
-            self._results[recall_name] = {
-                "ar": phys_recall["ar"],
-                "ap": phys_recall["ap"],
-                "precision": phys_recall["precisions"][-1],
-                "recall": phys_recall["recalls"][-1],
-            }
-            phys_recall = _evaluate_box_proposals(
-                prediction_cut, self._coco_api, limit=10
-            )
-            recall_name = f"own_recall_10_{physical_cut}"
-            self._results[recall_name] = {
-                "ar": phys_recall["ar"],
-                "ap": phys_recall["ap"],
-                "precision": phys_recall["precisions"][-1],
-                "recall": phys_recall["recalls"][-1],
-            }
-            phys_recall = _evaluate_box_proposals(
-                prediction_cut, self._coco_api, limit=100
-            )
-            recall_name = f"own_recall_100_{physical_cut}"
-            self._results[recall_name] = {
-                "ar": phys_recall["ar"],
-                "ap": phys_recall["ap"],
-                "precision": phys_recall["precisions"][-1],
-                "recall": phys_recall["recalls"][-1],
-            }
+            for limit, phys_recall in zip(RECALL_LIMITS, phys_recalls):
+                recall_name = (
+                    f"own_recall_{physical_cut}"
+                    if limit == 1
+                    else f"own_recall_{limit}_{physical_cut}"
+                )
+                self._results[recall_name] = {
+                    "ar": phys_recall["ar"],
+                    "ap": phys_recall["ap"],
+                    "precision": phys_recall["precisions"][-1],
+                    "recall": phys_recall["recalls"][-1],
+                }
         self._logger.info("Evaluating predictions ...")
         for task in sorted(tasks):
             coco_eval = (
@@ -378,17 +313,16 @@ class SourceEvaluator(DatasetEvaluator):
                 self._results[result_name] = res
 
     def _get_physical_cut_predictions(self, cut_key, predictions):
-        prediction_cut = []
-        for prediction in predictions:
-            if prediction["source_name"] in self._physical_cuts[cut_key]:
-                prediction_cut.append(prediction)
-            elif (
-                prediction["source_name"].rpartition(".")[0]
-                in self._physical_cuts[cut_key]
-            ):
-                # Handles the rotation, where there is an extra '.rot' after the source name
-                prediction_cut.append(prediction)
-        return prediction_cut
+        if len(predictions) == 0:
+            return []
+        cut_names = self._physical_cut_names[cut_key]
+        source_names = np.asarray(
+            [prediction["source_name"] for prediction in predictions]
+        )
+        # Handles the rotation, where there is an extra '.rot' after the source name
+        base_names = np.char.rpartition(source_names, ".")[:, 0]
+        in_cut = np.isin(source_names, cut_names) | np.isin(base_names, cut_names)
+        return [predictions[i] for i in np.flatnonzero(in_cut)]
 
     def _derive_coco_results(self, coco_eval, iou_type, class_names=None):
         """
@@ -490,6 +424,37 @@ class SourceEvaluator(DatasetEvaluator):
         return results
 
 
+@lru_cache(maxsize=8)
+def _load_coco_api(json_file, mtime):
+    """
+    Load the COCO api of an annotation file, cached as the trainer builds a new evaluator for every evaluation
+    :param json_file: COCO format annotation file
+    :param mtime: Modification time of the file, so a rewritten file is loaded again
+    :return: COCO api of the annotations
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return COCO(json_file)
+
+
+def _stack_prediction_tensors(predictions):
+    """
+    Put the box and score tensors of every image into one contiguous tensor each, with each prediction
+    keeping a view of its own rows, so they are held and saved as one block instead of thousands of small ones.
+
+    Args:
+        predictions (list[dict]): predictions from process, changed in place
+    """
+    with_boxes = [p for p in predictions if "pred_boxes" in p]
+    if len(with_boxes) == 0:
+        return
+    counts = [len(p["scores"]) for p in with_boxes]
+    boxes = torch.cat([p["pred_boxes"] for p in with_boxes]).split(counts)
+    scores = torch.cat([p["scores"] for p in with_boxes]).split(counts)
+    for prediction, pred_boxes, pred_scores in zip(with_boxes, boxes, scores):
+        prediction["pred_boxes"] = pred_boxes
+        prediction["scores"] = pred_scores
+
+
 def instances_to_coco_json(instances, img_id):
     """
     Dump an "Instances" object to a COCO-format json that's used for evaluation.
@@ -515,10 +480,16 @@ def instances_to_coco_json(instances, img_id):
     if has_mask:
         # use RLE to encode the masks, because they are too large and takes memory
         # since this evaluator stores outputs of the entire dataset
-        rles = [
-            mask_util.encode(np.array(mask[:, :, None], order="F", dtype="uint8"))[0]
-            for mask in instances.pred_masks
-        ]
+        # mask_util encodes a whole H x W x N stack of masks in one call, giving one RLE per mask
+        masks = instances.pred_masks.numpy()
+        # Boolean masks are already one byte per pixel, so view them as uint8 rather than copying,
+        # leaving the Fortran ordering as the only copy
+        masks = (
+            masks.view(np.uint8)
+            if masks.dtype == np.bool_
+            else masks.astype(np.uint8, copy=False)
+        )
+        rles = mask_util.encode(np.asfortranarray(masks.transpose(1, 2, 0)))
         for rle in rles:
             # "counts" is an array encoded by mask_util as a byte-stream. Python3's
             # json writer which always produces strings cannot serialize a bytestream
@@ -552,6 +523,99 @@ def instances_to_coco_json(instances, img_id):
     return results
 
 
+def _get_proposal_boxes(prediction_dict, coco_api, max_kept=None):
+    """
+    Get the score sorted prediction boxes and ground truth boxes and areas of an image,
+    cached on the prediction record so every limit and physical cut reuses them
+
+    If max_kept is given, only the max_kept highest scoring predictions are sorted and returned
+    """
+    if "_proposal_boxes" in prediction_dict:
+        cached_kept, cached = prediction_dict["_proposal_boxes"]
+        if cached_kept is None or (max_kept is not None and cached_kept >= max_kept):
+            return cached
+    preds = prediction_dict["instances"]
+    if "pred_boxes" in prediction_dict:
+        # XYXY boxes and scores kept from process, in the same order as the json instances
+        scores = prediction_dict["scores"]
+        all_pred_boxes = prediction_dict["pred_boxes"]
+    else:
+        scores = torch.from_numpy(
+            np.fromiter((i["score"] for i in preds), dtype=np.float32, count=len(preds))
+        )
+        all_pred_boxes = BoxMode.convert(
+            torch.as_tensor([i["bbox"] for i in preds], dtype=torch.float32).reshape(
+                -1, 4
+            ),  # guard against no boxes
+            BoxMode.XYWH_ABS,
+            BoxMode.XYXY_ABS,
+        )
+
+    # sort predictions in descending order
+    # TODO maybe remove this and make it explicit in the documentation
+    # topk only sorts the highest scoring predictions that are kept
+    num_kept = len(scores) if max_kept is None else min(max_kept, len(scores))
+    top_inds = torch.topk(scores, k=num_kept).indices
+    all_pred_boxes = all_pred_boxes[top_inds]
+    inds = top_inds.numpy()
+
+    ann_ids = coco_api.getAnnIds(imgIds=prediction_dict["image_id"])
+    anno = [obj for obj in coco_api.loadAnns(ann_ids) if obj["iscrowd"] == 0]
+    # Convert all the boxes of an image at once, instead of one at a time
+    # Reshaped so an image without boxes still gives a (0, 4) tensor
+    gt_boxes = BoxMode.convert(
+        torch.as_tensor([obj["bbox"] for obj in anno], dtype=torch.float32).reshape(
+            -1, 4
+        ),
+        BoxMode.XYWH_ABS,
+        BoxMode.XYXY_ABS,
+    )
+    gt_areas = torch.as_tensor([obj["area"] for obj in anno], dtype=torch.float32)
+    cached = (inds, all_pred_boxes, gt_boxes, gt_areas)
+    prediction_dict["_proposal_boxes"] = (max_kept, cached)
+    return cached
+
+
+def _batched_pairwise_iou(boxes1, boxes2, batch_size=1024):
+    """
+    IoU between every pair of boxes of each image, like pairwise_iou, for many images at once
+
+    The boxes of each batch of images are padded to the same number and the IoUs computed in one broadcast
+    :param boxes1: List of (N_i, 4) XYXY box tensors, one per image
+    :param boxes2: List of (M_i, 4) XYXY box tensors, one per image
+    :param batch_size: Number of images to compute at once, to bound the memory of the padded boxes
+    :return: List of (N_i, M_i) numpy arrays of the IoUs
+    """
+    overlaps = []
+    for start in range(0, len(boxes1), batch_size):
+        batch1 = boxes1[start : start + batch_size]
+        batch2 = boxes2[start : start + batch_size]
+        padded1 = torch.nn.utils.rnn.pad_sequence(batch1, batch_first=True)
+        padded2 = torch.nn.utils.rnn.pad_sequence(batch2, batch_first=True)
+        area1 = (padded1[..., 2] - padded1[..., 0]) * (
+            padded1[..., 3] - padded1[..., 1]
+        )
+        area2 = (padded2[..., 2] - padded2[..., 0]) * (
+            padded2[..., 3] - padded2[..., 1]
+        )
+        width_height = torch.min(
+            padded1[:, :, None, 2:], padded2[:, None, :, 2:]
+        ) - torch.max(padded1[:, :, None, :2], padded2[:, None, :, :2])
+        width_height.clamp_(min=0)
+        inter = width_height.prod(dim=3)
+        # handle empty boxes
+        iou = torch.where(
+            inter > 0,
+            inter / (area1[:, :, None] + area2[:, None, :] - inter),
+            torch.zeros(1, dtype=inter.dtype),
+        ).numpy()
+        overlaps.extend(
+            iou[i, : len(b1), : len(b2)]
+            for i, (b1, b2) in enumerate(zip(batch1, batch2))
+        )
+    return overlaps
+
+
 # inspired from Detectron:
 # https://github.com/facebookresearch/Detectron/blob/a6a835f5b8208c45d0dce217ce9bbda915f44df7/detectron/datasets/json_dataset_evaluator.py#L255 # noqa
 def _evaluate_box_proposals(
@@ -561,6 +625,9 @@ def _evaluate_box_proposals(
     Evaluate detection proposal recall metrics. This function is a much
     faster alternative to the official COCO API recall evaluation code. However,
     it produces slightly different results.
+
+    If limit is a sequence of limits, all of them are evaluated in the same pass over the images,
+    and a list of the results for each limit is returned
     """
     # Record max overlap value for each gt box
     # Return vector of overlap values
@@ -586,31 +653,19 @@ def _evaluate_box_proposals(
     ]  # 512-inf
     assert area in areas, "Unknown area range: {}".format(area)
     area_range = area_ranges[areas[area]]
-    gt_overlaps = []
+    limits = [limit] if limit is None or np.isscalar(limit) else list(limit)
+    gt_overlaps = [[] for _ in limits]
     num_pos = 0
-    num_boxes = 0
-    source_outcomes = {}
+    num_boxes = [0 for _ in limits]
+    source_outcomes = [{} for _ in limits]
+    # No limit needs more than the largest limit of the predictions
+    most_kept = None if None in limits else max(limits)
+    images = []
     for prediction_dict in dataset_predictions:
-        preds = np.asarray(prediction_dict["instances"])
-        scores = []
-        for i in preds:
-            scores.append(i["score"])
-
-        # sort predictions in descending order
-        # TODO maybe remove this and make it explicit in the documentation
-        inds = (-1 * np.asarray(scores)).argsort()
-        preds = preds[inds]
-
-        ann_ids = coco_api.getAnnIds(imgIds=prediction_dict["image_id"])
-        anno = coco_api.loadAnns(ann_ids)
-        gt_boxes = [
-            BoxMode.convert(obj["bbox"], BoxMode.XYWH_ABS, BoxMode.XYXY_ABS)
-            for obj in anno
-            if obj["iscrowd"] == 0
-        ]
-        gt_boxes = torch.as_tensor(gt_boxes).reshape(-1, 4)  # guard against no boxes
-        gt_boxes = Boxes(gt_boxes)
-        gt_areas = torch.as_tensor([obj["area"] for obj in anno if obj["iscrowd"] == 0])
+        preds = prediction_dict["instances"]
+        inds, all_pred_boxes, gt_boxes, gt_areas = _get_proposal_boxes(
+            prediction_dict, coco_api, max_kept=most_kept
+        )
 
         if len(gt_boxes) == 0 or len(preds) == 0:
             continue
@@ -619,83 +674,85 @@ def _evaluate_box_proposals(
         gt_boxes = gt_boxes[valid_gt_inds]
 
         num_pos += len(gt_boxes)  # 1 GT from each image
-        num_boxes += limit  # N number of proposals kept
+        for k, lim in enumerate(limits):
+            num_boxes[k] += lim  # N number of proposals kept
 
         if len(gt_boxes) == 0:
             continue
 
-        if limit is not None and len(preds) > limit:
-            preds = preds[:limit]
+        # The overlaps of the most predictions any limit keeps, each limit uses the first rows
+        max_kept = len(inds) if most_kept is None else min(len(inds), most_kept)
+        images.append((prediction_dict, inds, all_pred_boxes[:max_kept], gt_boxes))
 
-        pred_boxes = []
-        for i in preds:
-            pred_boxes.append(
-                BoxMode.convert(i["bbox"], BoxMode.XYWH_ABS, BoxMode.XYXY_ABS)
-            )
-        pred_boxes = torch.as_tensor(pred_boxes).reshape(
-            -1, 4
-        )  # guard against no boxes
-        pred_boxes = Boxes(pred_boxes)
-        overlaps = pairwise_iou(pred_boxes, gt_boxes)
-
-        _gt_overlaps = torch.zeros(len(gt_boxes))
-        for j in range(min(len(preds), len(gt_boxes))):
-            # find which proposal box maximally covers each gt box
-            # and get the iou amount of coverage for each gt box
-            max_overlaps, argmax_overlaps = overlaps.max(dim=0)
-
-            # find which gt box is 'best' covered (i.e. 'best' = most iou)
-            gt_ovr, gt_ind = max_overlaps.max(dim=0)
-            assert gt_ovr >= 0
-            # find the proposal box that covers the best covered gt box
-            box_ind = argmax_overlaps[gt_ind]
-            # record the iou coverage of this gt box
-            _gt_overlaps[j] = overlaps[box_ind, gt_ind]
-            assert _gt_overlaps[j] == gt_ovr
-            # mark the proposal box and the gt box as used
-            overlaps[box_ind, :] = -1
-            overlaps[:, gt_ind] = -1
-            print(preds[gt_ind])
-            source_outcomes[
-                prediction_dict["source_name"]
-            ] = gt_ovr.item()  # Save overlap, so can be used for determining outcome
-
-        # append recorded iou coverage level
-        gt_overlaps.append(_gt_overlaps)
-    gt_overlaps = (
-        torch.cat(gt_overlaps, dim=0)
-        if len(gt_overlaps)
-        else torch.zeros(0, dtype=torch.float32)
+    # The IoU of the proposal and gt boxes of all the images, computed in batches of images
+    # instead of one small pairwise_iou per image
+    image_overlaps = _batched_pairwise_iou(
+        [image[2] for image in images], [image[3] for image in images]
     )
-    gt_overlaps, _ = torch.sort(gt_overlaps)
+    # Every (proposal box, gt box) pair of each image from the most to the least overlap,
+    # sorted once for all the limits, and concatenated over the images. Taking the first pair
+    # whose boxes are both unused picks the same pairs as repeatedly finding the best covered
+    # gt box and its proposal box, then marking both used
+    pair_boxes, pair_gts, pair_overlaps, pair_offsets = sort_overlap_pairs(
+        image_overlaps
+    )
+    num_inds = np.asarray([len(image[1]) for image in images], dtype=np.int64)
+    num_gts = np.asarray([len(image[3]) for image in images], dtype=np.int64)
+    source_names = [image[0]["source_name"] for image in images]
+
+    for k, lim in enumerate(limits):
+        # Only the highest scoring predictions are kept
+        num_kept = num_inds if lim is None else np.minimum(num_inds, lim)
+        # iou coverage of every gt box, and of the last one matched in each image
+        matched, last = greedy_match(
+            pair_boxes, pair_gts, pair_overlaps, pair_offsets, num_kept, num_gts
+        )
+        gt_overlaps[k].append(torch.from_numpy(matched))
+        # Save overlap, so can be used for determining outcome
+        source_outcomes[k] = {
+            name: float(ovr)
+            for name, ovr in zip(source_names, last.tolist())
+            if not np.isnan(ovr)
+        }
 
     if thresholds is None:
         step = 0.05
         thresholds = torch.arange(0.5, 0.95 + 1e-5, step, dtype=torch.float32)
-    recalls = torch.zeros_like(thresholds)
-    precisions = torch.zeros_like(thresholds)
-    # compute recall for each iou threshold
-    for i, t in enumerate(thresholds):
-        recalls[i] = (gt_overlaps >= t).float().sum() / float(
+    results = []
+    for k in range(len(limits)):
+        limit_overlaps = (
+            torch.cat(gt_overlaps[k], dim=0)
+            if len(gt_overlaps[k])
+            else torch.zeros(0, dtype=torch.float32)
+        )
+        limit_overlaps, _ = torch.sort(limit_overlaps)
+
+        # count the true positives at every iou threshold at once, shared by the recall and precision
+        true_positives = (
+            (limit_overlaps[:, None] >= thresholds[None, :]).float().sum(dim=0)
+        )
+        recalls = true_positives / float(
             num_pos
         )  # TP/(Num GT Labels) with GT being Num Images as 1 GT per image
-    for i, t in enumerate(thresholds):
-        precisions[i] = (gt_overlaps >= t).float().sum() / float(
-            num_boxes
-        )  # TP/(Num of boxes kept)
-    # ar = 2 * np.trapz(recalls, thresholds)
-    ar = recalls.mean()
-    ap = precisions.mean()
-    return {
-        "ar": ar,
-        "ap": ap,
-        "per_source": source_outcomes,
-        "recalls": recalls,
-        "precisions": precisions,
-        "thresholds": thresholds,
-        "gt_overlaps": gt_overlaps,
-        "num_pos": num_pos,
-    }
+        precisions = true_positives / float(num_boxes[k])  # TP/(Num of boxes kept)
+        # ar = 2 * np.trapz(recalls, thresholds)
+        ar = recalls.mean()
+        ap = precisions.mean()
+        results.append(
+            {
+                "ar": ar,
+                "ap": ap,
+                "per_source": source_outcomes[k],
+                "recalls": recalls,
+                "precisions": precisions,
+                "thresholds": thresholds,
+                "gt_overlaps": limit_overlaps,
+                "num_pos": num_pos,
+            }
+        )
+    if limit is None or np.isscalar(limit):
+        return results[0]
+    return results
 
 
 def _evaluate_predictions_on_coco(coco_gt, coco_results, iou_type, kpt_oks_sigmas=None):
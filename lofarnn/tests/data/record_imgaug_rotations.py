@@ -0,0 +1,76 @@
+"""
+Records the imgaug 0.4.0 rotations that test_cutouts compares augment_image_and_bboxes against
+
+This is the augmentation lofarnn used before it moved to cv2, and needs imgaug 0.4.0, which needs numpy < 2, so
+run it in its own environment with: pip install numpy==1.26.4 imgaug==0.4.0 opencv-python-headless
+"""
+import os
+
+import imgaug.augmenters as iaa
+import numpy as np
+from imgaug.augmentables.bbs import BoundingBox, BoundingBoxesOnImage
+
+ANGLES = (0, 30, 45, 90, 137.5, 270)
+
+
+def imgaug_rotate(image, cutouts, proposal_boxes, angle):
+    """
+    The rotation of augment_image_and_bboxes from before the move to cv2, for a square image
+    """
+    seq = iaa.Sequential(
+        [
+            iaa.Affine(rotate=angle),
+            iaa.CropToFixedSize(
+                width=image.shape[0], height=image.shape[0], position="center"
+            ),
+        ]
+    )
+    bbs = BoundingBoxesOnImage(
+        [BoundingBox(c[1] + 0.5, c[0] + 0.5, c[3] + 0.5, c[2] + 0.5) for c in cutouts],
+        shape=image.shape,
+    )
+    pbbs = BoundingBoxesOnImage(
+        [
+            BoundingBox(p[1] + 0.5, p[0] + 0.5, p[3] + 0.5, p[2] + 0.5)
+            for p in proposal_boxes
+        ],
+        shape=image.shape,
+    )
+    _, bbs = seq(image=image, bounding_boxes=bbs)
+    image, pbbs = seq(image=image, bounding_boxes=pbbs)
+    bbs = bbs.remove_out_of_image(partly=False).clip_out_of_image()
+    pbbs = pbbs.remove_out_of_image(partly=False).clip_out_of_image()
+    boxes = np.asarray([(b.x1, b.y1, b.x2, b.y2) for b in bbs], dtype=float).reshape(
+        -1, 4
+    )
+    pboxes = np.asarray([(b.x1, b.y1, b.x2, b.y2) for b in pbbs], dtype=float).reshape(
+        -1, 4
+    )
+    return image, boxes, pboxes
+
+
+def main():
+    rng = np.random.default_rng(42)
+    image = rng.random((32, 32, 2)).astype(np.float32)
+    # In the (y1, x1, y2, x2) pixel indices of the cutouts, the center box stays in, the corner boxes go partly or
+    # fully out of the image when rotated
+    cutouts = np.array(
+        [[14.5, 14.5, 15.5, 15.5], [0.5, 0.5, 1.5, 1.5], [29.0, 2.0, 31.0, 6.0]]
+    )
+    proposal_boxes = np.array(
+        [[3.5, 20.5, 4.5, 21.5], [-0.5, -0.5, 0.5, 0.5], [10.0, 28.0, 12.0, 31.0]]
+    )
+    record = {"image": image, "cutouts": cutouts, "proposal_boxes": proposal_boxes}
+    record["angles"] = np.asarray(ANGLES, dtype=float)
+    for angle in ANGLES:
+        rotated, boxes, pboxes = imgaug_rotate(image, cutouts, proposal_boxes, angle)
+        record[f"image_{angle}"] = rotated
+        record[f"boxes_{angle}"] = boxes
+        record[f"proposal_boxes_{angle}"] = pboxes
+    np.savez_compressed(
+        os.path.join(os.path.dirname(__file__), "imgaug_rotations.npz"), **record
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from astropy.table import Table
+
+from lofarnn.utils import cnn
+from lofarnn.utils.cnn import save_cnn_image
+
+
+def _image(scale=1.0):
+    """
+    A 3 channel CNN image, with zeros, and values down to well below the smallest normal float16
+    """
+    rng = np.random.default_rng(1)
+    image = rng.uniform(0.0, scale, size=(20, 24, 3)).astype(np.float32)
+    image[2, 3, :] = 0.0
+    image[4, 5, 0] = 1e-7 * scale
+    return image
+
+
+def test_unnormalized_image_round_trips_exactly(tmp_path):
+    image = _image(scale=1e-3)
+    file_name = str(tmp_path / "source.cnn.False.npy")
+    save_cnn_image(file_name, image, half_precision=False)
+    loaded = np.load(file_name)
+    assert loaded.dtype == np.float32
+    np.testing.assert_array_equal(loaded, image)
+
+
+def test_half_precision_keeps_float32_with_subnormal_values(tmp_path):
+    image = _image()
+    file_name = str(tmp_path / "source.cnn.True.npy")
+    save_cnn_image(file_name, image, half_precision=True)
+    loaded = np.load(file_name)
+    assert loaded.dtype == np.float32
+    np.testing.assert_array_equal(loaded, image)
+
+
+def test_half_precision_saves_normal_values_as_float16(tmp_path):
+    image = _image()
+    image[4, 5, 0] = 1e-3
+    file_name = str(tmp_path / "source.cnn.True.npy")
+    save_cnn_image(file_name, image, half_precision=True)
+    loaded = np.load(file_name)
+    assert loaded.dtype == np.float16
+    np.testing.assert_allclose(
+        loaded.astype(np.float32), image, rtol=np.finfo(np.float16).eps, atol=0
+    )
+
+
+@pytest.mark.parametrize("half_precision", [False, True])
+def test_load_radio_image_after_round_trip(tmp_path, half_precision):
+    pytest.importorskip("torch")
+    from lofarnn.models.dataloaders.datasets import _load_radio_image
+
+    image = _image(scale=1e-3 if not half_precision else 1.0)
+    image[4, 5, 0] = 1e-3
+    file_name = str(tmp_path / f"source.cnn.{half_precision}.npy")
+    save_cnn_image(file_name, image, half_precision=half_precision)
+    radio = _load_radio_image(file_name, resize=False)
+    assert radio.dtype == np.float32
+    if half_precision:
+        np.testing.assert_allclose(
+            radio, image[:, :, 0], rtol=np.finfo(np.float16).eps, atol=0
+        )
+    else:
+        np.testing.assert_array_equal(radio, image[:, :, 0])
+
+
+def test_unrotated_annotations_keep_serial_order_and_ids(monkeypatch):
+    def fake_make_single_cnn_set(
+        image_names, record_list, set_number, *args, image_id_offset=0, **kwargs
+    ):
+        # Earlier chunks finish last
+        time.sleep(0.05 / (1 + image_id_offset))
+        for i, image_name in enumerate(image_names, start=image_id_offset):
+            for norm, records in record_list.items():
+                records.append({"file_name": image_name.stem, "image_id": i})
+
+    saved = {}
+    monkeypatch.setattr(cnn, "make_single_cnn_set", fake_make_single_cnn_set)
+    monkeypatch.setattr(cnn.os, "cpu_count", lambda: 4)
+    monkeypatch.setattr(
+        cnn, "save_cnn_annotations", lambda L, *args, **kwargs: saved.update(L)
+    )
+    image_names = [Path(f"source_{i}.npy") for i in range(10)]
+    cnn.create_cnn_annotations(image_names, normalize=[True, False])
+    for norm in (True, False):
+        assert [record["image_id"] for record in saved[norm]] == list(range(10))
+        assert [record["file_name"] for record in saved[norm]] == [
+            name.stem for name in image_names
+        ]
+
+
+def _write_catalogues(tmp_path, association=True):
+    vac = {
+        "Source_Name": np.array(["ILTJ1", "ILTJ2", "ILTJ3"]),
+        "RA": np.array([180.0, 180.1, 180.2]),
+        "DEC": np.array([45.0, 45.1, 45.2]),
+        "objID": np.array([1, 2, 3], dtype=np.int64),
+        "AllWISE": np.array(["a", "b", "c"]),
+        "LGZ_Size": np.array([20.0, 40.0, 60.0]),
+    }
+    if association:
+        vac["LGZ_Assoc"] = np.array([1, 2, 3], dtype=np.int64)
+    vac_path = str(tmp_path / "vac.fits")
+    Table(vac).write(vac_path)
+    counterpart_path = str(tmp_path / "pan_wise.fits")
+    Table(
+        {
+            "objID": np.array([1], dtype=np.int64),
+            "AllWISE": np.array(["a"]),
+            "ra": np.array([180.0]),
+            "dec": np.array([45.0]),
+            "z_best": np.array([0.5]),
+            "iFApMag": np.array([20.0]),
+        }
+    ).write(counterpart_path)
+    return vac_path, counterpart_path
+
+
+@pytest.mark.parametrize("association", [False, True])
+def test_create_cnn_dataset_needs_association_only_for_multi_rotate(
+    tmp_path, monkeypatch, association
+):
+    vac_path, counterpart_path = _write_catalogues(tmp_path, association)
+    all_directory = tmp_path / "dataset" / "COCO" / "all"
+    all_directory.mkdir(parents=True)
+    for name in ("ILTJ1", "ILTJ2", "ILTJ3"):
+        (all_directory / f"{name}.npz").touch()
+    calls = []
+    monkeypatch.setattr(
+        cnn,
+        "create_cnn_annotations",
+        lambda *args, **kwargs: calls.append(kwargs["rotation_names"]),
+    )
+    cnn.create_cnn_dataset(
+        str(tmp_path / "dataset"),
+        counterpart_catalog=counterpart_path,
+        vac_catalog=vac_path,
+        bands=["iFApMag"],
+        multi_rotate_only=vac_path if association else None,
+    )
+    assert len(calls) > 0
+    for names in calls:
+        if association:
+            np.testing.assert_array_equal(names, ["ILTJ2", "ILTJ3"])
+        else:
+            assert names is None
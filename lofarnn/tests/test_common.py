@@ -0,0 +1,96 @@
+import numpy as np
+from astropy.wcs import WCS
+
+from lofarnn.utils.common import load_cutout, save_cutout
+
+
+def _cutout():
+    """
+    A cutout like create_cutouts makes, with NaNs in the radio channel and mostly empty catalogue layers
+    """
+    rng = np.random.default_rng(0)
+    image = np.zeros((20, 24, 3), dtype=np.float32)
+    image[..., 0] = rng.normal(size=(20, 24))
+    image[3, 4, 0] = np.nan
+    image[5, 6, 1] = 17.5
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---SIN", "DEC--SIN"]
+    wcs.wcs.crval = [180.25, 45.5]
+    wcs.wcs.crpix = [12.5, 10.5]
+    wcs.wcs.cdelt = [-1.5 / 3600.0, 1.5 / 3600.0]
+    bounding_boxes = [(9.5, 10.5, 10.5, 11.5, "Optical source", (10.2, 11.7))]
+    proposal_boxes = [
+        (1.5, 2.5, 2.5, 3.5, "Proposal Box", (2.1, 3.4)),
+        (-0.5, 18.5, 0.5, 19.5, "Proposal Box", (0.0, 19.0)),
+    ]
+    return image, bounding_boxes, proposal_boxes, wcs
+
+
+def _assert_boxes_equal(loaded, boxes):
+    assert len(loaded) == len(boxes)
+    for loaded_box, box in zip(loaded, boxes):
+        np.testing.assert_array_equal(np.asarray(loaded_box[:4], dtype=float), box[:4])
+        assert loaded_box[4] == box[4]
+        np.testing.assert_array_equal(np.asarray(loaded_box[5], dtype=float), box[5])
+
+
+def test_cutout_round_trip(tmp_path):
+    image, bounding_boxes, proposal_boxes, wcs = _cutout()
+    for compress in (True, False):
+        filename = tmp_path / f"source_{compress}"
+        save_cutout(
+            str(filename), image, bounding_boxes, proposal_boxes, wcs, compress=compress
+        )
+        (
+            loaded_image,
+            loaded_bounding_boxes,
+            loaded_proposal_boxes,
+            loaded_wcs,
+        ) = load_cutout(f"{filename}.npz")
+        assert loaded_image.dtype == image.dtype
+        np.testing.assert_array_equal(loaded_image, image)
+        _assert_boxes_equal(loaded_bounding_boxes, bounding_boxes)
+        _assert_boxes_equal(loaded_proposal_boxes, proposal_boxes)
+        # FITS headers, which pickled WCSs go through too, keep 14 significant digits
+        assert loaded_wcs.wcs.compare(wcs.wcs, tolerance=1e-12)
+        np.testing.assert_allclose(
+            loaded_wcs.all_pix2world([[3.0, 7.0]], 0),
+            wcs.all_pix2world([[3.0, 7.0]], 0),
+        )
+
+
+def test_cutout_without_boxes(tmp_path):
+    image, _, _, wcs = _cutout()
+    image = np.moveaxis(image[..., :1], 2, 0)
+    filename = tmp_path / "radio_only.npz"
+    save_cutout(str(filename), image, np.array([]), np.array([]), wcs)
+    loaded_image, bounding_boxes, proposal_boxes, _ = load_cutout(str(filename))
+    np.testing.assert_array_equal(loaded_image, image)
+    assert len(bounding_boxes) == 0
+    assert len(proposal_boxes) == 0
+
+
+def test_load_legacy_npy_cutout(tmp_path):
+    """
+    Cutouts from before save_cutout were a pickled object array of the image, boxes, proposal boxes, and WCS
+    """
+    image, bounding_boxes, proposal_boxes, wcs = _cutout()
+    legacy_boxes = np.empty((1, 6), dtype=object)
+    legacy_boxes[0, :] = bounding_boxes[0]
+    legacy = np.empty(4, dtype=object)
+    legacy[0] = image
+    legacy[1] = legacy_boxes
+    legacy[2] = proposal_boxes
+    legacy[3] = wcs
+    filename = tmp_path / "legacy.npy"
+    np.save(filename, legacy, allow_pickle=True)
+    (
+        loaded_image,
+        loaded_bounding_boxes,
+        loaded_proposal_boxes,
+        loaded_wcs,
+    ) = load_cutout(str(filename))
+    np.testing.assert_array_equal(loaded_image, image)
+    _assert_boxes_equal(loaded_bounding_boxes, bounding_boxes)
+    _assert_boxes_equal(loaded_proposal_boxes, proposal_boxes)
+    assert loaded_wcs.wcs.compare(wcs.wcs, tolerance=1e-12)
@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+
+from lofarnn.data.cutouts import augment_image_and_bboxes
+
+RECORDED = os.path.join(os.path.dirname(__file__), "data", "imgaug_rotations.npz")
+
+
+def _angle_key(angle: float):
+    return angle if angle % 1 else int(angle)
+
+
+@pytest.mark.parametrize("angle", [0, 30, 45, 90, 137.5, 270])
+def test_rotation_matches_imgaug(angle):
+    """
+    The cv2 rotation gives the same images and boxes as imgaug 0.4.0, recorded with data/record_imgaug_rotations.py,
+    including the boxes that end up partly or fully outside the image
+    """
+    recorded = np.load(RECORDED)
+    key = _angle_key(angle)
+    cutouts = [list(cutout) for cutout in recorded["cutouts"]]
+    image, cutouts, proposal_boxes = augment_image_and_bboxes(
+        recorded["image"].copy(),
+        cutouts=cutouts,
+        proposal_boxes=recorded["proposal_boxes"],
+        angle=angle,
+        new_size=None,
+    )
+    expected_boxes = recorded[f"boxes_{key}"]
+    expected_proposals = recorded[f"proposal_boxes_{key}"]
+    # imgaug transforms the boxes in float32
+    np.testing.assert_allclose(image, recorded[f"image_{key}"], atol=1e-6)
+    np.testing.assert_allclose(
+        np.asarray([cutout[:4] for cutout in cutouts[: len(expected_boxes)]]),
+        expected_boxes,
+        atol=1e-5,
+    )
+    np.testing.assert_allclose(
+        np.asarray(proposal_boxes).reshape(-1, 4), expected_proposals, atol=1e-5
+    )
+
+
+def test_rotation_of_float16_image():
+    recorded = np.load(RECORDED)
+    image, _, _ = augment_image_and_bboxes(
+        recorded["image"].astype(np.float16),
+        cutouts=[list(cutout) for cutout in recorded["cutouts"]],
+        proposal_boxes=recorded["proposal_boxes"],
+        angle=30,
+        new_size=None,
+    )
+    assert image.dtype == np.float32
+    np.testing.assert_allclose(image, recorded["image_30"], atol=1e-3)
@@ -0,0 +1,173 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.io import fits as astropy_fits
+from astropy.table import Table
+from astropy.wcs import WCS
+
+from lofarnn.utils import fits
+
+READERS = ["astropy"] + (["fitsio"] if fits.fitsio is not None else [])
+
+
+def _use_reader(monkeypatch, reader):
+    if reader == "astropy":
+        monkeypatch.setattr(fits, "fitsio", None)
+
+
+def _write_table(path):
+    Table(
+        {
+            "Source_Name": np.array(["ILTJ1", "ILTJ123456+543210", ""]),
+            "ra": np.array([359.9, 0.1, 180.0]),
+            "iFApMag": np.array([np.nan, 21.5, -99.0], dtype=np.float32),
+            "objID": np.array([1, 2**40, -1], dtype=np.int64),
+            "z_best": np.array([0.1, np.nan, 2.0]),
+        }
+    ).write(path)
+
+
+def _astropy_read(path, columns=None):
+    """
+    The catalogues as they were read before load_fits_table
+    """
+    table = Table.read(path)
+    table.convert_bytestring_to_unicode()
+    if columns is not None:
+        # FITS column names are case insensitive, astropy's Table is not
+        names = {name.lower(): name for name in table.colnames}
+        table = table[[names[name.lower()] for name in columns]]
+    return np.ma.getdata(table.as_array())
+
+
+def _assert_tables_equal(loaded, expected):
+    assert loaded.dtype.names == expected.dtype.names
+    for name in expected.dtype.names:
+        assert loaded.dtype[name].newbyteorder("=") == expected.dtype[
+            name
+        ].newbyteorder("="), name
+        np.testing.assert_array_equal(loaded[name], expected[name])
+
+
+def test_threads_attach_shared_table_once():
+    table = np.zeros(100, dtype=[("ra", np.float64), ("dec", np.float64)])
+    table["ra"] = np.arange(100)
+    shm, handle = fits.share_table(table)
+    try:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            attached = list(
+                executor.map(lambda _: fits.attach_shared_table(handle), range(64))
+            )
+        assert all(array is attached[0] for array in attached)
+        np.testing.assert_array_equal(attached[0], table)
+    finally:
+        shared, _ = fits._shared_tables.pop(handle[0])
+        del attached, shared
+        shm.close()
+        shm.unlink()
+
+
+@pytest.mark.parametrize(
+    "centre_ra, centre_dec",
+    [(0.0, 45.0), (359.99, 10.0), (0.01, -30.0), (120.0, 89.99), (250.0, -89.95)],
+)
+def test_tree_selection_matches_separation(centre_ra, centre_dec):
+    rng = np.random.default_rng(int(centre_ra * 100 + centre_dec * 10) % 2**32)
+    size = 0.05
+    # Catalogue around the centre, over the RA wrap and the poles
+    ra = (centre_ra + rng.uniform(-2, 2, 2000)) % 360.0
+    dec = np.clip(centre_dec + rng.uniform(-0.2, 0.2, 2000), -90.0, 90.0)
+    tree = fits.build_catalogue_tree(ra, dec)
+    catalogue_coords = SkyCoord(ra, dec, unit="deg")
+    for source_ra, source_dec in zip(
+        (centre_ra + rng.uniform(-0.05, 0.05, 20)) % 360.0,
+        np.clip(centre_dec + rng.uniform(-0.05, 0.05, 20), -90.0, 90.0),
+    ):
+        separation = (
+            SkyCoord(source_ra, source_dec, unit="deg")
+            .separation(catalogue_coords)
+            .to_value(u.deg)
+        )
+        selected = fits.determine_visible_catalogue_indices(
+            source_ra, source_dec, size, tree
+        )
+        # Sources on the edge can go either way from rounding
+        on_edge = np.abs(separation - size) < 1e-9
+        expected = np.flatnonzero(separation < size)
+        assert len(expected) > 0
+        np.testing.assert_array_equal(
+            selected[~on_edge[selected]], expected[~on_edge[expected]]
+        )
+
+
+@pytest.mark.parametrize("reader", READERS)
+@pytest.mark.parametrize(
+    "columns", [None, ["objID", "ra"], ["source_name", "IFAPMAG", "z_best"]]
+)
+def test_load_fits_table_matches_astropy(tmp_path, monkeypatch, reader, columns):
+    path = str(tmp_path / "catalogue.fits")
+    _write_table(path)
+    _use_reader(monkeypatch, reader)
+    loaded = fits.load_fits_table(path, columns=columns)
+    # Names are kept as requested, whatever their case in the file
+    expected = _astropy_read(path, columns)
+    if columns is not None:
+        expected.dtype.names = tuple(columns)
+    _assert_tables_equal(loaded, expected)
+    _assert_tables_equal(
+        fits.load_fits_table(path, columns=columns, rows=[2, 0]), expected[[2, 0]]
+    )
+
+
+@pytest.mark.parametrize("reader", READERS)
+def test_load_fits_table_cache(tmp_path, monkeypatch, reader):
+    path = str(tmp_path / "catalogue.fits")
+    cache_dir = str(tmp_path / "cache")
+    _write_table(path)
+    _use_reader(monkeypatch, reader)
+    columns = ["Source_Name", "ra"]
+    first = fits.load_fits_table(path, columns=columns, cache_dir=cache_dir)
+    cached = os.listdir(cache_dir)
+    assert len(cached) == 1
+    second = fits.load_fits_table(path, columns=columns, cache_dir=cache_dir)
+    assert isinstance(second, np.memmap)
+    _assert_tables_equal(second, first)
+    _assert_tables_equal(second, _astropy_read(path, columns))
+    assert os.listdir(cache_dir) == cached
+    # Other columns, or a changed file, are decoded again
+    fits.load_fits_table(path, columns=["ra"], cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+    table = Table.read(path)
+    table["ra"] += 1.0
+    table.write(path, overwrite=True)
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10**9))
+    changed = fits.load_fits_table(path, columns=columns, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 3
+    np.testing.assert_array_equal(changed["ra"], first["ra"] + 1.0)
+
+
+@pytest.mark.parametrize("reader", READERS)
+@pytest.mark.parametrize("shape", [(40, 50), (1, 1, 40, 50)])
+def test_extract_subimage_matches_full_read(tmp_path, monkeypatch, reader, shape):
+    path = str(tmp_path / f"mosaic{len(shape)}.fits")
+    wcs = WCS(naxis=len(shape))
+    wcs.wcs.ctype = ["RA---SIN", "DEC--SIN", "FREQ", "STOKES"][: len(shape)]
+    wcs.wcs.crval = [180.0, 45.0, 1.4e8, 1.0][: len(shape)]
+    wcs.wcs.crpix = [25.0, 20.0, 1.0, 1.0][: len(shape)]
+    wcs.wcs.cdelt = [-1.5 / 3600.0, 1.5 / 3600.0, 1e6, 1.0][: len(shape)]
+    data = np.random.default_rng(3).normal(size=shape).astype(np.float32)
+    header = wcs.to_header()
+    header["BMAJ"] = 6.0 / 3600.0
+    astropy_fits.PrimaryHDU(data, header).writeto(path)
+    _use_reader(monkeypatch, reader)
+    ra, dec = wcs.celestial.all_pix2world([[30.5, 12.5]], 0)[0]
+    cutout = fits.extract_subimage(path, ra, dec, 20.5 * 1.5 / 3600.0, verbose=False)
+    # Pixel 30.5, 12.5 with a size of 20 pixels is columns 20:40 and rows 2:22
+    np.testing.assert_array_equal(cutout[0].data, data.reshape(40, 50)[2:22, 20:40])
+    np.testing.assert_allclose(cutout[0].header["CRPIX1"], 25.0 - 20)
+    np.testing.assert_allclose(cutout[0].header["CRPIX2"], 20.0 - 2)
+    np.testing.assert_allclose(cutout[0].header["BMAJ"], header["BMAJ"], rtol=1e-12)
@@ -0,0 +1,219 @@
+import numpy as np
+import pytest
+
+from lofarnn.data import datasets
+from lofarnn.visualization import metrics
+from lofarnn.utils.kernels import (
+    NUMBA_AVAILABLE,
+    _count_in_bins,
+    _greedy_match,
+    _scatter_layer,
+    greedy_match,
+    sort_overlap_pairs,
+)
+
+LIMITS = [1, 2, 5, 10, 100]
+MATCHERS = [_greedy_match] + ([greedy_match] if NUMBA_AVAILABLE else [])
+
+
+def _pairwise_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    IoU of (x1, y1, x2, y2) boxes in float32, as detectron2's pairwise_iou
+    """
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    width_height = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:]) - np.maximum(
+        boxes1[:, None, :2], boxes2[None, :, :2]
+    )
+    width_height = np.clip(width_height, 0, None)
+    inter = width_height.prod(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = np.where(inter > 0, inter / (area1[:, None] + area2[None, :] - inter), 0)
+    return iou.astype(np.float32)
+
+
+def _detectron_match(overlaps: np.ndarray, limit: int):
+    """
+    The matching of the Detectron proposal evaluation, that SourceEvaluator used with pairwise_iou before the
+    kernel, where torch's max returns the first of tied values
+    :return: The iou coverage of each gt box, and the overlap of the last match, None if there was none
+    """
+    overlaps = overlaps[:limit].copy()
+    gt_overlaps = np.zeros(overlaps.shape[1], dtype=np.float32)
+    last = None
+    for j in range(min(overlaps.shape[0], overlaps.shape[1])):
+        max_overlaps = overlaps.max(axis=0)
+        argmax_overlaps = overlaps.argmax(axis=0)
+        gt_ind = max_overlaps.argmax()
+        gt_ovr = max_overlaps[gt_ind]
+        box_ind = argmax_overlaps[gt_ind]
+        gt_overlaps[j] = overlaps[box_ind, gt_ind]
+        overlaps[box_ind, :] = -1
+        overlaps[:, gt_ind] = -1
+        last = gt_ovr
+    return gt_overlaps, last
+
+
+def _random_images(seed: int, num_images: int = 200):
+    """
+    IoU of random boxes on a coarse grid, so many overlaps tie, including images without gt or proposal boxes
+    """
+    rng = np.random.default_rng(seed)
+    image_overlaps = []
+    for _ in range(num_images):
+        num_preds = rng.integers(0, 15)
+        num_gts = rng.integers(0, 4)
+        preds = rng.integers(0, 6, size=(num_preds, 2)).astype(np.float32)
+        gts = rng.integers(0, 6, size=(num_gts, 2)).astype(np.float32)
+        preds = np.concatenate(
+            [preds, preds + rng.integers(1, 3, size=preds.shape)], axis=1
+        )
+        gts = np.concatenate([gts, gts + rng.integers(1, 3, size=gts.shape)], axis=1)
+        image_overlaps.append(_pairwise_iou(preds, gts))
+    return image_overlaps
+
+
+@pytest.mark.parametrize("match", MATCHERS)
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_greedy_match_matches_detectron_loop(match, seed):
+    image_overlaps = _random_images(seed)
+    pair_boxes, pair_gts, pair_overlaps, pair_offsets = sort_overlap_pairs(
+        image_overlaps
+    )
+    num_inds = np.asarray([o.shape[0] for o in image_overlaps], dtype=np.int64)
+    num_gts = np.asarray([o.shape[1] for o in image_overlaps], dtype=np.int64)
+    for limit in LIMITS:
+        matched, last = match(
+            pair_boxes,
+            pair_gts,
+            pair_overlaps,
+            pair_offsets,
+            np.minimum(num_inds, limit),
+            num_gts,
+        )
+        expected = [_detectron_match(overlaps, limit) for overlaps in image_overlaps]
+        np.testing.assert_array_equal(
+            matched, np.concatenate([gt_overlaps for gt_overlaps, _ in expected])
+        )
+        for image_last, (_, expected_last) in zip(last, expected):
+            if expected_last is None:
+                assert np.isnan(image_last)
+            else:
+                assert image_last == expected_last
+
+
+def test_sort_overlap_pairs_without_images():
+    pair_boxes, pair_gts, pair_overlaps, pair_offsets = sort_overlap_pairs([])
+    assert len(pair_boxes) == len(pair_gts) == len(pair_overlaps) == 0
+    np.testing.assert_array_equal(pair_offsets, [0])
+
+
+def _catalogue_points(seed: int, shape=(12, 9), num_points: int = 400):
+    """
+    Random catalogue values and pixel positions, with NaN, infinite and non-positive values, NaN positions, and
+    positions on and outside the edges of the layer
+    """
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-2, shape[0] + 2, num_points)
+    y = rng.uniform(-2, shape[1] + 2, num_points)
+    values = rng.uniform(0.1, 25, num_points)
+    values[rng.random(num_points) < 0.1] = np.nan
+    values[rng.random(num_points) < 0.05] = np.inf
+    values[rng.random(num_points) < 0.1] = 0.0
+    values[rng.random(num_points) < 0.1] *= -1
+    x[rng.random(num_points) < 0.05] = np.nan
+    y[rng.random(num_points) < 0.05] = np.nan
+    edges = rng.random(num_points) < 0.1
+    x[edges] = rng.choice([-1.0, -0.5, 0.0, shape[0] - 1e-9, shape[0]], edges.sum())
+    edges = rng.random(num_points) < 0.1
+    y[edges] = rng.choice([-1.0, -0.5, 0.0, shape[1] - 1e-9, shape[1]], edges.sum())
+    return x, y, values
+
+
+def _reference_layer(x, y, values, shape):
+    layer = np.zeros(shape)
+    for i in range(len(values)):
+        if not (np.isfinite(values[i]) and values[i] > 0):
+            continue
+        if 0 <= x[i] < shape[0] and 0 <= y[i] < shape[1]:
+            layer[int(np.floor(x[i])), int(np.floor(y[i]))] = values[i]
+    return layer
+
+
+@pytest.mark.parametrize("numba", [False] + ([True] if NUMBA_AVAILABLE else []))
+@pytest.mark.parametrize("dtype", [np.float16, np.float32, np.float64])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_make_catalogue_layer_matches_reference(monkeypatch, numba, dtype, seed):
+    shape = (12, 9)
+    x, y, values = _catalogue_points(seed, shape)
+    # Each pixel gets only one value, as numpy does not say which of repeated indices it keeps
+    _, first = np.unique(
+        np.stack([np.floor(np.nan_to_num(x)), np.floor(np.nan_to_num(y))]),
+        axis=1,
+        return_index=True,
+    )
+    x, y, values = x[first], y[first], values[first]
+    monkeypatch.setattr(datasets, "NUMBA_AVAILABLE", numba)
+    out = np.full(shape, 7.0, dtype=dtype)
+    layer = datasets.make_catalogue_layer(
+        "flux", None, shape, {"flux": values}, coords=(x, y), out=out
+    )
+    assert layer is out
+    np.testing.assert_array_equal(
+        layer, _reference_layer(x, y, values, shape).astype(dtype)
+    )
+
+
+def test_scatter_layer_later_values_overwrite():
+    layer = np.zeros((3, 3))
+    x = np.array([1.2, 1.7, 1.5, 2.5])
+    y = np.array([0.5, 0.1, 0.9, 3.0])
+    written = _scatter_layer(x, y, np.array([1.0, 2.0, -3.0, 4.0]), layer)
+    assert written == 2
+    assert layer[1, 0] == 2.0
+    assert np.count_nonzero(layer) == 1
+
+
+def _reference_binned_recall(X, Y, recalls, x_bin_edges, y_bin_edges, threshold):
+    n_sources = np.zeros((len(x_bin_edges) - 1, len(y_bin_edges) - 1), dtype=np.int64)
+    n_recalled = np.zeros_like(n_sources)
+    for x, y, recall in zip(X, Y, recalls):
+        for i in range(len(x_bin_edges) - 1):
+            for j in range(len(y_bin_edges) - 1):
+                if (
+                    x_bin_edges[i] < x < x_bin_edges[i + 1]
+                    and y_bin_edges[j] < y < y_bin_edges[j + 1]
+                ):
+                    n_sources[i, j] += 1
+                    n_recalled[i, j] += recall > threshold
+    return n_sources, n_recalled
+
+
+@pytest.mark.parametrize("numba", [False] + ([True] if NUMBA_AVAILABLE else []))
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_binned_recall_matches_reference(monkeypatch, numba, seed):
+    rng = np.random.default_rng(seed)
+    x_bin_edges = np.linspace(0, 10, 6)
+    y_bin_edges = np.array([0.0, 0.5, 2.0, 3.0, 7.5])
+    X = rng.uniform(-1, 11, 500)
+    Y = rng.uniform(-1, 8, 500)
+    # Points exactly on the edges, and NaN coordinates, are in no bin
+    X[:50] = rng.choice(x_bin_edges, 50)
+    Y[50:100] = rng.choice(y_bin_edges, 50)
+    X[100:120] = np.nan
+    Y[110:130] = np.nan
+    recalls = rng.choice([0.0, 0.5, 0.95, 1.0, np.nan], 500)
+    n_sources, n_recalled = _reference_binned_recall(
+        X, Y, recalls, x_bin_edges, y_bin_edges, 0.95
+    )
+    np.testing.assert_array_equal(
+        _count_in_bins(X, Y, recalls, x_bin_edges, y_bin_edges, 0.95),
+        (n_sources, n_recalled),
+    )
+    monkeypatch.setattr(metrics, "NUMBA_AVAILABLE", numba)
+    recall, counted = metrics._binned_recall(
+        X, Y, recalls, x_bin_edges, y_bin_edges, threshold=0.95
+    )
+    np.testing.assert_array_equal(counted, n_sources)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.testing.assert_array_equal(recall, n_recalled / n_sources)
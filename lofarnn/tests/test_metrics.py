@@ -0,0 +1,58 @@
+import json
+import os
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from lofarnn.visualization.metrics import plot_plots
+
+
+def _write_metrics(path):
+    with open(path, "w") as f:
+        for iteration in range(5):
+            f.write(
+                json.dumps(
+                    {
+                        "iteration": iteration,
+                        "total_loss": 1.0 / (iteration + 1),
+                        "validation_loss": 2.0 / (iteration + 1),
+                    }
+                )
+                + "\n"
+            )
+
+
+def _figure_times(output_dir):
+    return {
+        name: os.stat(os.path.join(output_dir, name)).st_mtime_ns
+        for name in os.listdir(output_dir)
+        if name.endswith(".png")
+    }
+
+
+def test_plots_redrawn_only_when_arguments_change(tmp_path, monkeypatch):
+    # plot_plots puts the metrics file names in the figure names
+    monkeypatch.chdir(tmp_path)
+    metrics_path = "metrics.json"
+    _write_metrics(metrics_path)
+    output_dir = tmp_path / "figures"
+    output_dir.mkdir()
+    args = dict(
+        metrics_files=[metrics_path],
+        experiment_name="exp",
+        experiment_dir=str(tmp_path),
+        cuts=["single_comp"],
+        title="test",
+        output_dir=str(output_dir),
+        dpi=20,
+    )
+    plot_plots(labels=["A"], colors=["red"], **args)
+    first = _figure_times(output_dir)
+    assert len(first) > 0
+    plot_plots(labels=["A"], colors=["red"], **args)
+    assert _figure_times(output_dir) == first
+    plot_plots(labels=["B"], colors=["blue"], **args)
+    redrawn = _figure_times(output_dir)
+    assert redrawn.keys() == first.keys()
+    assert all(redrawn[name] != first[name] for name in first)
@@ -1,25 +1,114 @@
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
 from multiprocessing import Manager, Pool
 from pathlib import Path
-from typing import List, Any, Optional, Union, Tuple
+from typing import List, Any, Dict, Optional, Union, Tuple
 
+import cv2
 import numpy as np
-from astropy.io import fits
 from astropy.nddata import Cutout2D
+from astropy.table import Table
 
 from lofarnn.data.cutouts import augment_image_and_bboxes, convert_to_valid_color
-from lofarnn.models.dataloaders.utils import get_lotss_objects
-from lofarnn.utils.common import create_coco_style_directory_structure, split_data
-from lofarnn.utils.fits import determine_visible_catalogue_source_and_separation
+from lofarnn.utils.common import (
+    create_coco_style_directory_structure,
+    load_cutout,
+    save_npy,
+    split_data,
+)
+from lofarnn.utils.fits import (
+    determine_visible_catalogue_source_and_separation,
+    load_fits_table,
+    open_catalogue,
+    share_table,
+    attach_shared_table,
+)
+from lofarnn.utils.kernels import NUMBA_AVAILABLE, scale_magnitudes
+
+# Columns of the PanSTARRS-ALLWISE catalogue used for the records, on top of the bands
+PAN_WISE_COLUMNS = ["objID", "AllWISE", "ra", "dec", "z_best"]
+# Columns of the value-added catalog needed to make the CNN sets, besides the size
+VAC_COLUMNS = ["Source_Name", "RA", "DEC", "objID", "AllWISE"]
+
+
+def _normalize_magnitudes_opencv(
+    magnitudes: np.ndarray, lower: float, upper: float
+) -> np.ndarray:
+    cv2.max(magnitudes, lower, dst=magnitudes)
+    cv2.min(magnitudes, upper, dst=magnitudes)
+    cv2.subtract(magnitudes, lower, dst=magnitudes)
+    cv2.multiply(magnitudes, 1.0 / (upper - lower), dst=magnitudes)
+    return magnitudes
+
+
+def _normalize_magnitudes_numpy(
+    magnitudes: np.ndarray, lower: float, upper: float
+) -> np.ndarray:
+    np.clip(magnitudes, lower, upper, out=magnitudes)
+    np.subtract(magnitudes, np.float32(lower), out=magnitudes)
+    np.multiply(magnitudes, np.float32(1.0 / (upper - lower)), out=magnitudes)
+    return magnitudes
+
+
+def normalize_magnitudes(
+    magnitudes: np.ndarray, lower: float = 10.0, upper: float = 28.0
+) -> np.ndarray:
+    """
+    Scale magnitudes to between 0 and 1 for 10 to 28 magnitude, in place
+
+    Uses the Numba kernel if numba is installed, otherwise OpenCV for contiguous float32 arrays, and numpy for the rest
+    :param magnitudes: Float32 array of magnitudes, as (objects, bands), without NaNs
+    :param lower: Magnitude that becomes 0
+    :param upper: Magnitude that becomes 1
+    :return: The same array, scaled
+    """
+    if magnitudes.size == 0:
+        return magnitudes
+    if NUMBA_AVAILABLE:
+        # One pass over the array, instead of one for each of clip, subtract, and multiply
+        return scale_magnitudes(magnitudes, lower, upper)
+    if magnitudes.dtype == np.float32 and magnitudes.flags.c_contiguous:
+        return _normalize_magnitudes_opencv(magnitudes, lower, upper)
+    return _normalize_magnitudes_numpy(magnitudes, lower, upper)
+
+
+def _fits_in_float16(image: np.ndarray) -> bool:
+    """
+    Whether every value of the image is either 0 or a normal float16 number, so it is stored to float16's precision
+    instead of overflowing, or becoming subnormal or 0
+    """
+    magnitudes = np.abs(image[image != 0])
+    if magnitudes.size == 0:
+        return True
+    return (
+        magnitudes.max() <= np.finfo(np.float16).max
+        and magnitudes.min() >= np.finfo(np.float16).tiny
+    )
+
+
+def save_cnn_image(
+    image_dest_filename: str, image: np.ndarray, half_precision: bool = False
+) -> None:
+    """
+    Save the CNN image, as float16 if half_precision is set and the values fit in it, halving its size on disk,
+    the loaders cast it back to float32
+    :param image_dest_filename: File to save the image to
+    :param image: The image to save
+    :param half_precision: Whether to try saving as float16, only meant for the normalized images
+    """
+    if half_precision and _fits_in_float16(image):
+        image = image.astype(np.float16)
+    np.save(image_dest_filename, image)
 
 
 def make_single_cnn_set(
     image_names: List[Path],
-    record_list: List[Any],
-    set_number: int,
+    record_list: Union[List[Any], Dict[bool, List[Any]]],
+    set_number: Union[int, List[int]],
     image_destination_dir: Optional[str],
-    pan_wise_location: str = "",
+    pan_wise_location: Union[str, tuple] = "",
     bands: List[str] = (
         "iFApMag",
         "w1Mag",
@@ -34,182 +123,271 @@ def make_single_cnn_set(
     resize: Optional[Union[int, List[int]]] = None,
     rotation: Optional[Union[List[float], float]] = None,
     convert: bool = False,
-    vac_catalog_location: str = "",
-    normalize: bool = True,
+    vac_catalog_location: Union[str, tuple, np.ndarray, Table] = "",
+    normalize: Union[bool, List[bool]] = True,
+    image_id_offset: int = 0,
     **kwargs,
 ):
-    pan_wise_catalog = fits.open(pan_wise_location, memmap=True)
-    pan_wise_catalog = pan_wise_catalog[1].data
-    vac_catalog = get_lotss_objects(vac_catalog_location, verbose=False)
-    for i, image_name in enumerate(image_names):
-        # Get image dimensions and insert them in a python dict
-        record_dest_filename = os.path.join(
-            image_destination_dir, image_name.stem + f".record.{normalize}.npy"
-        )
-        if convert:
-            image_dest_filename = os.path.join(
-                image_destination_dir, image_name.stem + f".cnn.{set_number}.png"
+    """
+    Make the CNN images and records for the given cutouts
+    :param vac_catalog_location: The value-added catalog, its location, or a handle to it in shared memory
+    :param record_list: List to append the records to, or a dict of lists keyed by normalization, if more than one
+    :param set_number: Which rotated copy to make, if a list, then makes all of those copies while only loading each
+    cutout once
+    :param normalize: Whether to normalize or not, if a list, then makes the images and records for each of those
+    while only loading each cutout once
+    :param image_id_offset: Image id of the first image, for when image_names is one chunk of all the images
+    """
+    pan_wise_catalog = open_catalogue(
+        pan_wise_location, columns=PAN_WISE_COLUMNS + list(bands)
+    )
+    vac_catalog = open_catalogue(
+        vac_catalog_location,
+        columns=VAC_COLUMNS + [kwargs.get("size_name", "LGZ_Size")],
+    )
+    normalizations = normalize if isinstance(normalize, (list, tuple)) else [normalize]
+    if not isinstance(record_list, dict):
+        record_list = {normalizations[0]: record_list}
+    set_numbers = (
+        set_number if isinstance(set_number, (list, tuple, range)) else [set_number]
+    )
+    for i, image_name in enumerate(image_names, start=image_id_offset):
+        # Shared between the copies and normalizations, only computed when first needed
+        radio = None
+        visible = None
+        for set_number, normalize in product(set_numbers, normalizations):
+            # Get image dimensions and insert them in a python dict
+            record_dest_filename = os.path.join(
+                image_destination_dir, image_name.stem + f".record.{normalize}.npy"
             )
-        else:
-            if rotation is not None and rotation.any() > 0:
+            if convert:
                 image_dest_filename = os.path.join(
-                    image_destination_dir,
-                    image_name.stem + f".cnn.{set_number}.{normalize}.npy",
-                )
-                wcs_dest_filename = os.path.join(
-                    image_destination_dir,
-                    image_name.stem + f".cnn.{set_number}.{normalize}.wcs.npy",
-                )
-                record_dest_filename = os.path.join(
-                    image_destination_dir,
-                    image_name.stem + f".record.{set_number}.{normalize}.npy",
+                    image_destination_dir, image_name.stem + f".cnn.{set_number}.png"
                 )
             else:
-                image_dest_filename = os.path.join(
-                    image_destination_dir, image_name.stem + f".cnn.{normalize}.npy"
+                if rotation is not None and rotation.any() > 0:
+                    image_dest_filename = os.path.join(
+                        image_destination_dir,
+                        image_name.stem + f".cnn.{set_number}.{normalize}.npy",
+                    )
+                    wcs_dest_filename = os.path.join(
+                        image_destination_dir,
+                        image_name.stem + f".cnn.{set_number}.{normalize}.wcs.npy",
+                    )
+                    record_dest_filename = os.path.join(
+                        image_destination_dir,
+                        image_name.stem + f".record.{set_number}.{normalize}.npy",
+                    )
+                else:
+                    image_dest_filename = os.path.join(
+                        image_destination_dir,
+                        image_name.stem + f".cnn.{normalize}.npy",
+                    )
+                    wcs_dest_filename = os.path.join(
+                        image_destination_dir,
+                        image_name.stem + f".cnn.{normalize}.wcs.npy",
+                    )
+            if not os.path.exists(os.path.join(image_dest_filename)):
+                if radio is None:
+                    (image, cutouts, proposal_boxes, wcs) = load_cutout(image_name)
+                    image = np.moveaxis(image, 0, 2)
+                    cutout = Cutout2D(
+                        image[:, :, 0],
+                        position=(int(image.shape[0] / 2), int(image.shape[1] / 2)),
+                        size=(int(image.shape[0]), int(image.shape[1])),
+                        wcs=wcs,
+                    )
+                    cutout_wcs = cutout.wcs
+                    # Cutouts can be saved as float16, which the OpenCV augmentations don't support
+                    image = np.nan_to_num(image.astype(np.float32, copy=False))
+                    # Need this to convert the bbox coordinates into the correct format
+                    (image, cutouts, proposal_boxes,) = augment_image_and_bboxes(
+                        image,
+                        cutouts=cutouts,
+                        proposal_boxes=proposal_boxes,
+                        angle=0,
+                        new_size=resize,
+                        verbose=False,
+                    )
+                    cutout_width, cutout_height, cutout_depth = np.shape(image)
+                    # First R (Radio) channel
+                    radio = image[:, :, 0]
+                wcs = cutout_wcs
+                width, height, depth = cutout_width, cutout_height, cutout_depth
+                image = convert_to_valid_color(
+                    np.copy(radio),
+                    clip=True,
+                    lower_clip=0.0,
+                    upper_clip=1000,
+                    normalize=normalize,
+                    scaling="sqrt",
                 )
-                wcs_dest_filename = os.path.join(
-                    image_destination_dir, image_name.stem + f".cnn.{normalize}.wcs.npy"
+                image_clip = convert_to_valid_color(
+                    np.copy(radio),
+                    clip=True,
+                    lower_clip=0.0,
+                    upper_clip=1000,
+                    normalize=normalize,
+                    scaling=None,
                 )
-        if not os.path.exists(os.path.join(image_dest_filename)):
-            (image, cutouts, proposal_boxes, wcs) = np.load(
-                image_name, allow_pickle=True
-            )  # mmap_mode might allow faster read
-            print(image.shape)
-            image = np.moveaxis(image, 0, 2)
-            cutout = Cutout2D(
-                image[:, :, 0],
-                position=(int(image.shape[0] / 2), int(image.shape[1] / 2)),
-                size=(int(image.shape[0]), int(image.shape[1])),
-                wcs=wcs,
-            )
-            wcs = cutout.wcs
-            image = np.nan_to_num(image)
-            # Need this to convert the bbox coordinates into the correct format
-            (image, cutouts, proposal_boxes,) = augment_image_and_bboxes(
-                image,
-                cutouts=cutouts,
-                proposal_boxes=proposal_boxes,
-                angle=0,
-                new_size=resize,
-                verbose=False,
-            )
-            width, height, depth = np.shape(image)
-
-            # First R (Radio) channel
-            image = image[:, :, 0]
-            image_clip = np.copy(image)
-            image_none = np.copy(image)
-            image = convert_to_valid_color(
-                image,
-                clip=True,
-                lower_clip=0.0,
-                upper_clip=1000,
-                normalize=normalize,
-                scaling="sqrt",
-            )
-            image_clip = convert_to_valid_color(
-                image_clip,
-                clip=True,
-                lower_clip=0.0,
-                upper_clip=1000,
-                normalize=normalize,
-                scaling=None,
-            )
-            image_none = convert_to_valid_color(
-                image_none,
-                clip=False,
-                normalize=False,
-                scaling="sqrt",
-            )
-            image = np.ma.filled(
-                image, fill_value=0.0
-            )  # convert back from masked array to normal array
-            image_clip = np.ma.filled(
-                image_clip, fill_value=0.0
-            )  # convert back from masked array to normal array
-            image_none = np.ma.filled(
-                image_none, fill_value=0.0
-            )  # convert back from masked array to normal array
-            # Now restack into 3 channel image
-            image = np.dstack((image, image_clip, image_none))
-            image = np.nan_to_num(image)  # Only take radio
-            np.save(image_dest_filename, image)  # Save to the final destination
-            np.save(wcs_dest_filename, wcs)
-        else:
-            image = np.load(image_dest_filename)
-            wcs = np.load(wcs_dest_filename, allow_pickle=True)
-            height, width, depth = np.shape(image)
+                image_none = convert_to_valid_color(
+                    np.copy(radio),
+                    clip=False,
+                    normalize=False,
+                    scaling="sqrt",
+                )
+                image = np.ma.filled(
+                    image, fill_value=0.0
+                )  # convert back from masked array to normal array
+                image_clip = np.ma.filled(
+                    image_clip, fill_value=0.0
+                )  # convert back from masked array to normal array
+                image_none = np.ma.filled(
+                    image_none, fill_value=0.0
+                )  # convert back from masked array to normal array
+                # Now restack into 3 channel image
+                image = np.dstack((image, image_clip, image_none))
+                image = np.nan_to_num(image)  # Only take radio
+                save_cnn_image(
+                    image_dest_filename, image, half_precision=normalize
+                )  # Save to the final destination
+                save_npy(wcs_dest_filename, wcs)
+            else:
+                image = np.load(image_dest_filename)
+                wcs = np.load(wcs_dest_filename, allow_pickle=True)
+                height, width, depth = np.shape(image)
 
-        record = {
-            "file_name": image_dest_filename,
-            "image_id": i,
-            "height": height,
-            "width": width,
-            "depth": depth,
-        }
-        if not os.path.exists(os.path.join(record_dest_filename)):
-            source = vac_catalog[vac_catalog["Source_Name"] == image_name.stem]
-            # All optical sources in 150 arcsecond radius of the point
-            (
-                objects,
-                distances,
-                angles,
-                source_coords,
-                sky_coords,
-            ) = determine_visible_catalogue_source_and_separation(
-                source["RA"],
-                source["DEC"],
-                np.max([source[kwargs.get("size_name", "LGZ_Size")] * 1.5 / 3600.0, 30./3600.]), # 20. is min cutout size
-                pan_wise_catalog,
-            )
-            # Sort from closest to farthest distance
-            idx = np.argsort(distances)
-            objects = objects[idx]
-            distances = distances[idx]
-            angles = angles[idx]
-            sky_coords = sky_coords[idx]
-            optical_sources = []
-            optical_labels = []
-            for j, obj in enumerate(objects):
-                optical_sources.append([])
+            record = {
+                "file_name": image_dest_filename,
+                "image_id": i,
+                "height": height,
+                "width": width,
+                "depth": depth,
+            }
+            if not os.path.exists(os.path.join(record_dest_filename)):
+                if visible is None:
+                    source = vac_catalog[vac_catalog["Source_Name"] == image_name.stem]
+                    # All optical sources in 150 arcsecond radius of the point
+                    (
+                        objects,
+                        distances,
+                        angles,
+                        source_coords,
+                        sky_coords,
+                    ) = determine_visible_catalogue_source_and_separation(
+                        source["RA"],
+                        source["DEC"],
+                        np.max(
+                            [
+                                source[kwargs.get("size_name", "LGZ_Size")]
+                                * 1.5
+                                / 3600.0,
+                                30.0 / 3600.0,
+                            ]
+                        ),  # 20. is min cutout size
+                        pan_wise_catalog,
+                    )
+                    # Sort from closest to farthest distance
+                    idx = np.argsort(distances)
+                    objects = objects[idx]
+                    # Magnitudes of every band for all the objects at once, as (objects, bands)
+                    magnitudes = np.nan_to_num(
+                        np.column_stack(
+                            [np.asarray(objects[layer]) for layer in bands]
+                        ).astype(np.float32),
+                        copy=False,
+                    )
+                    visible = (
+                        objects,
+                        distances[idx],
+                        angles[idx],
+                        source_coords,
+                        sky_coords[idx],
+                        magnitudes,
+                    )
+                (
+                    objects,
+                    distances,
+                    angles,
+                    source_coords,
+                    sky_coords,
+                    magnitudes,
+                ) = visible
+                if normalize:
+                    magnitudes = normalize_magnitudes(np.copy(magnitudes))
                 # 999999 == '' in source for AllWISE
-                print(f"Object: {obj['objID']} Source: {source['objID'].data[0]} \n {obj['AllWISE']} {source['AllWISE'].data[0]}")
-                if (
-                    obj["objID"] == source["objID"].data[0]
-                    and obj["AllWISE"] == source["AllWISE"].data[0]
-                ):
-                    optical_labels.append(1)  # Optical Source
+                source_obj_id = source["objID"][0]
+                source_all_wise = source["AllWISE"][0]
+                # 1 for the Optical Source, 0 otherwise, matching all the objects at once
+                optical_labels = (
+                    (
+                        (np.asarray(objects["objID"]) == source_obj_id)
+                        & (np.asarray(objects["AllWISE"]) == source_all_wise)
+                    )
+                    .astype(int)
+                    .tolist()
+                )
+                optical_sources = []
+                for j, obj in enumerate(objects):
+                    optical_sources.append([])
+                    optical_sources[-1].append(obj["objID"])
+                    optical_sources[-1].append(obj["AllWISE"])
+                    optical_sources[-1].append(obj["ra"])
+                    optical_sources[-1].append(obj["dec"])
+                    optical_sources[-1].append(distances[j])
+                    optical_sources[-1].append(angles[j])
+                    optical_sources[-1].append(obj["z_best"])
+                    optical_sources[-1].extend(magnitudes[j])
+                record["optical_sources"] = optical_sources
+                record["optical_labels"] = optical_labels
+                record["source_skycoord"] = source_coords
+                record["optical_skycoords"] = sky_coords
+                record["wcs"] = wcs
+                if rotation is not None:
+                    record["rotation"] = rotation[set_number]
                 else:
-                    optical_labels.append(0)
-                optical_sources[-1].append(obj["objID"])
-                optical_sources[-1].append(obj["AllWISE"])
-                optical_sources[-1].append(obj["ra"])
-                optical_sources[-1].append(obj["dec"])
-                optical_sources[-1].append(distances[j])
-                optical_sources[-1].append(angles[j])
-                optical_sources[-1].append(obj["z_best"])
-                for layer in bands:
-                    value = np.nan_to_num(obj[layer])
-                    if normalize:  # Scale to between 0 and 1 for 10 to 28 magnitude
-                        value = np.clip(value, 10.0, 28.0)
-                        value = (value - 10.0) / (28.0 - 10.0)
-                    optical_sources[-1].append(value)
-            record["optical_sources"] = optical_sources
-            record["optical_labels"] = optical_labels
-            record["source_skycoord"] = source_coords
-            record["optical_skycoords"] = sky_coords
-            record["wcs"] = wcs
-            if rotation is not None:
-                record["rotation"] = rotation[set_number]
+                    record["rotation"] = 0.0
+                save_npy(record_dest_filename, record)
             else:
-                record["rotation"] = 0.0
-            np.save(record_dest_filename, record)
-        else:
-            record = np.load(record_dest_filename, fix_imports=True, allow_pickle=True)
+                record = np.load(
+                    record_dest_filename, fix_imports=True, allow_pickle=True
+                )
 
-        # Now add the labels, so need to know which optical source is the true one
-        record_list.append(record)
+            # Now add the labels, so need to know which optical source is the true one
+            record_list[normalize].append(record)
+
+
+def save_cnn_annotations(
+    record_lists: Dict[bool, List[Any]],
+    json_dir: str,
+    json_name: str,
+    verbose: bool = False,
+):
+    """
+    Write the records for each normalization to their own annotation file
+    :param record_lists: Dict of the records, keyed by the normalization
+    :param json_dir: The directory where to put the annotation files
+    :param json_name: The name of the annotation file, formatted with the normalization
+    """
+    for normalize, records in record_lists.items():
+        # List to store single dict for each image
+        dataset_dicts = []
+        print(f"Length of L: {len(records)}")
+        for element in records:
+            dataset_dicts.append(element)
+        print(f"Length of Dataset Dict: {len(dataset_dicts)}")
+        # Write all image dictionaries to file as one json
+        json_path = os.path.join(json_dir, json_name.format(normalize=normalize))
+        # Pickle in memory and write the file in one go
+        with open(json_path, "wb") as outfile:
+            outfile.write(pickle.dumps(dataset_dicts, protocol=pickle.HIGHEST_PROTOCOL))
+    if verbose:
+        print(f"CNN annotation file created in '{json_dir}'.\n")
+
+
+def _attach_shared_tables(*handles):
+    for handle in handles:
+        attach_shared_table(handle)
 
 
 def create_cnn_annotations(
@@ -243,11 +421,12 @@ def create_cnn_annotations(
     :param image_names: Image names, i.e., the source names
     :param image_destination_dir: The directory the images will end up in
     :param json_dir: The directory where to put the JSON annotation file
-    :param json_name: The name of the JSON file
+    :param json_name: The name of the JSON file, "{normalize}" in it is replaced by the normalization
     :param bands: The bands to include in the source
     :param rotation: Whether to rotate the images or not, if given as a tuple, it is taken as rotate each image by that amount,
     if a single float, then rotates images randomly between -rotation,rotation 50 times
     :param convert: Whether to convert to PNG files (default), or leave them as NPY files
+    :param normalize: Whether to normalize, or a list of normalizations to create in a single pass
     :return:
     """
 
@@ -275,20 +454,30 @@ def create_cnn_annotations(
     else:
         single_names = image_names
         extra_names = []
-    # List to store single dict for each image
-    dataset_dicts = []
+    normalizations = normalize if isinstance(normalize, (list, tuple)) else [normalize]
     if num_copies > 1:
         manager = Manager()
-        pool = Pool(processes=os.cpu_count())
-        L = manager.list()
+        # Attach each worker to the shared catalogues once, instead of per task
+        pool = Pool(
+            processes=os.cpu_count(),
+            initializer=_attach_shared_tables,
+            initargs=[
+                c
+                for c in (pan_wise_location, vac_catalog_location)
+                if isinstance(c, tuple)
+            ],
+        )
+        L = {norm: manager.list() for norm in normalizations}
         rotation = np.linspace(0, 170, num_copies)
+        # Each task makes every copy of its cutouts, so each cutout is only loaded once
+        num_chunks = os.cpu_count()
         [
             pool.apply_async(
                 make_single_cnn_set,
                 args=[
-                    single_names,
+                    list(names),
                     L,
-                    m,
+                    list(range(num_copies)),
                     image_destination_dir,
                     pan_wise_location,
                     bands,
@@ -299,9 +488,9 @@ def create_cnn_annotations(
                     normalize,
                 ],
             )
-            for m in range(num_copies)
+            for names in np.array_split(np.asarray(single_names), num_chunks)
+            if len(names) > 0
         ]
-        print(len(L))
         # Now do the same for the extra copies, but with more rotations, ~2.5 to equal out multi and single comp sources
         num_multi_copies = int(np.ceil(num_copies * 2.5))
         print(f"Num Multi Copies: {num_multi_copies}")
@@ -310,70 +499,64 @@ def create_cnn_annotations(
             pool.apply_async(
                 make_single_cnn_set,
                 args=[
-                    extra_names,
+                    list(names),
                     L,
-                    m,
+                    list(range(num_multi_copies)),
                     image_destination_dir,
                     pan_wise_location,
                     bands,
                     resize,
                     multi_rotation,
                     convert,
-                    bands,
                     vac_catalog_location,
                     normalize,
                 ],
             )
-            for m in range(num_multi_copies)
+            for names in np.array_split(np.asarray(extra_names), num_chunks)
+            if len(names) > 0
         ]
         pool.close()
         pool.join()
-        print(len(L))
-        print(f"Length of L: {len(L)}")
-        for element in L:
-            dataset_dicts.append(element)
-        print(f"Length of Dataset Dict: {len(dataset_dicts)}")
-        # Write all image dictionaries to file as one json
-        json_path = os.path.join(json_dir, json_name)
-        with open(json_path, "wb") as outfile:
-            pickle.dump(dataset_dicts, outfile)
-        if verbose:
-            print(f"CNN annotation file created in '{json_dir}'.\n")
+        save_cnn_annotations(L, json_dir, json_name, verbose=verbose)
         return 0  # Returns to doesnt go through it again
 
     # Iterate over all cutouts and their objects (which contain bounding boxes and class labels)
-    manager = Manager()
-    pool = Pool(processes=os.cpu_count())
-    L = manager.list()
-    for name in image_names:
-        # x = pool.apply_async(
-        make_single_cnn_set(
-            [name],
-            L,
-            0,
-            image_destination_dir,
-            pan_wise_location,
-            bands,
-            resize,
-            None,
-            convert,
-            vac_catalog_location,
-            normalize,
-        )
-        # )
-        # x.get()
-    pool.close()
-    pool.join()
-    print(len(L))
-    print(f"Length of L: {len(L)}")
-    for element in L:
-        dataset_dicts.append(element)
-    # Write all image dictionaries to file as one json
-    json_path = os.path.join(json_dir, json_name)
-    with open(json_path, "wb") as outfile:
-        pickle.dump(dataset_dicts, outfile)
-    if verbose:
-        print(f"CNN annotation file created in '{json_dir}'.\n")
+    # Loading and transforming the cutouts is mostly I/O and numpy, so use threads, which share the catalogues and
+    # records instead of pickling them between processes. Each chunk makes its own records, so they keep the same
+    # order and image ids as going through all the cutouts in one loop
+    num_workers = os.cpu_count()
+    chunks = [
+        chunk
+        for chunk in np.array_split(np.arange(len(image_names)), num_workers)
+        if len(chunk) > 0
+    ]
+    chunk_records = [{norm: [] for norm in normalizations} for _ in chunks]
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(
+                make_single_cnn_set,
+                [image_names[i] for i in chunk],
+                records,
+                0,
+                image_destination_dir,
+                pan_wise_location,
+                bands,
+                resize,
+                None,
+                convert,
+                vac_catalog_location,
+                normalize,
+                image_id_offset=int(chunk[0]),
+            )
+            for chunk, records in zip(chunks, chunk_records)
+        ]
+        for future in futures:
+            future.result()
+    L = {norm: [] for norm in normalizations}
+    for records in chunk_records:
+        for norm in normalizations:
+            L[norm].extend(records[norm])
+    save_cnn_annotations(L, json_dir, json_name, verbose=verbose)
 
 
 def create_cnn_dataset(
@@ -394,11 +577,12 @@ def create_cnn_dataset(
         "w3Mag",
         "w4Mag",
     ),
-    vac_catalog: str = "",
-    normalize: bool = True,
+    vac_catalog: Union[str, np.ndarray, Table] = "",
+    normalize: Union[bool, List[bool]] = True,
     subset: str = "",
-    multi_rotate_only: Optional[Union[List[str], str]] = None,
+    multi_rotate_only: Optional[Union[str, np.ndarray, Table]] = None,
     verbose: bool = False,
+    cache_dir: Optional[str] = None,
     **kwargs,
 ):
     """
@@ -410,7 +594,13 @@ def create_cnn_dataset(
     :param resize: Image size to resize to, or None if not resizing
     :param convert: Whether to convert npy files to png, or to keep them in the original format, useful for SourceMapper
     :param verbose: Whether to print more data to stdout or not
+    :param vac_catalog: The value-added catalog, or its location
+    :param normalize: Whether to normalize, or a list, e.g. [True, False], to make each of them while only loading each
+    cutout once
     :param subset: Whether to limit ones to only the fluxlimit sources, if not empty, should be path to list of source filepaths to use
+    :param multi_rotate_only: Catalog, or its location, whose multi-component sources get extra rotated copies, if it is
+    the same as vac_catalog, that is reused instead of loaded again
+    :param cache_dir: Directory to keep the decoded counterpart catalog in, so later runs skip decoding the FITS file
     :return:
     """
 
@@ -432,21 +622,64 @@ def create_cnn_dataset(
         for d in ["train", "test", "val"]:
             data_split[d] = data_split[d][np.isin(data_split[d], subset)]
         annotations_directory = os.path.join(annotations_directory, "subset")
-    if multi_rotate_only:
-        l_objects = get_lotss_objects(multi_rotate_only, False)
+    association_name = kwargs.get("association_name", "LGZ_Assoc")
+    if isinstance(multi_rotate_only, str) and not multi_rotate_only:
+        multi_rotate_only = None
+    vac_columns = VAC_COLUMNS + [kwargs.get("size_name", "LGZ_Size")]
+    if multi_rotate_only is not None:
+        # Only needed to find the multi-component sources
+        vac_columns.append(association_name)
+    # Load the VAC once, for both the multi-component sources and every set of annotations
+    vac_table = open_catalogue(vac_catalog, columns=vac_columns)
+    if isinstance(vac_table, Table):
+        vac_table = vac_table[vac_columns].as_array()
+    if multi_rotate_only is None:
+        l_objects = None
+    elif multi_rotate_only is vac_catalog or (
+        isinstance(multi_rotate_only, str) and multi_rotate_only == vac_catalog
+    ):
+        l_objects = vac_table
+    else:
+        l_objects = open_catalogue(
+            multi_rotate_only, columns=["Source_Name", association_name]
+        )
+    if l_objects is not None:
         # Get all multicomponent sources
-        l_objects = l_objects[
-            l_objects[kwargs.get("association_name", "LGZ_Assoc")] > 1
-        ]
-        multi_names = l_objects["Source_Name"].data
+        l_objects = l_objects[l_objects[association_name] > 1]
+        multi_names = np.asarray(l_objects["Source_Name"])
     else:
         multi_names = None
-    if len(data_split["val"]) > 0:
+    # Load the catalogue once and share it with every worker, instead of each loading their own copy
+    shm, counterpart_catalog = share_table(
+        load_fits_table(
+            counterpart_catalog,
+            columns=PAN_WISE_COLUMNS + list(bands),
+            cache_dir=cache_dir,
+        )
+    )
+    vac_shm, vac_catalog = share_table(vac_table)
+    try:
+        if len(data_split["val"]) > 0:
+            create_cnn_annotations(
+                data_split["val"],
+                json_dir=annotations_directory,
+                image_destination_dir=val_directory,
+                json_name="cnn_val_norm{normalize}_extra.pkl",
+                pan_wise_location=counterpart_catalog,
+                resize=resize,
+                rotation=None,
+                convert=convert,
+                normalize=normalize,
+                bands=bands,
+                vac_catalog_location=vac_catalog,
+                rotation_names=multi_names,
+                verbose=verbose,
+            )
         create_cnn_annotations(
-            data_split["val"],
+            data_split["train"],
             json_dir=annotations_directory,
-            image_destination_dir=val_directory,
-            json_name=f"cnn_val_norm{normalize}_extra.pkl",
+            image_destination_dir=train_directory,
+            json_name="cnn_train_test_norm{normalize}_extra.pkl",
             pan_wise_location=counterpart_catalog,
             resize=resize,
             rotation=None,
@@ -457,48 +690,38 @@ def create_cnn_dataset(
             rotation_names=multi_names,
             verbose=verbose,
         )
-    create_cnn_annotations(
-        data_split["train"],
-        json_dir=annotations_directory,
-        image_destination_dir=train_directory,
-        json_name=f"cnn_train_test_norm{normalize}_extra.pkl",
-        pan_wise_location=counterpart_catalog,
-        resize=resize,
-        rotation=None,
-        convert=convert,
-        normalize=normalize,
-        bands=bands,
-        vac_catalog_location=vac_catalog,
-        rotation_names=multi_names,
-        verbose=verbose,
-    )
-    create_cnn_annotations(
-        data_split["test"],
-        json_dir=annotations_directory,
-        image_destination_dir=test_directory,
-        json_name=f"cnn_test_norm{normalize}_extra.pkl",
-        pan_wise_location=counterpart_catalog,
-        resize=resize,
-        rotation=None,
-        convert=convert,
-        normalize=normalize,
-        bands=bands,
-        vac_catalog_location=vac_catalog,
-        rotation_names=multi_names,
-        verbose=verbose,
-    )
-    create_cnn_annotations(
-        data_split["train"],
-        json_dir=annotations_directory,
-        image_destination_dir=train_directory,
-        json_name=f"cnn_train_norm{normalize}_extra.pkl",
-        pan_wise_location=counterpart_catalog,
-        resize=resize,
-        rotation=rotation,
-        convert=convert,
-        normalize=normalize,
-        bands=bands,
-        vac_catalog_location=vac_catalog,
-        rotation_names=multi_names,
-        verbose=verbose,
-    )
+        create_cnn_annotations(
+            data_split["test"],
+            json_dir=annotations_directory,
+            image_destination_dir=test_directory,
+            json_name="cnn_test_norm{normalize}_extra.pkl",
+            pan_wise_location=counterpart_catalog,
+            resize=resize,
+            rotation=None,
+            convert=convert,
+            normalize=normalize,
+            bands=bands,
+            vac_catalog_location=vac_catalog,
+            rotation_names=multi_names,
+            verbose=verbose,
+        )
+        create_cnn_annotations(
+            data_split["train"],
+            json_dir=annotations_directory,
+            image_destination_dir=train_directory,
+            json_name="cnn_train_norm{normalize}_extra.pkl",
+            pan_wise_location=counterpart_catalog,
+            resize=resize,
+            rotation=rotation,
+            convert=convert,
+            normalize=normalize,
+            bands=bands,
+            vac_catalog_location=vac_catalog,
+            rotation_names=multi_names,
+            verbose=verbose,
+        )
+    finally:
+        shm.close()
+        shm.unlink()
+        vac_shm.close()
+        vac_shm.unlink()
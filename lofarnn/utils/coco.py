@@ -1,5 +1,5 @@
 import os
-import pickle
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Pool, Manager
 from pathlib import Path
 from typing import Optional, List, Tuple, Union, Any
@@ -9,8 +9,12 @@ from PIL import Image
 from detectron2.structures import BoxMode
 
 from lofarnn.data.cutouts import convert_to_valid_color, augment_image_and_bboxes
-from lofarnn.models.dataloaders.utils import get_lotss_objects
-from lofarnn.utils.common import create_coco_style_directory_structure, split_data
+from lofarnn.models.dataloaders.utils import get_lotss_objects, save_annotations
+from lofarnn.utils.common import (
+    create_coco_style_directory_structure,
+    load_cutout,
+    split_data,
+)
 
 
 def make_single_coco_annotation_set(
@@ -35,6 +39,7 @@ def make_single_coco_annotation_set(
     ),
     precomputed_proposals: bool = False,
     normalize: bool = True,
+    image_id_offset: int = 0,
 ):
     """
     For use with multiprocessing, goes through and does one rotation for the COCO annotations
@@ -48,9 +53,10 @@ def make_single_coco_annotation_set(
     :param bands: Whether to use all 10 channels, or just radio, iband, W1 band
     :param precomputed_proposals: Whether to create precomputed proposals
     :param normalize: Whether to normalize input data between 0 and 1
+    :param image_id_offset: Image id of the first image, for when image_names is one chunk of all the images
     :return:
     """
-    for i, image_name in enumerate(image_names):
+    for i, image_name in enumerate(image_names, start=image_id_offset):
         # Get image dimensions and insert them in a python dict
         if convert:
             image_dest_filename = os.path.join(
@@ -65,10 +71,9 @@ def make_single_coco_annotation_set(
                 image_dest_filename = os.path.join(
                     image_destination_dir, image_name.stem + f".npy"
                 )
-        (image, cutouts, proposal_boxes, wcs) = np.load(
-            image_name, allow_pickle=True
-        )  # mmap_mode might allow faster read
-        image = np.nan_to_num(image)
+        (image, cutouts, proposal_boxes, wcs) = load_cutout(image_name)
+        # Cutouts can be saved as float16, which the OpenCV augmentations don't support
+        image = np.nan_to_num(image.astype(np.float32, copy=False))
         # Change order to H,W,C for imgaug
         if rotation is not None:
             if isinstance(rotation, (list, tuple, np.ndarray)):
@@ -144,35 +149,23 @@ def make_single_coco_annotation_set(
         # Insert bounding boxes and their corresponding classes
         objs = []
         # check if there is no optical source
-        try:
-            if len(cutouts) > 0:  # There is an optical source
-                if not multiple_bboxes:
-                    cutouts = [
-                        cutouts[0]
-                    ]  # Only take the first one, the main optical source
-                for source_num, bbox in enumerate(cutouts):
-                    assert float(bbox[2]) >= float(bbox[0])
-                    assert float(bbox[3]) >= float(bbox[1])
-
-                    if bbox[4] == "Other Optical Source":
-                        category_id = 0
-                    else:
-                        category_id = 0
-                    obj = {
-                        "bbox": [
-                            float(bbox[0]),
-                            float(bbox[1]),
-                            float(bbox[2]),
-                            float(bbox[3]),
-                        ],
-                        "bbox_mode": BoxMode.XYXY_ABS,
-                        "category_id": category_id,  # For Optical Source
-                        "iscrowd": 0,
-                    }
-                    objs.append(obj)
-        except Exception as e:
-            print(e)
-            print("No Optical source found")
+        if len(cutouts) > 0:  # There is an optical source
+            if not multiple_bboxes:
+                # Only take the first one, the main optical source
+                cutouts = cutouts[:1]
+            boxes = np.array([bbox[:4] for bbox in cutouts], dtype=float)
+            # Drop the boxes with their max below their min in one compare, instead of asserting on each
+            valid = (boxes[:, 2] >= boxes[:, 0]) & (boxes[:, 3] >= boxes[:, 1])
+            if not valid.all():
+                print(f"Dropped {np.count_nonzero(~valid)} invalid boxes")
+            for box in boxes[valid]:
+                obj = {
+                    "bbox": box.tolist(),
+                    "bbox_mode": BoxMode.XYXY_ABS,
+                    "category_id": 0,  # For Optical Source
+                    "iscrowd": 0,
+                }
+                objs.append(obj)
         if precomputed_proposals:
             record["proposal_boxes"] = proposal_boxes
             record["proposal_objectness_logits"] = np.ones(len(proposal_boxes))
@@ -313,31 +306,48 @@ def create_coco_annotations(
         print(f"Length of Dataset Dict: {len(dataset_dicts)}")
         # Write all image dictionaries to file as one json
         json_path = os.path.join(json_dir, json_name)
-        with open(json_path, "wb") as outfile:
-            pickle.dump(dataset_dicts, outfile)
+        save_annotations(dataset_dicts, json_path)
         if verbose:
             print(f"COCO annotation file created in '{json_dir}'.\n")
         return 0  # Returns to doesnt go through it again
 
     # Iterate over all cutouts and their objects (which contain bounding boxes and class labels)
+    # Loading and transforming the cutouts is mostly I/O and numpy, so use threads, as for the CNN dataset. Each chunk
+    # makes its own records, so they keep the same order and image ids as going through all the cutouts in one loop
+    num_workers = os.cpu_count()
+    chunks = [
+        chunk
+        for chunk in np.array_split(np.arange(len(image_names)), num_workers)
+        if len(chunk) > 0
+    ]
     for m in range(num_copies):
-        make_single_coco_annotation_set(
-            image_names=image_names,
-            record_list=dataset_dicts,
-            set_number=m,
-            image_destination_dir=image_destination_dir,
-            multiple_bboxes=multiple_bboxes,
-            resize=resize,
-            rotation=rotation,
-            convert=convert,
-            bands=bands,
-            precomputed_proposals=precomputed_proposals,
-            normalize=normalize,
-        )
+        chunk_records = [[] for _ in chunks]
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [
+                executor.submit(
+                    make_single_coco_annotation_set,
+                    image_names=[image_names[i] for i in chunk],
+                    record_list=records,
+                    set_number=m,
+                    image_destination_dir=image_destination_dir,
+                    multiple_bboxes=multiple_bboxes,
+                    resize=resize,
+                    rotation=rotation,
+                    convert=convert,
+                    bands=bands,
+                    precomputed_proposals=precomputed_proposals,
+                    normalize=normalize,
+                    image_id_offset=int(chunk[0]),
+                )
+                for chunk, records in zip(chunks, chunk_records)
+            ]
+            for future in futures:
+                future.result()
+        for records in chunk_records:
+            dataset_dicts.extend(records)
     # Write all image dictionaries to file as one json
     json_path = os.path.join(json_dir, json_name)
-    with open(json_path, "wb") as outfile:
-        pickle.dump(dataset_dicts, outfile)
+    save_annotations(dataset_dicts, json_path)
     if verbose:
         print(f"COCO annotation file created in '{json_dir}'.\n")
 
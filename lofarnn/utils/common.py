@@ -1,4 +1,6 @@
+import io
 import os
+import pickle
 from pathlib import Path
 from typing import Any, Union, List, Tuple, Dict
 from zlib import crc32
@@ -6,6 +8,143 @@ from zlib import crc32
 import numpy as np
 
 
+def save_npy(filename: str, array: Any, allow_pickle: bool = True):
+    """
+    Save an array in .npy format, like np.save, but serialized into memory first and written to disk in one go
+
+    Object arrays, like the cutouts with their boxes and WCS, are otherwise pickled into the file in many small writes
+    :param filename: File to save to, .npy is appended if it is not already there, as with np.save
+    :param array: Array to save
+    :param allow_pickle: Whether to allow saving object arrays
+    """
+    if not str(filename).endswith(".npy"):
+        filename = f"{filename}.npy"
+    if isinstance(array, (list, tuple)):
+        # Lists of differently shaped parts, like the cutouts, are an object array with one part per element, which
+        # newer numpy no longer makes from the list itself
+        parts = array
+        array = np.empty(len(parts), dtype=object)
+        for i, part in enumerate(parts):
+            array[i] = part
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=allow_pickle)
+    with open(filename, "wb") as f:
+        f.write(buffer.getbuffer())
+
+
+def _boxes_to_arrays(boxes: Any) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split boxes of (xmin, ymin, xmax, ymax, class_name, (x, y)) into a float array of the numbers and the class names
+    """
+    coordinates = np.zeros((len(boxes), 6), dtype=np.float64)
+    labels = []
+    for i, box in enumerate(boxes):
+        coordinates[i, :4] = [float(value) for value in box[:4]]
+        coordinates[i, 4:] = [float(value) for value in box[5]]
+        labels.append(str(box[4]))
+    return coordinates, np.asarray(labels, dtype=str)
+
+
+def _arrays_to_boxes(coordinates: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """
+    Put the boxes split by _boxes_to_arrays back together, as the object array of rows the cutouts used to hold
+    """
+    if len(labels) == 0:
+        return np.array([])
+    boxes = np.empty((len(labels), 6), dtype=object)
+    for i, (coordinate, label) in enumerate(zip(coordinates, labels)):
+        boxes[i, :4] = coordinate[:4]
+        boxes[i, 4] = str(label)
+        boxes[i, 5] = (coordinate[4], coordinate[5])
+    return boxes
+
+
+def save_cutout(
+    filename: str,
+    image: np.ndarray,
+    bounding_boxes: Any,
+    proposal_boxes: Any,
+    wcs: Any,
+    compress: bool = True,
+):
+    """
+    Save a cutout as plain arrays in a .npz file, with the boxes as numbers and names and the WCS as its header, so
+    loading it does not need pickle, and the mostly empty catalogue layers compress well
+    :param filename: File to save to, .npz is appended if it is not already there
+    :param image: The cutout image
+    :param bounding_boxes: Boxes of (xmin, ymin, xmax, ymax, class_name, (x, y)) of the sources
+    :param proposal_boxes: Boxes of the same form of the proposals
+    :param wcs: WCS of the cutout
+    :param compress: Whether to compress the arrays
+    """
+    if not str(filename).endswith(".npz"):
+        filename = f"{filename}.npz"
+    bounding_box_coordinates, bounding_box_labels = _boxes_to_arrays(bounding_boxes)
+    proposal_box_coordinates, proposal_box_labels = _boxes_to_arrays(proposal_boxes)
+    buffer = io.BytesIO()
+    (np.savez_compressed if compress else np.savez)(
+        buffer,
+        image=image,
+        bounding_boxes=bounding_box_coordinates,
+        bounding_box_labels=bounding_box_labels,
+        proposal_boxes=proposal_box_coordinates,
+        proposal_box_labels=proposal_box_labels,
+        wcs=np.asarray(wcs.to_header_string()),
+    )
+    with open(filename, "wb") as f:
+        f.write(buffer.getbuffer())
+
+
+def load_cutout(filename: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Any]:
+    """
+    Load a cutout saved by save_cutout, or the older pickled .npy cutouts
+    :param filename: File to load
+    :return: The image, bounding boxes, proposal boxes, and WCS of the cutout
+    """
+    if not str(filename).endswith(".npz"):
+        image, bounding_boxes, proposal_boxes, wcs = np.load(
+            filename, allow_pickle=True
+        )
+        return image, bounding_boxes, proposal_boxes, wcs
+    from astropy.io import fits
+    from astropy.wcs import WCS
+
+    with np.load(filename) as data:
+        return (
+            data["image"],
+            _arrays_to_boxes(data["bounding_boxes"], data["bounding_box_labels"]),
+            _arrays_to_boxes(data["proposal_boxes"], data["proposal_box_labels"]),
+            WCS(fits.Header.fromstring(str(data["wcs"]))),
+        )
+
+
+def save_source_recalls(filename: str, recalls: Dict[str, float]):
+    """
+    Save the recall, or overlap, of each source as plain arrays in a .npz file, so loading them does not need pickle
+    :param filename: File to save to
+    :param recalls: Dict of source name to its recall
+    """
+    np.savez(
+        filename,
+        names=np.asarray(list(recalls.keys()), dtype=str),
+        recalls=np.asarray(list(recalls.values()), dtype=np.float32),
+    )
+
+
+def load_source_recalls(filename: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Load the recalls saved by save_source_recalls, or the older pickled dicts of them
+    :param filename: File to load
+    :return: Arrays of the source names and their recalls
+    """
+    if str(filename).endswith(".npz"):
+        with np.load(filename) as data:
+            return data["names"], data["recalls"]
+    with open(filename, "rb") as f:
+        recalls = pickle.load(f, fix_imports=True)
+    return np.asarray(list(recalls.keys())), np.asarray(list(recalls.values()))
+
+
 def mkdirs_safe(directory_list: list):
     """When given a list containing directories,
     checks if these exist, if not creates them."""
@@ -107,7 +246,8 @@ def split_data(
     :return: A dict containing which images go to which directory
     """
 
-    image_paths = Path(image_directory).rglob("*.npy")
+    # The cutouts are .npz files, or .npy from before that
+    image_paths = Path(image_directory).rglob("*.np[yz]")
     im_paths = []
     for p in image_paths:
         im_paths.append(p)
@@ -1,4 +1,11 @@
-from typing import Any, Tuple
+import bisect
+import hashlib
+import os
+import threading
+from functools import lru_cache
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple, Union
 
 import numpy as np
 from astropy import units as u
@@ -6,6 +13,154 @@ from astropy.coordinates import SkyCoord
 from astropy.io import fits
 from astropy.table import Table
 from astropy.wcs import WCS
+from numpy.lib.recfunctions import repack_fields
+from scipy.spatial import cKDTree
+
+try:
+    import fitsio
+except ImportError:
+    fitsio = None
+
+
+def load_fits_table(
+    path: str,
+    columns: Optional[List[str]] = None,
+    rows: Optional[Union[List[int], np.ndarray]] = None,
+    ext: int = 1,
+    cache_dir: Optional[str] = None,
+) -> np.ndarray:
+    """
+    Load a FITS table as a numpy structured array, reading only the columns and rows that are needed
+
+    Uses fitsio if it is installed, as cfitsio skips the columns that are not requested, otherwise falls back to astropy
+    :param path: Location of the FITS file
+    :param columns: Names of the columns to load, or None for all columns
+    :param rows: Indices of the rows to load, or None for all rows
+    :param ext: HDU of the table
+    :param cache_dir: If given, the decoded table is saved here as a .npy file the first time, and later loads memory
+    map that instead of decoding the FITS file again. The cache is keyed on the file's size and modification time as
+    well as the columns, so a changed FITS file is decoded again
+    :return: Numpy structured array of the table
+    """
+    if cache_dir is not None and rows is None:
+        stat = os.stat(path)
+        key = hashlib.blake2b(
+            repr(
+                (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, ext, columns)
+            ).encode(),
+            digest_size=8,
+        ).hexdigest()
+        cache_path = os.path.join(cache_dir, f"{Path(path).stem}.{key}.npy")
+        if os.path.exists(cache_path):
+            return np.load(cache_path, mmap_mode="r")
+        data = load_fits_table(path, columns=columns, ext=ext)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary file first, so a partly written cache is never loaded
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, data, allow_pickle=False)
+        os.replace(tmp_path, cache_path)
+        return data
+    if fitsio is not None:
+        with fitsio.FITS(path) as f:
+            data = f[ext].read(columns=columns, rows=rows)
+        if columns is not None:
+            # cfitsio matches column names case insensitively, keep the names as requested like FITS_rec would
+            names = {name.lower(): name for name in columns}
+            data.dtype.names = tuple(
+                names.get(name.lower(), name) for name in data.dtype.names
+            )
+            if data.dtype.names != tuple(columns):
+                # and in the requested order, instead of the order in the file
+                data = repack_fields(data[list(columns)])
+        return data
+    with fits.open(path, memmap=True) as f:
+        table = f[ext].data
+        if rows is not None:
+            table = table[rows]
+        if columns is None:
+            columns = table.columns.names
+        table = Table([table.field(name) for name in columns], names=columns)
+    table.convert_bytestring_to_unicode()
+    return table.as_array()
+
+
+# Shared memory blocks attached to in this process, keyed by name, kept so the arrays stay valid
+_shared_tables = {}
+# Threads of a process can attach at the same time, only one of them should open each block
+_shared_tables_lock = threading.Lock()
+
+
+def share_table(
+    table: np.ndarray,
+) -> Tuple[shared_memory.SharedMemory, Tuple[str, np.dtype, Tuple[int, ...]]]:
+    """
+    Copy a catalogue into shared memory, so worker processes can use it without each loading their own copy
+    :param table: Numpy structured array of the catalogue
+    :return: The SharedMemory block, which the caller should close and unlink once the workers are done, and the
+    handle to pass to the workers
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(table.nbytes, 1))
+    shared = np.ndarray(table.shape, dtype=table.dtype, buffer=shm.buf)
+    shared[...] = table
+    return shm, (shm.name, table.dtype, table.shape)
+
+
+def attach_shared_table(handle: Tuple[str, np.dtype, Tuple[int, ...]]) -> np.ndarray:
+    """
+    Get a zero-copy view of a catalogue put in shared memory by share_table, only attaching once per process
+    :param handle: Handle returned by share_table
+    :return: Numpy structured array backed by the shared memory
+    """
+    name, dtype, shape = handle
+    with _shared_tables_lock:
+        if name not in _shared_tables:
+            shm = shared_memory.SharedMemory(name=name)
+            _shared_tables[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+        return _shared_tables[name][1]
+
+
+def open_catalogue(
+    catalogue: Union[str, Tuple[str, np.dtype, Tuple[int, ...]], np.ndarray, Table],
+    columns: Optional[List[str]] = None,
+    cache_dir: Optional[str] = None,
+) -> Union[np.ndarray, Table]:
+    """
+    Get a catalogue from either its location, a handle from share_table, or the already loaded catalogue
+    :param catalogue: Location, shared memory handle, or catalogue
+    :param columns: Columns to load, if loading it from a file
+    :param cache_dir: Directory for the decoded catalogue, if loading it from a file, see load_fits_table
+    :return: The catalogue
+    """
+    if isinstance(catalogue, str):
+        return load_fits_table(catalogue, columns=columns, cache_dir=cache_dir)
+    if isinstance(catalogue, tuple):
+        return attach_shared_table(catalogue)
+    return catalogue
+
+
+def _get_ra_dec_columns(
+    catalogue: Union[Table, np.ndarray], names: Tuple[Tuple[str, str], ...]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the RA and DEC arrays from the first pair of column names that are in the catalogue
+    :param catalogue: Catalogue as an astropy Table, FITS_rec, or numpy structured array
+    :param names: Pairs of (RA, DEC) column names to try, in order
+    :return: RA and DEC as float arrays
+    """
+    if isinstance(catalogue, Table):
+        columns = catalogue.colnames
+    else:
+        columns = catalogue.dtype.names
+    # FITS_rec lookups are case insensitive, so match on lower case names
+    columns = {name.lower(): name for name in columns}
+    for ra_name, dec_name in names:
+        if ra_name.lower() in columns and dec_name.lower() in columns:
+            return (
+                np.array(catalogue[columns[ra_name.lower()]], dtype=float),
+                np.array(catalogue[columns[dec_name.lower()]], dtype=float),
+            )
+    raise KeyError(f"No RA and DEC columns found from {names}")
 
 
 def flatten(
@@ -23,15 +178,56 @@ def flatten(
     data
     This version also makes a sub-image of specified size.
     """
+    return _flatten(
+        f[hduid].header,
+        f[hduid].data.shape,
+        lambda index: f[hduid].data[index],
+        x,
+        y,
+        size,
+        channel=channel,
+        freqaxis=freqaxis,
+        verbose=verbose,
+    )
+
+
+def _read_fitsio_slice(hdu: Any, index: Tuple[Union[int, slice], ...]) -> np.ndarray:
+    """
+    Read only the part of a fitsio image HDU in index, as fitsio only slices with ranges
+    :param hdu: fitsio ImageHDU
+    :param index: Integers and slices, one per axis, in numpy order
+    :return: The data in index, with the axes of the integers removed like numpy indexing
+    """
+    ranges = tuple(np.s_[i : i + 1] if isinstance(i, int) else i for i in index)
+    squeeze = tuple(0 if isinstance(i, int) else np.s_[:] for i in index)
+    return hdu[ranges][squeeze]
+
+
+def _flatten(
+    header: fits.Header,
+    data_shape: Tuple[int, ...],
+    read: Callable[[Tuple[Union[int, slice], ...]], np.ndarray],
+    x: float,
+    y: float,
+    size: float,
+    channel: int = 0,
+    freqaxis: int = 3,
+    verbose: bool = True,
+    wcs: Optional[WCS] = None,
+) -> fits.HDUList:
+    """
+    Make the flattened sub-image of flatten from the header and shape of the image, reading only the sub-image
+    :param read: Function returning the data at a tuple index of the image
+    :param wcs: WCS of header, if it is already made, so the header isn't parsed again
+    """
 
-    naxis = f[hduid].header["NAXIS"]
+    naxis = header["NAXIS"]
     if naxis < 2:
         raise RuntimeError("Can't make map from this")
 
     if verbose:
-        print(f[hduid].data.shape)
-    data_shape = f[hduid].data.shape[-2:]
-    by, bx = data_shape
+        print(data_shape)
+    by, bx = data_shape[-2:]
     xmin = int(x - size / 2)
     if xmin < 0:
         xmin = 0
@@ -50,7 +246,7 @@ def flatten(
         print(xmin, xmax, ymin, ymax)
         raise RuntimeError("Failed to make subimage! Required position not on the map.")
 
-    w = WCS(f[hduid].header)
+    w = WCS(header) if wcs is None else wcs
     wn = WCS(naxis=2)
 
     wn.wcs.crpix[0] = w.wcs.crpix[0] - xmin
@@ -64,8 +260,8 @@ def flatten(
     wn.wcs.ctype[0] = w.wcs.ctype[0]
     wn.wcs.ctype[1] = w.wcs.ctype[1]
 
-    header = wn.to_header()
-    header["NAXIS"] = 2
+    sub_header = wn.to_header()
+    sub_header["NAXIS"] = 2
 
     slice = []
     for i in range(naxis, 0, -1):
@@ -80,18 +276,86 @@ def flatten(
     if verbose:
         print(slice)
 
-    hdu = fits.PrimaryHDU(f[hduid].data[tuple(slice)], header)
+    hdu = fits.PrimaryHDU(read(tuple(slice)), sub_header)
     copy = ("EQUINOX", "EPOCH", "BMAJ", "BMIN", "BPA")
     for k in copy:
-        r = f[hduid].header.get(k)
+        r = header.get(k)
         if r:
             hdu.header[k] = r
     if "TAN" in hdu.header["CTYPE1"]:
-        hdu.header["LATPOLE"] = f[hduid].header["CRVAL2"]
+        hdu.header["LATPOLE"] = header["CRVAL2"]
     hdulist = fits.HDUList([hdu])
     return hdulist
 
 
+@lru_cache(maxsize=8)
+def read_fits_header(filename: str, hduid: int = 0) -> Tuple[fits.Header, WCS]:
+    """
+    Read only the header of a FITS file, and make its WCS, once per file, as every cutout of a mosaic needs them
+
+    Uses fitsio if it is installed, which only reads the header cards, otherwise falls back to astropy
+    :param filename: Location of the FITS file
+    :param hduid: HDU to read the header of
+    :return: The header and its WCS, shared between calls so should not be modified
+    """
+    if fitsio is not None:
+        records = fitsio.read_header(filename, ext=hduid).records()
+        header = fits.Header.fromstring(
+            "".join(record["card_string"].ljust(80) for record in records)
+        )
+    else:
+        header = fits.getheader(filename, ext=hduid)
+    return header, WCS(header)
+
+
+def open_mosaic(filename: str) -> Any:
+    """
+    Open a mosaic to make many cutouts from, with fitsio if it is installed, otherwise memory mapped with astropy
+    :param filename: Location of the FITS file
+    :return: The open fitsio.FITS or astropy HDUList, which the caller should close
+    """
+    if fitsio is not None:
+        return fitsio.FITS(filename)
+    return fits.open(filename, memmap=True)
+
+
+def _cut_subimage(
+    mosaic: Any,
+    header: fits.Header,
+    x: float,
+    y: float,
+    size: int,
+    hduid: int = 0,
+    verbose: bool = True,
+    wcs: Optional[WCS] = None,
+) -> fits.HDUList:
+    """
+    Cut the flattened sub-image out of a mosaic opened with open_mosaic
+    :param mosaic: The open fitsio.FITS or astropy HDUList
+    :param header: Header of the mosaic
+    :param x: Pixel x of the center of the cutout
+    :param y: Pixel y of the center of the cutout
+    :param size: Size of the cutout in pixels
+    :param wcs: WCS of the mosaic, if it is already made
+    """
+    if isinstance(mosaic, fits.HDUList):
+        hdu = flatten(mosaic, x, y, size, hduid=hduid, verbose=verbose)
+        # Copy the cutout out of the memory map, so it stays valid after the file is closed
+        hdu[0].data = np.array(hdu[0].data)
+        return hdu
+    # cfitsio reads only the pixels of the cutout, and the header is already parsed
+    return _flatten(
+        header,
+        tuple(mosaic[hduid].get_dims()),
+        lambda index: _read_fitsio_slice(mosaic[hduid], index),
+        x,
+        y,
+        size,
+        verbose=verbose,
+        wcs=wcs,
+    )
+
+
 def extract_subimage(
     filename: str,
     ra: float,
@@ -99,25 +363,54 @@ def extract_subimage(
     size: float,
     hduid: int = 0,
     verbose: bool = True,
+    mosaic: Any = None,
 ) -> fits.HDUList:
+    """
+    Cut out a flattened sub-image of size degrees around ra and dec
+    :param filename: Location of the FITS file
+    :param mosaic: The file already opened with open_mosaic, so it isn't opened again for every cutout
+    """
     if verbose:
         print("Opening", filename)
-    orighdu = fits.open(filename)
-    psize = int((size / orighdu[hduid].header["CDELT2"]))
+    header, lwcs = read_fits_header(filename, hduid)
+    psize = int((size / header["CDELT2"]))
     if verbose:
         print(f"Size in Pixels: {psize}")
         print(f"Size in Arcseconds: {size}")
 
-    ndims = orighdu[hduid].header["NAXIS"]
+    ndims = header["NAXIS"]
     pvect = np.zeros((1, ndims))
-    lwcs = WCS(orighdu[hduid].header)
     pvect[0][0] = ra
     pvect[0][1] = dec
     imc = lwcs.wcs_world2pix(pvect, 0)
     x = imc[0][0]
     y = imc[0][1]
-    hdu = flatten(orighdu, x, y, psize, hduid=hduid, verbose=verbose)
-    return hdu
+    if mosaic is not None:
+        return _cut_subimage(
+            mosaic, header, x, y, psize, hduid=hduid, verbose=verbose, wcs=lwcs
+        )
+    with open_mosaic(filename) as mosaic:
+        return _cut_subimage(
+            mosaic, header, x, y, psize, hduid=hduid, verbose=verbose, wcs=lwcs
+        )
+
+
+def cutout_wcs(header: fits.Header, base_wcs: Optional[WCS] = None) -> WCS:
+    """
+    Get the WCS of a cutout made by extract_subimage, from the WCS of another cutout of the same mosaic if given
+
+    Cutouts of a mosaic only differ in their reference pixel and size, so those are changed on a copy of base_wcs
+    instead of parsing the whole header again
+    :param header: Header of the cutout
+    :param base_wcs: WCS of another cutout of the same mosaic
+    :return: WCS of the cutout
+    """
+    if base_wcs is None:
+        return WCS(header)
+    wcs = base_wcs.deepcopy()
+    wcs.wcs.crpix = [header["CRPIX1"], header["CRPIX2"]]
+    wcs.pixel_shape = (header["NAXIS1"], header["NAXIS2"])
+    return wcs
 
 
 def determine_visible_catalogue_source_and_separation(
@@ -134,12 +427,9 @@ def determine_visible_catalogue_source_and_separation(
     :return: Subcatalog of catalogue that only contains sources near the radio source in the cutout size, as well as
     SkyCoord of their world coordinates
     """
-    try:
-        ra_array = np.array(catalogue["RA"], dtype=float)
-        dec_array = np.array(catalogue["DEC"], dtype=float)
-    except:
-        ra_array = np.array(catalogue["ID_ra"], dtype=float)
-        dec_array = np.array(catalogue["ID_dec"], dtype=float)
+    ra_array, dec_array = _get_ra_dec_columns(
+        catalogue, (("RA", "DEC"), ("ID_ra", "ID_dec"))
+    )
     sky_coords = SkyCoord(ra_array, dec_array, unit="deg")
 
     source_coord = SkyCoord(ra, dec, unit="deg")
@@ -149,12 +439,9 @@ def determine_visible_catalogue_source_and_separation(
     idxcatalog = np.where(catalogmask)[0]
     objects = catalogue[idxcatalog]
 
-    try:
-        ra_array = np.array(objects["RA"], dtype=float)
-        dec_array = np.array(objects["DEC"], dtype=float)
-    except:
-        ra_array = np.array(objects["ID_ra"], dtype=float)
-        dec_array = np.array(objects["ID_dec"], dtype=float)
+    ra_array, dec_array = _get_ra_dec_columns(
+        objects, (("RA", "DEC"), ("ID_ra", "ID_dec"))
+    )
     sky_coords = SkyCoord(ra_array, dec_array, unit="deg")
     d2d = source_coord.separation(sky_coords)
     angles = source_coord.position_angle(sky_coords)
@@ -162,33 +449,130 @@ def determine_visible_catalogue_source_and_separation(
     return objects, d2d, angles, source_coord, sky_coords
 
 
+def _unit_sphere_xyz(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """
+    Convert RA and DEC to cartesian coordinates on the unit sphere
+    :param ra: RA in degrees
+    :param dec: DEC in degrees
+    :return: Array of shape (N, 3) of the XYZ coordinates
+    """
+    ra = np.deg2rad(np.asarray(ra, dtype=float))
+    dec = np.deg2rad(np.asarray(dec, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.stack([cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)], -1)
+
+
+def sort_catalogue_by_dec(catalogue: np.ndarray) -> np.ndarray:
+    """
+    Sort a catalogue by DEC, so catalogue_footprint only has to look at the rows in the DEC range of the sources
+    :param catalogue: Numpy structured array of the catalogue
+    :return: The sorted catalogue
+    """
+    return catalogue[np.argsort(catalogue["dec"], kind="stable")]
+
+
+def catalogue_footprint(
+    catalogue: Union[Table, np.ndarray],
+    ra: np.ndarray,
+    dec: np.ndarray,
+    radius: np.ndarray,
+    dec_sorted: bool = False,
+) -> np.ndarray:
+    """
+    Find the rows of the catalogue that could be within radius of any of the sources, so only that part of the
+    catalogue has to be copied and put in a KD tree
+
+    The rows are those inside the smallest circle around the sources' circles found here, limited to their DEC range
+    :param catalogue: Pan-AllWISE catalogue
+    :param ra: RA of the sources in degrees
+    :param dec: DEC of the sources in degrees
+    :param radius: Search radius of each source in degrees
+    :param dec_sorted: Whether the catalogue is sorted by DEC, from sort_catalogue_by_dec, so only the rows in the DEC
+    range of the sources are read, instead of the whole catalogue
+    :return: Sorted indices of the rows of the catalogue in the footprint of the sources
+    """
+    ra = np.atleast_1d(np.asarray(ra, dtype=float))
+    dec = np.atleast_1d(np.asarray(dec, dtype=float))
+    radius = np.broadcast_to(np.asarray(radius, dtype=float), dec.shape)
+    if len(dec) == 0:
+        return np.zeros(0, dtype=int)
+    source_xyz = _unit_sphere_xyz(ra, dec)
+    center = source_xyz.sum(axis=0)
+    center /= np.linalg.norm(center)
+    footprint_radius = np.max(
+        np.arccos(np.clip(source_xyz @ center, -1.0, 1.0)) + np.deg2rad(radius)
+    )
+    start, stop = 0, len(catalogue)
+    if dec_sorted:
+        dec_column = catalogue["dec"]
+        start = bisect.bisect_left(dec_column, np.min(dec - radius))
+        stop = bisect.bisect_right(dec_column, np.max(dec + radius), lo=start)
+    rows = np.arange(start, stop)
+    if footprint_radius >= np.pi:
+        return rows
+    ra_array = np.asarray(catalogue["ra"][start:stop], dtype=float)
+    dec_array = np.asarray(catalogue["dec"][start:stop], dtype=float)
+    return rows[
+        _unit_sphere_xyz(ra_array, dec_array) @ center >= np.cos(footprint_radius)
+    ]
+
+
+def build_catalogue_tree(ra_array: np.ndarray, dec_array: np.ndarray) -> cKDTree:
+    """
+    Build a KD tree of the catalogue on the unit sphere, so many cutouts can query it without going over every row
+    :param ra_array: RA of the catalogue sources in degrees
+    :param dec_array: DEC of the catalogue sources in degrees
+    :return: cKDTree of the unit sphere coordinates of the catalogue
+    """
+    return cKDTree(_unit_sphere_xyz(ra_array, dec_array))
+
+
+def determine_visible_catalogue_indices(
+    ra: float, dec: float, size: float, tree: cKDTree
+) -> np.ndarray:
+    """
+    Find the indices of the catalogue sources that are visible in the cutout
+    :param ra: Radio RA
+    :param dec: Radio DEC
+    :param size: Size of cutout in degrees
+    :param tree: KD tree of the catalogue from build_catalogue_tree
+    :return: Sorted indices into the catalogue of the sources near the radio source in the cutout size
+    """
+    source_xyz = _unit_sphere_xyz(
+        np.ravel(np.asarray(ra, dtype=float))[0],
+        np.ravel(np.asarray(dec, dtype=float))[0],
+    )
+    # Chord length on the unit sphere of the angular search radius
+    return np.sort(
+        np.asarray(
+            tree.query_ball_point(source_xyz, r=2 * np.sin(np.deg2rad(size) / 2)),
+            dtype=int,
+        )
+    )
+
+
 def determine_visible_catalogue_sources(
-    ra: float, dec: float, size: float, catalogue: Table, verbose=False
+    ra: float,
+    dec: float,
+    size: float,
+    catalogue: Table,
+    verbose=False,
+    tree: Optional[cKDTree] = None,
 ) -> Table:
     """
     Find the sources in the catalogue that are visible in the cutout, and returns a smaller catalogue for that
     :param ra: Radio RA
     :param dec: Radio DEC
-    :param wcs: WCS of Radio FITS files
     :param size: Size of cutout in degrees
     :param catalogue: Pan-AllWISE catalogue
-    :param l_objects: LOFAR Value Added Catalogue objects
-    :return: Subcatalog of catalogue that only contains sources near the radio source in the cutout size, as well as
-    SkyCoord of their world coordinates
+    :param tree: KD tree of the catalogue from build_catalogue_tree, built here if not given
+    :return: Subcatalog of catalogue that only contains sources near the radio source in the cutout size
     """
-    try:
-        ra_array = np.array(catalogue["ra"], dtype=float)
-        dec_array = np.array(catalogue["dec"], dtype=float)
-    except:
-        ra_array = np.array(catalogue["ID_ra"], dtype=float)
-        dec_array = np.array(catalogue["ID_dec"], dtype=float)
-    sky_coords = SkyCoord(ra_array, dec_array, unit="deg")
-
-    source_coord = SkyCoord(ra, dec, unit="deg")
-    search_radius = size * u.deg
-    d2d = source_coord.separation(sky_coords)
-    catalogmask = d2d < search_radius
-    idxcatalog = np.where(catalogmask)[0]
+    if tree is None:
+        tree = build_catalogue_tree(
+            *_get_ra_dec_columns(catalogue, (("ra", "dec"), ("ID_ra", "ID_dec")))
+        )
+    idxcatalog = determine_visible_catalogue_indices(ra, dec, size, tree)
     objects = catalogue[idxcatalog]
 
     return objects
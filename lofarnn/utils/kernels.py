@@ -0,0 +1,199 @@
+"""
+Numba kernels for the inner loops of the dataset creation, evaluation, and plotting. They are only compiled if numba is installed, callers
+should check NUMBA_AVAILABLE and fall back to numpy otherwise, except for greedy_match, which is the pure Python loop without numba
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None
+
+
+def _scale_magnitudes(magnitudes: np.ndarray, lower: float, upper: float) -> np.ndarray:
+    """
+    Scale magnitudes to between 0 and 1 for lower to upper magnitude in place, in a single pass, NaNs become 0
+    :param magnitudes: 2D float array of magnitudes, as (objects, bands)
+    :param lower: Magnitude that becomes 0
+    :param upper: Magnitude that becomes 1
+    :return: The same array, scaled
+    """
+    scale = 1.0 / (upper - lower)
+    for i in range(magnitudes.shape[0]):
+        for j in range(magnitudes.shape[1]):
+            value = magnitudes[i, j]
+            if np.isnan(value) or value <= lower:
+                magnitudes[i, j] = 0.0
+            elif value >= upper:
+                magnitudes[i, j] = 1.0
+            else:
+                magnitudes[i, j] = (value - lower) * scale
+    return magnitudes
+
+
+def _count_in_bins(
+    x: np.ndarray,
+    y: np.ndarray,
+    values: np.ndarray,
+    x_edges: np.ndarray,
+    y_edges: np.ndarray,
+    threshold: float,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the points strictly inside each 2D bin, and how many of those have a value above threshold, in one pass over
+    the points. Points on a bin edge, or with a NaN coordinate, are in no bin
+    :param x: X of the points
+    :param y: Y of the points
+    :param values: Value of each point
+    :param x_edges: Increasing edges of the bins along x
+    :param y_edges: Increasing edges of the bins along y
+    :param threshold: Values above this are counted
+    :return: Number of points, and number above the threshold, in each bin, as (x bins, y bins)
+    """
+    counts = np.zeros((x_edges.shape[0] - 1, y_edges.shape[0] - 1), dtype=np.int64)
+    above = np.zeros((x_edges.shape[0] - 1, y_edges.shape[0] - 1), dtype=np.int64)
+    for k in range(x.shape[0]):
+        i = -1
+        for b in range(x_edges.shape[0] - 1):
+            if x_edges[b] < x[k] < x_edges[b + 1]:
+                i = b
+                break
+        if i < 0:
+            continue
+        j = -1
+        for b in range(y_edges.shape[0] - 1):
+            if y_edges[b] < y[k] < y_edges[b + 1]:
+                j = b
+                break
+        if j < 0:
+            continue
+        counts[i, j] += 1
+        if values[k] > threshold:
+            above[i, j] += 1
+    return counts, above
+
+
+def sort_overlap_pairs(
+    image_overlaps: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Every (proposal box, gt box) pair of each image from the most to the least overlap, concatenated over the images,
+    as greedy_match takes them
+    Equal overlaps are ordered by gt box, then proposal box, so taking the first pair whose boxes are both unused picks
+    the same pairs, ties included, as repeatedly taking the best covered gt box, the first one if tied, and the first of
+    its best proposal boxes, as the Detectron proposal evaluation does
+    :param image_overlaps: IoU of each image, as (proposal boxes, gt boxes)
+    :return: Proposal box index, gt box index, and IoU of each pair, and the start of the pairs of each image and the end
+    of the last one
+    """
+    pair_boxes, pair_gts, pair_overlaps = [], [], []
+    for overlaps in image_overlaps:
+        overlaps = np.asarray(overlaps)
+        # Sort the transpose, so ties are ordered by the gt box first
+        order = np.argsort(-overlaps.T, axis=None, kind="stable")
+        image_gts, image_boxes = np.unravel_index(order, overlaps.T.shape)
+        pair_boxes.append(image_boxes)
+        pair_gts.append(image_gts)
+        pair_overlaps.append(overlaps.T.ravel()[order])
+    pair_offsets = np.cumsum([0] + [len(p) for p in pair_overlaps]).astype(np.int64)
+    if not image_overlaps:
+        return (
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.float32),
+            pair_offsets,
+        )
+    return (
+        np.concatenate(pair_boxes).astype(np.int64),
+        np.concatenate(pair_gts).astype(np.int64),
+        np.concatenate(pair_overlaps).astype(np.float32),
+        pair_offsets,
+    )
+
+
+def _greedy_match(
+    pair_boxes: np.ndarray,
+    pair_gts: np.ndarray,
+    pair_overlaps: np.ndarray,
+    pair_offsets: np.ndarray,
+    num_kept: np.ndarray,
+    num_gts: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Greedily match the proposal boxes to the gt boxes of many images, taking the pairs from the most to the least
+    overlap and skipping those where the proposal or gt box is already matched
+    The pairs of all the images are concatenated, those of image i are pair_offsets[i]:pair_offsets[i + 1]
+    :param pair_boxes: Proposal box index of each pair, sorted by decreasing overlap within each image, as from
+    sort_overlap_pairs
+    :param pair_gts: Gt box index of each pair
+    :param pair_overlaps: IoU of each pair
+    :param pair_offsets: Start of the pairs of each image, and the end of the last one
+    :param num_kept: Number of proposal boxes kept for each image, pairs with later boxes are skipped
+    :param num_gts: Number of gt boxes of each image
+    :return: The overlap of each match, as the concatenated num_gts of the images with 0 for unmatched gt boxes,
+    and the overlap of the last match of each image, NaN if it had none
+    """
+    num_images = num_kept.shape[0]
+    matched = np.zeros(np.sum(num_gts), dtype=np.float32)
+    last = np.full(num_images, np.nan, dtype=np.float32)
+    gt_offset = 0
+    for i in range(num_images):
+        num_matches = min(num_kept[i], num_gts[i])
+        used_boxes = np.zeros(num_kept[i], dtype=np.bool_)
+        used_gts = np.zeros(num_gts[i], dtype=np.bool_)
+        j = 0
+        for p in range(pair_offsets[i], pair_offsets[i + 1]):
+            if j == num_matches:
+                break
+            box = pair_boxes[p]
+            gt = pair_gts[p]
+            if box >= num_kept[i] or used_boxes[box] or used_gts[gt]:
+                continue
+            matched[gt_offset + j] = pair_overlaps[p]
+            last[i] = pair_overlaps[p]
+            j += 1
+            used_boxes[box] = True
+            used_gts[gt] = True
+        gt_offset += num_gts[i]
+    return matched, last
+
+
+def _scatter_layer(
+    x: np.ndarray, y: np.ndarray, values: np.ndarray, layer: np.ndarray
+) -> int:
+    """
+    Write the finite, positive values into the pixels of the layer at floor(x), floor(y) in one pass, skipping the
+    values whose pixel is not in the layer. Later values in the same pixel overwrite earlier ones
+    :param x: Pixel x of each value, the first axis of the layer
+    :param y: Pixel y of each value, the second axis of the layer
+    :param values: Values to write
+    :param layer: 2D float array written in place
+    :return: Number of values written
+    """
+    written = 0
+    for i in range(values.shape[0]):
+        value = values[i]
+        if not (np.isfinite(value) and value > 0.0):
+            continue
+        # floor(x) is in the layer exactly when 0 <= x < size, which is also False for NaN
+        if 0.0 <= x[i] < layer.shape[0] and 0.0 <= y[i] < layer.shape[1]:
+            layer[int(np.floor(x[i])), int(np.floor(y[i]))] = value
+            written += 1
+    return written
+
+
+if NUMBA_AVAILABLE:
+    # nogil, as the CNN sets are made from a thread pool
+    scale_magnitudes = njit(cache=True, nogil=True)(_scale_magnitudes)
+    count_in_bins = njit(cache=True, nogil=True)(_count_in_bins)
+    greedy_match = njit(cache=True, nogil=True)(_greedy_match)
+    scatter_layer = njit(cache=True, nogil=True)(_scatter_layer)
+else:
+    scale_magnitudes = None
+    count_in_bins = None
+    greedy_match = _greedy_match
+    scatter_layer = None
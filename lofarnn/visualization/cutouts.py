@@ -4,6 +4,8 @@ import matplotlib.patches as patches
 import matplotlib.pyplot as plt
 import numpy as np
 
+from lofarnn.utils.common import load_cutout
+
 
 def plot_cutout_and_bboxes(image_name: str, title: str) -> Tuple[plt.Figure, plt.Axes]:
     """
@@ -13,7 +15,7 @@ def plot_cutout_and_bboxes(image_name: str, title: str) -> Tuple[plt.Figure, plt
     :return:
     """
     print(image_name)
-    cutout_and_bboxes = np.load(image_name, allow_pickle=True)
+    cutout_and_bboxes = load_cutout(image_name)
     cutout = cutout_and_bboxes[0]
     bboxes = cutout_and_bboxes[1]
     fig, ax = plt.subplots(1)
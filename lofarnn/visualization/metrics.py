@@ -1,19 +1,237 @@
+import hashlib
 import json
 import os
-import pickle
+from functools import lru_cache
 
 import matplotlib.pyplot as plt
 import numpy as np
 
 from lofarnn.models.dataloaders.utils import get_lotss_objects
+from lofarnn.utils.common import load_source_recalls
+from lofarnn.utils.kernels import NUMBA_AVAILABLE, count_in_bins
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def load_json_arr(json_path):
-    lines = []
-    with open(json_path, "r") as f:
-        for line in f:
-            lines.append(json.loads(line))
-    return lines
+# (X, Y) properties of the sources the 2D recall is binned over
+AXIS_RECALL_PAIRS = [
+    ("Apparent size [arcsec]", ylabel)
+    for ylabel in ["Total flux [mJy]", "Axis ratio", "z", "Number of Components"]
+]
+
+
+def load_metrics(json_path):
+    """
+    Load a metrics file with one JSON dict per line, like the one written by Detectron2, into arrays
+
+    The arrays are cached until the file changes, so plotting the same experiments again does not parse them again
+    :param json_path: Location of the metrics file
+    :return: Dict of each metric to a read-only array over all the lines, NaN where a line does not have that metric
+    """
+    return _load_metrics(os.path.abspath(json_path), os.path.getmtime(json_path))
+
+
+@lru_cache(maxsize=32)
+def _load_metrics(json_path, mtime):
+    if orjson is not None:
+        with open(json_path, "rb") as f:
+            rows = [_loads_orjson(line) for line in f if line.strip()]
+    else:
+        with open(json_path, "r") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    # Fill in all the columns in one pass over the lines
+    metrics = {k: np.full(len(rows), np.nan) for k in set().union(*rows)}
+    for i, row in enumerate(rows):
+        for k, v in row.items():
+            metrics[k][i] = v
+    for v in metrics.values():
+        v.setflags(write=False)
+    return metrics
+
+
+def _loads_orjson(line):
+    """
+    Parse a line with orjson, falling back to json for lines orjson rejects, like those with NaN or Infinity
+    """
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return json.loads(line)
+
+
+def _get_metric(metrics, key):
+    """
+    Get a metric from load_metrics, or all NaN if it was never logged
+    """
+    if key in metrics:
+        return metrics[key]
+    return np.full(len(metrics.get("iteration", [])), np.nan)
+
+
+def _rebuild_key(key):
+    return hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+
+
+def needs_rebuild(out_png, *inputs, key=None):
+    """
+    Whether a figure has to be drawn again, because it does not exist, one of its inputs changed after it was saved,
+    or it was drawn with different arguments
+    :param out_png: Location of the figure
+    :param inputs: Locations of the files the figure is made from
+    :param key: The arguments the figure is drawn with, compared to those saved next to it by save_figure
+    :return: True if the figure should be made
+    """
+    if not os.path.exists(out_png):
+        return True
+    if key is not None:
+        key_path = out_png + ".key"
+        if not os.path.exists(key_path):
+            return True
+        with open(key_path, "r") as f:
+            if f.read() != _rebuild_key(key):
+                return True
+    saved = os.path.getmtime(out_png)
+    return any(os.path.getmtime(i) > saved for i in inputs)
+
+
+def save_figure(out_png, dpi=300, key=None):
+    """
+    Save the current figure, and the arguments it was drawn with next to it, for needs_rebuild
+    :param out_png: Location of the figure
+    :param dpi: DPI of the saved figure
+    :param key: The arguments the figure is drawn with
+    """
+    plt.savefig(out_png, dpi=dpi)
+    if key is not None:
+        with open(out_png + ".key", "w") as f:
+            f.write(_rebuild_key(key))
+
+
+def _evaluation_rows(metrics):
+    """
+    Keep only the lines of the metrics from the evaluations, i.e. those with a validation loss
+    """
+    mask = ~np.isnan(_get_metric(metrics, "validation_loss"))
+    return {k: v[mask] for k, v in metrics.items()}
+
+
+def _recall_key(experiment_name, split, limit, cut=None, metric="recall"):
+    """
+    Name of the own recall or precision metric for a split, limit, and cut, the limit of 1 is logged without a suffix
+    """
+    name = "own_recall" if limit == 1 else f"own_recall_{limit}"
+    if cut is not None:
+        name = f"{name}_{cut}"
+    return f"{experiment_name}_{split}/{name}/{metric}"
+
+
+def _finite(x, y):
+    """
+    Drop the points where y is NaN, so missing metrics are not plotted
+    """
+    mask = ~np.isnan(y)
+    return x[mask], y[mask]
+
+
+def decimate(x, y, n=2000):
+    """
+    Keep every k-th point, so that about n points are plotted, drawing more than the figure can show only costs time
+    :param x: X values
+    :param y: Y values
+    :param n: Number of points to keep
+    :return: The decimated x and y
+    """
+    if len(x) <= n:
+        return x, y
+    k = len(x) // n
+    return x[: k * n : k], y[: k * n : k]
+
+
+def _plottable(x, y, n=2000):
+    """
+    Drop the NaN points and decimate the rest to about n points
+    """
+    return decimate(*_finite(x, y), n=n)
+
+
+def _plot_envelope(x, y, n=2000, **kwargs):
+    """
+    Plot a series decimated to about n points, shading between the minimum and maximum of the points each one stands
+    for, so that spikes, like in the loss, still show
+    """
+    x, y = _finite(x, y)
+    if len(x) > n:
+        k = len(x) // n
+        buckets = y[: k * n].reshape(n, k)
+        plt.fill_between(
+            x[: k * n : k],
+            buckets.min(axis=1),
+            buckets.max(axis=1),
+            alpha=0.3,
+            color=kwargs.get("color"),
+            linewidth=0,
+        )
+    plt.plot(*decimate(x, y, n=n), **kwargs)
+
+
+def _recalls_in_catalog(recall_path, vac_catalog):
+    """
+    Load the recalls of the sources, keeping only those in the catalog
+    :param recall_path: Recalls saved by SourceEvaluator or the CNN test, either .npz or the older pickled dicts
+    :param vac_catalog: The value-added catalog
+    :return: Arrays of the source names and their recalls
+    """
+    names, recalls = load_source_recalls(recall_path)
+    mask = np.isin(names, vac_catalog["Source_Name"].data)
+    return names[mask], recalls[mask]
+
+
+def _source_properties(source_names, vac_catalog):
+    """
+    Look up the radio properties of the sources in the catalog, joining on the Source_Name for all of them at once
+    :param source_names: Names of the sources, all of which are in the catalog
+    :param vac_catalog: The value-added catalog
+    :return: Dict of each property to an array in the order of source_names
+    """
+    catalog_names = np.asarray(vac_catalog["Source_Name"])
+    order = np.argsort(catalog_names)
+    rows = order[np.searchsorted(catalog_names, source_names, sorter=order)]
+
+    def column(name):
+        return np.asarray(vac_catalog[name], dtype=float)[rows]
+
+    radio_apparent_size = column("LGZ_Size")
+    return {
+        "Axis ratio": radio_apparent_size / column("LGZ_Width"),
+        "Total flux [mJy]": column("Total_flux"),
+        "Apparent size [arcsec]": radio_apparent_size,
+        "z": column("z_best"),
+        "Number of Components": column("LGZ_Assoc"),
+        "quality": np.nan_to_num(column("LGZ_ID_Qual")),
+    }
+
+
+def _binned_fraction(Y, values, y_bin_edges, threshold=0.95):
+    """
+    Fraction of values above threshold, and the number of values, in every Y bin
+    Values on a bin edge, or with a NaN Y, are in no bin, and empty bins have a NaN fraction
+    If threshold is None, the mean of the values in every bin is returned instead
+    """
+    Y = np.asarray(Y, dtype=float)
+    values = np.asarray(values, dtype=float)
+    num_bins = len(y_bin_edges) - 1
+    # Index of the bin with y_bin_edges[j] < Y <= y_bin_edges[j + 1], then drop the ones on the upper edge
+    j = np.searchsorted(y_bin_edges, Y, side="left") - 1
+    in_bin = (j >= 0) & (j < num_bins)
+    in_bin[in_bin] &= Y[in_bin] < y_bin_edges[j[in_bin] + 1]
+    j = j[in_bin]
+    weights = values[in_bin] if threshold is None else values[in_bin] > threshold
+    counts = np.bincount(j, minlength=num_bins)
+    totals = np.bincount(j, weights=weights, minlength=num_bins)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return totals / counts, counts
 
 
 def plot_cutoffs(
@@ -25,102 +243,23 @@ def plot_cutoffs(
     name="",
     recall_names=["CNN", "Fast RCNN"],
 ):
-    data = pickle.load(open(recall_path, "rb"), fix_imports=True)
-    data2 = pickle.load(open(recall_path_2, "rb"), fix_imports=True)
-    baseline_data = pickle.load(open(baseline_path, "rb"), fix_imports=True)
     vac_catalog = get_lotss_objects(vac_catalog)
     qual = vac_catalog["LGZ_ID_Qual"]
-    pred_source_names = []
-    pred_source_recall = []
-    pred_source_names2 = []
-    pred_source_recall2 = []
-    baseline_names = []
-    baseline_recalls = []
     # vac_catalog = vac_catalog[vac_catalog["LGZ_Size"] > 15.0]
     # vac_catalog = vac_catalog[vac_catalog["Total_flux"] > 10.0]
-    for key in data.keys():
-        if key in vac_catalog["Source_Name"].data:
-            pred_source_names.append(key)
-            pred_source_recall.append(data[key])
-    for key in data2.keys():
-        if key in vac_catalog["Source_Name"].data:
-            pred_source_names2.append(key)
-            pred_source_recall2.append(data2[key])
-    for key in baseline_data.keys():
-        if key in vac_catalog["Source_Name"].data:
-            baseline_names.append(key)
-            baseline_recalls.append(baseline_data[key])
+    pred_source_names, pred_source_recall = _recalls_in_catalog(
+        recall_path, vac_catalog
+    )
+    pred_source_names2, pred_source_recall2 = _recalls_in_catalog(
+        recall_path_2, vac_catalog
+    )
+    baseline_names, baseline_recalls = _recalls_in_catalog(baseline_path, vac_catalog)
     pred_source_recall = np.asarray(pred_source_recall)
     pred_source_recall2 = np.asarray(pred_source_recall2)
     baseline_recalls = np.asarray(baseline_recalls)  # [:1630]
-    radio_apparent_size = np.zeros(len(pred_source_names))
-    radio_apparent_width = np.zeros(len(pred_source_names))
-    radio_total_flux = np.zeros(len(pred_source_names))
-    radio_z = np.zeros(len(pred_source_names))
-    radio_comp = np.zeros(len(pred_source_names))
-    quality = np.zeros(len(pred_source_names))
-    for i, source_name in enumerate(pred_source_names):
-        mask = source_name == vac_catalog["Source_Name"]
-        quality[i] = np.nan_to_num(vac_catalog[mask]["LGZ_ID_Qual"].data)
-        # get values
-        radio_apparent_size[i] = vac_catalog[mask]["LGZ_Size"].data
-        radio_apparent_width[i] = vac_catalog[mask]["LGZ_Width"].data
-        radio_total_flux[i] = vac_catalog[mask]["Total_flux"].data
-        radio_z[i] = vac_catalog[mask]["z_best"].data
-        radio_comp[i] = vac_catalog[mask]["LGZ_Assoc"].data
-    radio_axis_ratio = radio_apparent_size / radio_apparent_width
-    data_dict = {
-        "Axis ratio": radio_axis_ratio,
-        "Total flux [mJy]": radio_total_flux,
-        "Apparent size [arcsec]": radio_apparent_size,
-        "z": radio_z,
-        "Number of Components": radio_comp,
-        "quality": quality,
-    }
-    radio_apparent_size3 = np.zeros(len(pred_source_names2))
-    radio_apparent_width3 = np.zeros(len(pred_source_names2))
-    radio_total_flux3 = np.zeros(len(pred_source_names2))
-    radio_z3 = np.zeros(len(pred_source_names2))
-    radio_comp3 = np.zeros(len(pred_source_names2))
-    for i, source_name in enumerate(pred_source_names2):
-        mask = source_name == vac_catalog["Source_Name"]
-
-        # get values
-        radio_apparent_size3[i] = vac_catalog[mask]["LGZ_Size"].data
-        radio_apparent_width3[i] = vac_catalog[mask]["LGZ_Width"].data
-        radio_total_flux3[i] = vac_catalog[mask]["Total_flux"].data
-        radio_z3[i] = vac_catalog[mask]["z_best"].data
-        radio_comp3[i] = vac_catalog[mask]["LGZ_Assoc"].data
-    radio_axis_ratio3 = radio_apparent_size3 / radio_apparent_width3
-    data_dict2 = {
-        "Axis ratio": radio_axis_ratio3,
-        "Total flux [mJy]": radio_total_flux3,
-        "Apparent size [arcsec]": radio_apparent_size3,
-        "z": radio_z3,
-        "Number of Components": radio_comp3,
-    }
-    radio_apparent_size2 = np.zeros(len(baseline_names))
-    radio_apparent_width2 = np.zeros(len(baseline_names))
-    radio_total_flux2 = np.zeros(len(baseline_names))
-    radio_z2 = np.zeros(len(baseline_names))
-    radio_comp2 = np.zeros(len(baseline_names))
-    for i, source_name in enumerate(baseline_names):  # [:1630]):
-        mask = source_name == vac_catalog["Source_Name"]
-
-        # get values
-        radio_apparent_size2[i] = vac_catalog[mask]["LGZ_Size"].data
-        radio_apparent_width2[i] = vac_catalog[mask]["LGZ_Width"].data
-        radio_total_flux2[i] = vac_catalog[mask]["Total_flux"].data
-        radio_z2[i] = vac_catalog[mask]["z_best"].data
-        radio_comp2[i] = vac_catalog[mask]["LGZ_Assoc"].data
-    radio_axis_ratio2 = radio_apparent_size2 / radio_apparent_width2
-    baseline_data_dict = {
-        "Axis ratio": radio_axis_ratio2,
-        "Total flux [mJy]": radio_total_flux2,
-        "Apparent size [arcsec]": radio_apparent_size2,
-        "z": radio_z2,
-        "Number of Components": radio_comp2,
-    }
+    data_dict = _source_properties(pred_source_names, vac_catalog)
+    data_dict2 = _source_properties(pred_source_names2, vac_catalog)
+    baseline_data_dict = _source_properties(baseline_names, vac_catalog)
     pred_source_recall = np.array(pred_source_recall)
     pred_source_recall2 = np.array(pred_source_recall2)
     baseline_recalls = np.array(baseline_recalls)
@@ -144,30 +283,13 @@ def plot_cutoffs(
         # derive bin centers
         y_bin_width = y_bin_edges[1] - y_bin_edges[0]
         y_bin_centers = y_bin_edges[1:] - y_bin_width / 2
-        # now obtain recall
-        recall = np.zeros((y_bin_centers.shape[0]))
-        recall2 = np.zeros((y_bin_centers.shape[0]))
-        recall3 = np.zeros((y_bin_centers.shape[0]))
-        qualities = np.zeros((y_bin_centers.shape[0]))
-        num_sources = np.zeros((y_bin_centers.shape[0]))
-        for j in range(len(y_bin_centers)):
-            # get the prediction errors in a bin
-            bin_mask = (Y > y_bin_edges[j]) & (Y < y_bin_edges[j + 1])
-            bin_contents = pred_source_recall[bin_mask]
-            bin_quality = data_dict["quality"][bin_mask]
-            bin_contents2 = baseline_recalls[
-                (Y2 > y_bin_edges[j]) & (Y2 < y_bin_edges[j + 1])
-            ]
-            bin_contents3 = pred_source_recall2[
-                (Y3 > y_bin_edges[j]) & (Y3 < y_bin_edges[j + 1])
-            ]
-            # determine recall
-            # print(f"Bin Sum: {np.nansum(bin_contents > 0.95)}, len: {len(bin_contents)}")
-            recall[j] = np.nansum(bin_contents > 0.95) / len(bin_contents)
-            recall2[j] = np.nansum(bin_contents2 > 0.95) / len(bin_contents2)
-            recall3[j] = np.nansum(bin_contents3 > 0.95) / len(bin_contents3)
-            qualities[j] = np.nansum(bin_quality) / len(bin_quality)
-            num_sources[j] = len(bin_contents)
+        # now obtain recall, the quality, and the number of sources, in every bin at once
+        recall, num_sources = _binned_fraction(Y, pred_source_recall, y_bin_edges)
+        recall2, _ = _binned_fraction(Y2, baseline_recalls, y_bin_edges)
+        recall3, _ = _binned_fraction(Y3, pred_source_recall2, y_bin_edges)
+        qualities, _ = _binned_fraction(
+            Y, data_dict["quality"], y_bin_edges, threshold=None
+        )
         # Now plot
         fig, (ax3, ax1, ax2) = plt.subplots(
             3, 1, sharex="all", gridspec_kw={"height_ratios": [1, 3, 1], "hspace": 0}
@@ -215,8 +337,8 @@ def plot_cutoffs(
             ax1.text(x=72, y=0.5, s=s, size=8)
         ax1.legend(loc="best")
         fig.savefig(f"{ylabel}_Recall_{name}.png", dpi=300)
-        plt.clf()
-        plt.cla()
+        # Close, not just clear, the figure, otherwise pyplot keeps one per call
+        plt.close(fig)
         # Now read out recalls for apparent size
         if ylabel == "Apparent size [arcsec]":
             # Size cut
@@ -230,6 +352,31 @@ def plot_cutoffs(
             print(f"FRCNN Mean Recall > 70 arcseconds: {np.mean(recall3[mask])}")
 
 
+def _binned_recall(X, Y, recalls, x_bin_edges, y_bin_edges, threshold=0.95):
+    """
+    Recall, the fraction of sources with a recall above threshold, and the number of sources, in every (X, Y) bin
+    Sources on a bin edge, or with NaN X or Y, are in no bin, and empty bins have a NaN recall
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    Y = np.ascontiguousarray(Y, dtype=np.float64)
+    recalls = np.ascontiguousarray(recalls, dtype=np.float64)
+    x_bin_edges = np.ascontiguousarray(x_bin_edges, dtype=np.float64)
+    y_bin_edges = np.ascontiguousarray(y_bin_edges, dtype=np.float64)
+    if NUMBA_AVAILABLE:
+        n_sources, n_recalled = count_in_bins(
+            X, Y, recalls, x_bin_edges, y_bin_edges, threshold
+        )
+    else:
+        in_x = (X[:, None] > x_bin_edges[:-1]) & (X[:, None] < x_bin_edges[1:])
+        in_y = (
+            (Y[:, None] > y_bin_edges[:-1]) & (Y[:, None] < y_bin_edges[1:])
+        ).astype(np.int64)
+        n_sources = in_x.T.astype(np.int64) @ in_y
+        n_recalled = (in_x & (recalls > threshold)[:, None]).T.astype(np.int64) @ in_y
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return n_recalled / n_sources, n_sources
+
+
 def plot_compared_axis_recall(
     recall_path,
     recall_path_2,
@@ -247,190 +394,114 @@ def plot_compared_axis_recall(
     :param limit: str, limit for the recall value for use in saving, title, etc.
     :return:
     """
-    data = pickle.load(open(recall_path, "rb"), fix_imports=True)
-    data2 = pickle.load(open(recall_path_2, "rb"), fix_imports=True)
     vac_catalog = get_lotss_objects(vac_catalog)
-    pred_source_names = []
-    pred_source_recall = []
-    pred_source_names2 = []
-    pred_source_recall2 = []
     if jelle_cut:
         vac_catalog = vac_catalog[vac_catalog["LGZ_Size"] > 15.0]
         vac_catalog = vac_catalog[vac_catalog["Total_flux"] > 10.0]
-    for key in data.keys():
-        if key in vac_catalog["Source_Name"].data:
-            pred_source_names.append(key)
-            pred_source_recall.append(data[key])
-    for key in data2.keys():
-        if key in vac_catalog["Source_Name"].data:
-            pred_source_names2.append(key)
-            pred_source_recall2.append(data2[key])
+    pred_source_names, pred_source_recall = _recalls_in_catalog(
+        recall_path, vac_catalog
+    )
+    pred_source_names2, pred_source_recall2 = _recalls_in_catalog(
+        recall_path_2, vac_catalog
+    )
     pred_source_recall = np.asarray(pred_source_recall)
     pred_source_recall2 = np.asarray(pred_source_recall2)  # [:1630]
-    radio_apparent_size = np.zeros(len(pred_source_names))
-    radio_apparent_width = np.zeros(len(pred_source_names))
-    radio_total_flux = np.zeros(len(pred_source_names))
-    radio_z = np.zeros(len(pred_source_names))
-    radio_comp = np.zeros(len(pred_source_names))
-    for i, source_name in enumerate(pred_source_names):
-        mask = source_name == vac_catalog["Source_Name"]
-
-        # get values
-        radio_apparent_size[i] = vac_catalog[mask]["LGZ_Size"].data
-        radio_apparent_width[i] = vac_catalog[mask]["LGZ_Width"].data
-        radio_total_flux[i] = vac_catalog[mask]["Total_flux"].data
-        radio_z[i] = vac_catalog[mask]["z_best"].data
-        radio_comp[i] = vac_catalog[mask]["LGZ_Assoc"].data
-    radio_axis_ratio = radio_apparent_size / radio_apparent_width
-    data_dict = {
-        "Axis ratio": radio_axis_ratio,
-        "Total flux [mJy]": radio_total_flux,
-        "Apparent size [arcsec]": radio_apparent_size,
-        "z": radio_z,
-        "Number of Components": radio_comp,
-    }
-    radio_apparent_size2 = np.zeros(len(pred_source_names2))
-    radio_apparent_width2 = np.zeros(len(pred_source_names2))
-    radio_total_flux2 = np.zeros(len(pred_source_names2))
-    radio_z2 = np.zeros(len(pred_source_names2))
-    radio_comp2 = np.zeros(len(pred_source_names2))
-    for i, source_name in enumerate(pred_source_names2):  # [:1630]):
-        mask = source_name == vac_catalog["Source_Name"]
-
-        # get values
-        radio_apparent_size2[i] = vac_catalog[mask]["LGZ_Size"].data
-        radio_apparent_width2[i] = vac_catalog[mask]["LGZ_Width"].data
-        radio_total_flux2[i] = vac_catalog[mask]["Total_flux"].data
-        radio_z2[i] = vac_catalog[mask]["z_best"].data
-        radio_comp2[i] = vac_catalog[mask]["LGZ_Assoc"].data
-    radio_axis_ratio2 = radio_apparent_size2 / radio_apparent_width2
-    data_dict2 = {
-        "Axis ratio": radio_axis_ratio2,
-        "Total flux [mJy]": radio_total_flux2,
-        "Apparent size [arcsec]": radio_apparent_size2,
-        "z": radio_z2,
-        "Number of Components": radio_comp2,
-    }
+    data_dict = _source_properties(pred_source_names, vac_catalog)
+    data_dict2 = _source_properties(pred_source_names2, vac_catalog)
 
     ###calculate recall in bins
     # set which parameters you want to have on the X and Y axis
-    for xlabel in ["Apparent size [arcsec]"]:
-        for ylabel in ["Total flux [mJy]", "Axis ratio", "z", "Number of Components"]:
-            X = data_dict[xlabel]
-            Y = data_dict[ylabel]
-            X2 = data_dict2[xlabel]  # [:1595]
-            Y2 = data_dict2[ylabel]  # [:1595]
-            # get edges with maxima determined using percentiles to be robust for outliers
-            x_bin_edges = np.linspace(
-                np.nanpercentile(X, 1) - 0.00001, np.nanpercentile(X, 98), bins + 1
-            )
-            # x_bin_edges = np.linspace(np.nanmin(X)-0.00001, np.nanpercentile(X, 98), bins+1)
-            y_bin_edges = np.linspace(
-                np.nanpercentile(Y, 1) - 0.00001, np.nanpercentile(Y, 95), bins + 1
-            )
-            # y_bin_edges = np.linspace(np.nanmin(Y)-0.00001, np.nanpercentile(Y, 98), bins + 1)
-            # derive bin centers
-            x_bin_width = x_bin_edges[1] - x_bin_edges[0]
-            x_bin_centers = x_bin_edges[1:] - x_bin_width / 2
-            y_bin_width = y_bin_edges[1] - y_bin_edges[0]
-            y_bin_centers = y_bin_edges[1:] - y_bin_width / 2
-
-            recall_2D = np.zeros((x_bin_centers.shape[0], y_bin_centers.shape[0]))
-            recall_2D2 = np.zeros((x_bin_centers.shape[0], y_bin_centers.shape[0]))
-            n_sources = np.zeros(
-                (x_bin_centers.shape[0], y_bin_centers.shape[0]), dtype=int
-            )
-            # now obtain recall
-            for i in range(len(x_bin_centers)):
-                for j in range(len(y_bin_centers)):
-                    # get the prediction errors in a bin
-                    bin_contents = pred_source_recall[
-                        (X > x_bin_edges[i])
-                        & (X < x_bin_edges[i + 1])
-                        & (Y > y_bin_edges[j])
-                        & (Y < y_bin_edges[j + 1])
-                    ]
-                    bin_2 = pred_source_recall2[
-                        (X2 > x_bin_edges[i])
-                        & (X2 < x_bin_edges[i + 1])
-                        & (Y2 > y_bin_edges[j])
-                        & (Y2 < y_bin_edges[j + 1])
-                    ]
-
-                    # determine recall
-                    # print(f"Bin Sum: {np.nansum(bin_contents > 0.95)}, len: {len(bin_contents)}")
-                    recall_2D[i][j] = np.nansum(bin_contents > 0.95) / len(bin_contents)
-                    recall_2D2[i][j] = np.nansum(bin_2 > 0.95) / len(bin_2)
-                    # print(f"Recall Model:\n {recall_2D}")
-                    # print(f"Recall Baseline:\n {recall_2D2}")
-                    # also determine the number of sources
-                    n_sources[i][j] = len(bin_contents)
-            recall_2D = recall_2D - recall_2D2
-
-            # now get the selection mask
-            fig, ax = plt.subplots()
-
-            # get the desired aspect ratio such that the plot is square
-            aspectratio = (np.max(x_bin_centers) - np.min(x_bin_centers)) / (
-                np.max(y_bin_centers) - np.min(y_bin_centers)
-            )
-            im = ax.imshow(
-                recall_2D.T,
-                origin="lower",
-                cmap="bwr_r",
-                vmin=-1,
-                vmax=1,
-                zorder=2,
-                aspect=aspectratio,
-                extent=[
-                    np.min(x_bin_edges),
-                    np.max(x_bin_edges),
-                    np.min(y_bin_edges),
-                    np.max(y_bin_edges),
-                ],
-            )
+    for xlabel, ylabel in AXIS_RECALL_PAIRS:
+        X = data_dict[xlabel]
+        Y = data_dict[ylabel]
+        X2 = data_dict2[xlabel]  # [:1595]
+        Y2 = data_dict2[ylabel]  # [:1595]
+        # get edges with maxima determined using percentiles to be robust for outliers
+        x_bin_edges = np.linspace(
+            np.nanpercentile(X, 1) - 0.00001, np.nanpercentile(X, 98), bins + 1
+        )
+        # x_bin_edges = np.linspace(np.nanmin(X)-0.00001, np.nanpercentile(X, 98), bins+1)
+        y_bin_edges = np.linspace(
+            np.nanpercentile(Y, 1) - 0.00001, np.nanpercentile(Y, 95), bins + 1
+        )
+        # y_bin_edges = np.linspace(np.nanmin(Y)-0.00001, np.nanpercentile(Y, 98), bins + 1)
+        # derive bin centers
+        x_bin_width = x_bin_edges[1] - x_bin_edges[0]
+        x_bin_centers = x_bin_edges[1:] - x_bin_width / 2
+        y_bin_width = y_bin_edges[1] - y_bin_edges[0]
+        y_bin_centers = y_bin_edges[1:] - y_bin_width / 2
 
-            xlims = ax.get_xlim()
-            ylims = ax.get_ylim()
-
-            # reset view limits
-            ax.set_xlim(xlims)
-            ax.set_ylim(ylims)
-
-            # indicate the number of sources
-            for i in range(n_sources.shape[0]):
-                for j in range(n_sources.shape[1]):
-                    ax.text(
-                        x_bin_centers[i],
-                        y_bin_centers[j],
-                        str(n_sources[i, j]),
-                        ha="center",
-                        va="center",
-                        color="black",
-                        fontsize=5,
-                    )
+        # now obtain recall, and the number of sources, in every bin at once
+        recall_2D, n_sources = _binned_recall(
+            X, Y, pred_source_recall, x_bin_edges, y_bin_edges
+        )
+        recall_2D2, _ = _binned_recall(
+            X2, Y2, pred_source_recall2, x_bin_edges, y_bin_edges
+        )
+        recall_2D = recall_2D - recall_2D2
+
+        # now get the selection mask
+        fig, ax = plt.subplots()
+
+        # get the desired aspect ratio such that the plot is square
+        aspectratio = (np.max(x_bin_centers) - np.min(x_bin_centers)) / (
+            np.max(y_bin_centers) - np.min(y_bin_centers)
+        )
+        im = ax.imshow(
+            recall_2D.T,
+            origin="lower",
+            cmap="bwr_r",
+            vmin=-1,
+            vmax=1,
+            zorder=2,
+            aspect=aspectratio,
+            extent=[
+                np.min(x_bin_edges),
+                np.max(x_bin_edges),
+                np.min(y_bin_edges),
+                np.max(y_bin_edges),
+            ],
+        )
+
+        xlims = ax.get_xlim()
+        ylims = ax.get_ylim()
+
+        # reset view limits
+        ax.set_xlim(xlims)
+        ax.set_ylim(ylims)
+
+        # indicate the number of sources
+        for i in range(n_sources.shape[0]):
+            for j in range(n_sources.shape[1]):
+                ax.text(
+                    x_bin_centers[i],
+                    y_bin_centers[j],
+                    str(n_sources[i, j]),
+                    ha="center",
+                    va="center",
+                    color="black",
+                    fontsize=5,
+                )
 
-            cbar = plt.colorbar(im, ax=ax)
-            cbar.ax.set_ylabel("Recall Improvement Over Baseline")
+        cbar = plt.colorbar(im, ax=ax)
+        cbar.ax.set_ylabel("Recall Improvement Over Baseline")
 
-            ax.set_xticks(x_bin_centers)
-            ax.set_yticks(y_bin_centers)
+        ax.set_xticks(x_bin_centers)
+        ax.set_yticks(y_bin_centers)
 
-            ax.tick_params(axis="x", labelrotation=40, labelsize="x-small")
-            ax.tick_params(axis="y", labelrotation=0, labelsize="x-small")
+        ax.tick_params(axis="x", labelrotation=40, labelsize="x-small")
+        ax.tick_params(axis="y", labelrotation=0, labelsize="x-small")
 
-            ax.set_xlabel(xlabel)
-            ax.set_ylabel(ylabel)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
 
-            ax.set_title(f"{limit} recall vs Baseline for {xlabel} vs {ylabel}")
-            fig.savefig(
-                os.path.join(
-                    output_dir, f"{xlabel}-{ylabel}_jelle{jelle_cut}_{limit}.png"
-                ),
-                dpi=300,
-                bbox_inches="tight",
-            )
-            plt.close()
+        ax.set_title(f"{limit} recall vs Baseline for {xlabel} vs {ylabel}")
+        fig.savefig(
+            os.path.join(output_dir, f"{xlabel}-{ylabel}_jelle{jelle_cut}_{limit}.png"),
+            dpi=300,
+            bbox_inches="tight",
+        )
+        plt.close()
 
 
 def plot_axis_recall(
@@ -444,145 +515,194 @@ def plot_axis_recall(
     :param limit: str, limit for the recall value for use in saving, title, etc.
     :return:
     """
-    data = pickle.load(open(recall_path, "rb"), fix_imports=True)
     vac_catalog = get_lotss_objects(vac_catalog)
-    pred_source_names = []
-    pred_source_recall = []
     if jelle_cut:
         vac_catalog = vac_catalog[vac_catalog["LGZ_Size"] > 15.0]
         vac_catalog = vac_catalog[vac_catalog["Total_flux"] > 10.0]
-    for key in data.keys():
-        if key in vac_catalog["Source_Name"].data:
-            pred_source_names.append(key)
-            pred_source_recall.append(data[key])
+    pred_source_names, pred_source_recall = _recalls_in_catalog(
+        recall_path, vac_catalog
+    )
     pred_source_recall = np.asarray(pred_source_recall)
-    radio_apparent_size = np.zeros(len(pred_source_names))
-    radio_apparent_width = np.zeros(len(pred_source_names))
-    radio_total_flux = np.zeros(len(pred_source_names))
-    radio_z = np.zeros(len(pred_source_names))
-    radio_comp = np.zeros(len(pred_source_names))
-    for i, source_name in enumerate(pred_source_names):
-        mask = source_name == vac_catalog["Source_Name"]
-
-        # get values
-        radio_apparent_size[i] = vac_catalog[mask]["LGZ_Size"].data
-        radio_apparent_width[i] = vac_catalog[mask]["LGZ_Width"].data
-        radio_total_flux[i] = vac_catalog[mask]["Total_flux"].data
-        radio_z[i] = vac_catalog[mask]["z_best"].data
-        radio_comp[i] = vac_catalog[mask]["LGZ_Assoc"].data
-    radio_axis_ratio = radio_apparent_size / radio_apparent_width
-    data_dict = {
-        "Axis ratio": radio_axis_ratio,
-        "Total flux [mJy]": radio_total_flux,
-        "Apparent size [arcsec]": radio_apparent_size,
-        "z": radio_z,
-        "Number of Components": radio_comp,
-    }
+    data_dict = _source_properties(pred_source_names, vac_catalog)
 
     ###calculate recall in bins
     # set which parameters you want to have on the X and Y axis
-    for xlabel in ["Apparent size [arcsec]"]:
-        for ylabel in ["Total flux [mJy]", "Axis ratio", "z", "Number of Components"]:
-            X = data_dict[xlabel]
-            Y = data_dict[ylabel]
-            # get edges with maxima determined using percentiles to be robust for outliers
-            x_bin_edges = np.linspace(
-                np.nanpercentile(X, 1) - 0.00001, np.nanpercentile(X, 98), bins + 1
-            )
-            # x_bin_edges = np.linspace(np.nanmin(X)-0.00001, np.nanpercentile(X, 98), bins+1)
-            y_bin_edges = np.linspace(
-                np.nanpercentile(Y, 1) - 0.00001, np.nanpercentile(Y, 95), bins + 1
-            )
-            # y_bin_edges = np.linspace(np.nanmin(Y)-0.00001, np.nanpercentile(Y, 98), bins + 1)
-            # derive bin centers
-            x_bin_width = x_bin_edges[1] - x_bin_edges[0]
-            x_bin_centers = x_bin_edges[1:] - x_bin_width / 2
-            y_bin_width = y_bin_edges[1] - y_bin_edges[0]
-            y_bin_centers = y_bin_edges[1:] - y_bin_width / 2
-
-            recall_2D = np.zeros((x_bin_centers.shape[0], y_bin_centers.shape[0]))
-            n_sources = np.zeros(
-                (x_bin_centers.shape[0], y_bin_centers.shape[0]), dtype=int
-            )
-            # now obtain recall
-            for i in range(len(x_bin_centers)):
-                for j in range(len(y_bin_centers)):
-                    # get the prediction errors in a bin
-                    bin_contents = pred_source_recall[
-                        (X > x_bin_edges[i])
-                        & (X < x_bin_edges[i + 1])
-                        & (Y > y_bin_edges[j])
-                        & (Y < y_bin_edges[j + 1])
-                    ]
-                    # determine recall
-                    recall_2D[i][j] = np.sum(bin_contents > 0.95) / len(bin_contents)
-                    # also determine the number of sources
-                    n_sources[i][j] = len(bin_contents)
-
-            # now get the selection mask
-            fig, ax = plt.subplots()
-
-            # get the desired aspect ratio such that the plot is square
-            aspectratio = (np.max(x_bin_centers) - np.min(x_bin_centers)) / (
-                np.max(y_bin_centers) - np.min(y_bin_centers)
-            )
-            im = ax.imshow(
-                recall_2D.T,
-                origin="lower",
-                cmap="viridis",
-                vmin=0,
-                vmax=1,
-                zorder=2,
-                aspect=aspectratio,
-                extent=[
-                    np.min(x_bin_edges),
-                    np.max(x_bin_edges),
-                    np.min(y_bin_edges),
-                    np.max(y_bin_edges),
-                ],
-            )
+    for xlabel, ylabel in AXIS_RECALL_PAIRS:
+        X = data_dict[xlabel]
+        Y = data_dict[ylabel]
+        # get edges with maxima determined using percentiles to be robust for outliers
+        x_bin_edges = np.linspace(
+            np.nanpercentile(X, 1) - 0.00001, np.nanpercentile(X, 98), bins + 1
+        )
+        # x_bin_edges = np.linspace(np.nanmin(X)-0.00001, np.nanpercentile(X, 98), bins+1)
+        y_bin_edges = np.linspace(
+            np.nanpercentile(Y, 1) - 0.00001, np.nanpercentile(Y, 95), bins + 1
+        )
+        # y_bin_edges = np.linspace(np.nanmin(Y)-0.00001, np.nanpercentile(Y, 98), bins + 1)
+        # derive bin centers
+        x_bin_width = x_bin_edges[1] - x_bin_edges[0]
+        x_bin_centers = x_bin_edges[1:] - x_bin_width / 2
+        y_bin_width = y_bin_edges[1] - y_bin_edges[0]
+        y_bin_centers = y_bin_edges[1:] - y_bin_width / 2
 
-            xlims = ax.get_xlim()
-            ylims = ax.get_ylim()
-
-            # reset view limits
-            ax.set_xlim(xlims)
-            ax.set_ylim(ylims)
-
-            # indicate the number of sources
-            for i in range(n_sources.shape[0]):
-                for j in range(n_sources.shape[1]):
-                    ax.text(
-                        x_bin_centers[i],
-                        y_bin_centers[j],
-                        str(n_sources[i, j]),
-                        ha="center",
-                        va="center",
-                        color="white",
-                        fontsize=5,
-                    )
+        # now obtain recall, and the number of sources, in every bin at once
+        recall_2D, n_sources = _binned_recall(
+            X, Y, pred_source_recall, x_bin_edges, y_bin_edges
+        )
 
-            cbar = plt.colorbar(im, ax=ax)
-            cbar.ax.set_ylabel("Recall")
+        # now get the selection mask
+        fig, ax = plt.subplots()
 
-            ax.set_xticks(x_bin_centers)
-            ax.set_yticks(y_bin_centers)
+        # get the desired aspect ratio such that the plot is square
+        aspectratio = (np.max(x_bin_centers) - np.min(x_bin_centers)) / (
+            np.max(y_bin_centers) - np.min(y_bin_centers)
+        )
+        im = ax.imshow(
+            recall_2D.T,
+            origin="lower",
+            cmap="viridis",
+            vmin=0,
+            vmax=1,
+            zorder=2,
+            aspect=aspectratio,
+            extent=[
+                np.min(x_bin_edges),
+                np.max(x_bin_edges),
+                np.min(y_bin_edges),
+                np.max(y_bin_edges),
+            ],
+        )
 
-            ax.tick_params(axis="x", labelrotation=40, labelsize="x-small")
-            ax.tick_params(axis="y", labelrotation=0, labelsize="x-small")
+        xlims = ax.get_xlim()
+        ylims = ax.get_ylim()
+
+        # reset view limits
+        ax.set_xlim(xlims)
+        ax.set_ylim(ylims)
+
+        # indicate the number of sources
+        for i in range(n_sources.shape[0]):
+            for j in range(n_sources.shape[1]):
+                ax.text(
+                    x_bin_centers[i],
+                    y_bin_centers[j],
+                    str(n_sources[i, j]),
+                    ha="center",
+                    va="center",
+                    color="white",
+                    fontsize=5,
+                )
 
-            ax.set_xlabel(xlabel)
-            ax.set_ylabel(ylabel)
+        cbar = plt.colorbar(im, ax=ax)
+        cbar.ax.set_ylabel("Recall")
 
-            ax.set_title(f"Recall for {xlabel} vs {ylabel}, limit: {limit}")
-            fig.savefig(
-                os.path.join(
-                    output_dir, f"{xlabel}-{ylabel}_limit{limit}_jelle{jelle_cut}.png"
-                ),
-                dpi=200,
-                bbox_inches="tight",
-            )
-            plt.close()
+        ax.set_xticks(x_bin_centers)
+        ax.set_yticks(y_bin_centers)
+
+        ax.tick_params(axis="x", labelrotation=40, labelsize="x-small")
+        ax.tick_params(axis="y", labelrotation=0, labelsize="x-small")
+
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+
+        ax.set_title(f"Recall for {xlabel} vs {ylabel}, limit: {limit}")
+        fig.savefig(
+            os.path.join(
+                output_dir, f"{xlabel}-{ylabel}_limit{limit}_jelle{jelle_cut}.png"
+            ),
+            dpi=200,
+            bbox_inches="tight",
+        )
+        plt.close()
+
+
+def _plot_limits_and_cuts(
+    metrics_files,
+    metrics_paths,
+    metrics_data,
+    experiment_name,
+    cuts,
+    labels,
+    title,
+    output_dir,
+    colors,
+    dpi=300,
+):
+    """
+    Plot the train and val recall and precision of every model, for each limit over the cuts,
+    and for each cut over the limits, shared by plot_plots and plot_combo_plots
+
+    Every curve is read from the metrics once, and used by both the limit and cut figures
+    """
+    limits = [1, 2, 5, 10, 100]
+    # Figures drawn with other arguments are drawn again, not only those whose metrics changed
+    key = (experiment_name, list(cuts), list(labels), list(colors), dpi)
+    for i, metrics in enumerate(metrics_data):
+        iteration = _get_metric(metrics, "iteration")
+        curves = {}
+
+        def curve(metric, split, j, cut):
+            # Read each curve from the metrics once, the first time a figure needs it
+            key = (metric, split, j, cut)
+            if key not in curves:
+                curves[key] = _plottable(
+                    iteration,
+                    _get_metric(
+                        metrics, _recall_key(experiment_name, split, j, cut, metric)
+                    ),
+                )
+            return curves[key]
+
+        for metric, ylabel in (("recall", "Recall"), ("precision", "Precision")):
+            for j in limits:
+                out_png = os.path.join(
+                    output_dir, f"{ylabel}_limit{j}_{title}_{metrics_files[i]}.png"
+                )
+                if not needs_rebuild(out_png, metrics_paths[i], key=key):
+                    continue
+                for k, cut in enumerate(cuts):
+                    # Only the recall is coloured and labelled by the model labels
+                    label = labels[k] if metric == "recall" else cut
+                    color = colors[k] if metric == "recall" else None
+                    plt.plot(
+                        *curve(metric, "train_test", j, cut),
+                        label=f"{label} Train",
+                        color=color,
+                    )
+                    plt.plot(
+                        *curve(metric, "val", j, cut),
+                        label=f"{label} Val",
+                        linestyle="dashed",
+                        color=color,
+                    )
+                plt.legend(loc="lower right")
+                plt.title(f"{ylabel} for limit {j}: {title}, {metrics_files[i]}")
+                plt.xlabel("Iteration")
+                plt.ylabel(ylabel)
+                save_figure(out_png, dpi=dpi, key=key)
+                plt.clf()
+                plt.cla()
+
+            for cut in cuts:
+                out_png = os.path.join(
+                    output_dir, f"{ylabel}_cut{cut}_{title}_{metrics_files[i]}.png"
+                )
+                if not needs_rebuild(out_png, metrics_paths[i], key=key):
+                    continue
+                for j in limits:
+                    plt.plot(*curve(metric, "train_test", j, cut), label=f"{j} Train")
+                    plt.plot(
+                        *curve(metric, "val", j, cut),
+                        label=f"{j} Val",
+                        linestyle="dashed",
+                    )
+                plt.legend(loc="lower right")
+                plt.title(f"{ylabel} for cut {cut}: {title}, {metrics_files[i]}")
+                plt.xlabel("Iteration")
+                plt.ylabel(ylabel)
+                save_figure(out_png, dpi=dpi, key=key)
+                plt.clf()
+                plt.cla()
 
 
 def plot_plots(
@@ -594,6 +714,7 @@ def plot_plots(
     title,
     output_dir,
     colors,
+    dpi=300,
 ):
     """
     Plot a variety of different metrics, including recall, precision, loss, etc.
@@ -601,319 +722,57 @@ def plot_plots(
     :param experiment_name:
     :param labels:
     :param output_dir:
+    :param dpi: DPI of the saved figures
     :return:
     """
-    metrics_data = []
-    for f in metrics_files:
-        metrics_data.append(load_json_arr(os.path.join(f)))
-
-    # Now extract the useful information: own recall and precision are the important ones since COCO seems off
-    recall = {}
-    val_recall = {}
-    precision = {}
-    val_precision = {}
-    iteration = {}
-    loss = {}
-    val_loss = {}
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [1, 2, 5, 10, 100]:
-                recall[f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"] = []
-                val_recall[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"] = []
-                precision[
-                    f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                ] = []
-                val_precision[
-                    f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                ] = []
-                recall[f"{experiment_name}_train_test/own_recall_{j}/recall"] = []
-                val_recall[f"{experiment_name}_val/own_recall_{j}/recall"] = []
-                precision[f"{experiment_name}_train_test/own_recall_{j}/precision"] = []
-                val_precision[f"{experiment_name}_val/own_recall_{j}/precision"] = []
-
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [1, 2, 5, 10, 100]:
-                iteration[metrics_files[i]] = []
-                loss[metrics_files[i]] = []
-                val_loss[metrics_files[i]] = []
-                val_recall[f"{experiment_name}_val/own_recall_1/recall"] = []
-                val_precision[f"{experiment_name}_val/own_recall_1/precision"] = []
-                precision[f"{experiment_name}_train_test/own_recall_1/precision"] = []
-                recall[f"{experiment_name}_train_test/own_recall_1/recall"] = []
-                val_recall[f"{experiment_name}_val/own_recall_1_{cut}/recall"] = []
-                val_precision[
-                    f"{experiment_name}_val/own_recall_1_{cut}/precision"
-                ] = []
-                precision[
-                    f"{experiment_name}_train_test/own_recall_1_{cut}/precision"
-                ] = []
-                # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                recall[f"{experiment_name}_train_test/own_recall_1_{cut}/recall"] = []
-                for line in metric:
-                    try:
-                        val_recall[
-                            f"{experiment_name}_val/own_recall_{j}_{cut}/recall"
-                        ].append(
-                            line[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"]
-                        )
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                            ]
-                        )
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                            ]
-                        )
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"
-                            ]
-                        )
-                        val_recall[
-                            f"{experiment_name}_val/own_recall_{j}/recall"
-                        ].append(line[f"{experiment_name}_val/own_recall_{j}/recall"])
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_{j}/precision"
-                        ].append(
-                            line[f"{experiment_name}_val/own_recall_{j}/precision"]
-                        )
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_{j}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{j}/precision"
-                            ]
-                        )
-                        # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_{j}/recall"
-                        ].append(
-                            line[f"{experiment_name}_train_test/own_recall_{j}/recall"]
-                        )
-                        val_recall[f"{experiment_name}_val/own_recall_1/recall"].append(
-                            line[f"{experiment_name}_val/own_recall/recall"]
-                        )
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_1/precision"
-                        ].append(line[f"{experiment_name}_val/own_recall/precision"])
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_1/precision"
-                        ].append(
-                            line[f"{experiment_name}_train_test/own_recall/precision"]
-                        )
-                        # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_1/recall"
-                        ].append(
-                            line[f"{experiment_name}_train_test/own_recall/recall"]
-                        )
-                        val_recall[
-                            f"{experiment_name}_val/own_recall_1_{cut}/recall"
-                        ].append(line[f"{experiment_name}_val/own_recall_{cut}/recall"])
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_1_{cut}/precision"
-                        ].append(
-                            line[f"{experiment_name}_val/own_recall_{cut}/precision"]
-                        )
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_1_{cut}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{cut}/precision"
-                            ]
-                        )
-                        # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_1_{cut}/recall"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{cut}/recall"
-                            ]
-                        )
-                        val_loss[metrics_files[i]].append(line["validation_loss"])
-                        loss[metrics_files[i]].append(line["total_loss"])
-                        iteration[metrics_files[i]].append(line["iteration"])
-                    except:
-                        continue
+    metrics_paths = [os.path.join(f) for f in metrics_files]
+    metrics_data = [_evaluation_rows(load_metrics(f)) for f in metrics_paths]
 
     # Plot the iteration vs loss for the models
-    for i, metric in enumerate(metrics_data):
-        if "1.0" in labels[i]:
-            print(len(iteration[metrics_files[i]]))
-        else:
-            print(len(iteration[metrics_files[i]]))
-        iteration[metrics_files[i]] = iteration[metrics_files[i]][:35]
-        loss[metrics_files[i]] = loss[metrics_files[i]][:35]
-        val_loss[metrics_files[i]] = val_loss[metrics_files[i]][:35]
-        plt.plot(
-            iteration[metrics_files[i]],
-            loss[metrics_files[i]],
-            label=f"{labels[i]} Train",
-            color=colors[i],
-        )
-        plt.plot(
-            iteration[metrics_files[i]],
-            val_loss[metrics_files[i]],
-            linestyle="dashed",
-            label=f"{labels[i]} Val",
-            color=colors[i],
-        )
-
-    plt.legend(loc="lower left")
-    plt.title(f"Total Training Loss {title}")
-    # plt.xlim(0,200000)
-    plt.xlabel("Iteration")
-    plt.ylabel("Total Loss")
-    plt.yscale("log")
-    plt.savefig(os.path.join(output_dir, f"Total_Training_Loss_{title}.png"), dpi=300)
-    plt.clf()
-    plt.cla()
-
-    # Plot recall for the different cuts for the same models
-    for i, metric in enumerate(metrics_data):
-        for j in [1, 2, 5, 10, 100]:
-            for k, cut in enumerate(cuts):
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    recall[f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"],
-                    label=f"{labels[k]} Train",
-                    color=colors[k],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_recall[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"],
-                    label=f"{labels[k]} Val",
-                    linestyle="dashed",
-                    color=colors[k],
-                )
-
-            plt.legend(loc="lower right")
-            plt.title(f"Recall for limit {j}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Recall")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Recall_limit{j}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
+    loss_png = os.path.join(output_dir, f"Total_Training_Loss_{title}.png")
+    # Only redraw if the metrics, or the arguments, changed since the figure was saved
+    loss_key = ("plot_plots", metrics_paths, list(labels), list(colors), dpi)
+    if needs_rebuild(loss_png, *metrics_paths, key=loss_key):
+        for i, metrics in enumerate(metrics_data):
+            iteration = _get_metric(metrics, "iteration")[:35]
+            print(len(iteration))
+            _plot_envelope(
+                iteration,
+                _get_metric(metrics, "total_loss")[:35],
+                label=f"{labels[i]} Train",
+                color=colors[i],
             )
-            plt.clf()
-            plt.cla()
-
-    # Plot precision for different cuts for same models
-    for i, metric in enumerate(metrics_data):
-        for j in [1, 2, 5, 10, 100]:
-            for k, cut in enumerate(cuts):
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    precision[
-                        f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{cut} Train",
-                    # color=colors[i],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_precision[
-                        f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{cut} Val",
-                    linestyle="dashed",
-                    # color=colors[i],
-                )
-
-            plt.legend(loc="lower right")
-            plt.title(f"Precision for limit {j}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Precision")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Precision_limit{j}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
+            _plot_envelope(
+                iteration,
+                _get_metric(metrics, "validation_loss")[:35],
+                linestyle="dashed",
+                label=f"{labels[i]} Val",
+                color=colors[i],
             )
-            plt.clf()
-            plt.cla()
-
-    # Plot recall and precision based on different limits
-    # Plot recall for the different cuts for the same models
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [1, 2, 5, 10, 100]:
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    recall[f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"],
-                    label=f"{j} Train",
-                    # color=colors[i],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_recall[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"],
-                    label=f"{j} Val",
-                    linestyle="dashed",
-                    # color=colors[i],
-                )
 
-            plt.legend(loc="lower right")
-            plt.title(f"Recall for cut {cut}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Recall")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Recall_cut{cut}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
-            )
-            plt.clf()
-            plt.cla()
-
-    # Plot precision for different cuts for same models
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [1, 2, 5, 10, 100]:
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    precision[
-                        f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{j} Train",
-                    # color=colors[i],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_precision[
-                        f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{j} Val",
-                    linestyle="dashed",
-                    # color=colors[i],
-                )
+        plt.legend(loc="lower left")
+        plt.title(f"Total Training Loss {title}")
+        # plt.xlim(0,200000)
+        plt.xlabel("Iteration")
+        plt.ylabel("Total Loss")
+        plt.yscale("log")
+        save_figure(loss_png, dpi=dpi, key=loss_key)
+        plt.clf()
+        plt.cla()
 
-            plt.legend(loc="lower right")
-            plt.title(f"Precision for cut {cut}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Precision")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Precision_cut{cut}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
-            )
-            plt.clf()
-            plt.cla()
+    # Plot recall and precision for each limit over the cuts, and each cut over the limits
+    _plot_limits_and_cuts(
+        metrics_files,
+        metrics_paths,
+        metrics_data,
+        experiment_name,
+        cuts,
+        labels,
+        title,
+        output_dir,
+        colors,
+        dpi,
+    )
 
     # Plot recall for different models
 
@@ -929,6 +788,7 @@ def plot_combo_plots(
     title,
     output_dir,
     colors,
+    dpi=300,
 ):
     """
     Plot a variety of different metrics, including recall, precision, loss, etc.
@@ -936,311 +796,55 @@ def plot_combo_plots(
     :param experiment_name:
     :param labels:
     :param output_dir:
+    :param dpi: DPI of the saved figures
     :return:
     """
-    metrics_data = []
-    for f in metrics_files:
-        metrics_data.append(load_json_arr(os.path.join(experiment_dir, f + ".json")))
-
-    # Now extract the useful information: own recall and precision are the important ones since COCO seems off
-    recall = {}
-    val_recall = {}
-    precision = {}
-    val_precision = {}
-    iteration = {}
-    loss = {}
-    val_loss = {}
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [1, 2, 5, 10, 100]:
-                recall[f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"] = []
-                val_recall[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"] = []
-                precision[
-                    f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                ] = []
-                val_precision[
-                    f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                ] = []
-                recall[f"{experiment_name}_train_test/own_recall_{j}/recall"] = []
-                val_recall[f"{experiment_name}_val/own_recall_{j}/recall"] = []
-                precision[f"{experiment_name}_train_test/own_recall_{j}/precision"] = []
-                val_precision[f"{experiment_name}_val/own_recall_{j}/precision"] = []
-
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [2, 5, 10, 100]:
-                iteration[metrics_files[i]] = []
-                loss[metrics_files[i]] = []
-                val_loss[metrics_files[i]] = []
-                val_recall[f"{experiment_name}_val/own_recall_1/recall"] = []
-                val_precision[f"{experiment_name}_val/own_recall_1/precision"] = []
-                precision[f"{experiment_name}_train_test/own_recall_1/precision"] = []
-                recall[f"{experiment_name}_train_test/own_recall_1/recall"] = []
-                val_recall[f"{experiment_name}_val/own_recall_1_{cut}/recall"] = []
-                val_precision[
-                    f"{experiment_name}_val/own_recall_1_{cut}/precision"
-                ] = []
-                precision[
-                    f"{experiment_name}_train_test/own_recall_1_{cut}/precision"
-                ] = []
-                # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                recall[f"{experiment_name}_train_test/own_recall_1_{cut}/recall"] = []
-                for line in metric:
-                    try:
-                        val_recall[
-                            f"{experiment_name}_val/own_recall_{j}_{cut}/recall"
-                        ].append(
-                            line[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"]
-                        )
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                            ]
-                        )
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                            ]
-                        )
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"
-                            ]
-                        )
-                        val_recall[
-                            f"{experiment_name}_val/own_recall_{j}/recall"
-                        ].append(line[f"{experiment_name}_val/own_recall_{j}/recall"])
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_{j}/precision"
-                        ].append(
-                            line[f"{experiment_name}_val/own_recall_{j}/precision"]
-                        )
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_{j}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{j}/precision"
-                            ]
-                        )
-                        # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_{j}/recall"
-                        ].append(
-                            line[f"{experiment_name}_train_test/own_recall_{j}/recall"]
-                        )
-                        val_recall[f"{experiment_name}_val/own_recall_1/recall"].append(
-                            line[f"{experiment_name}_val/own_recall/recall"]
-                        )
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_1/precision"
-                        ].append(line[f"{experiment_name}_val/own_recall/precision"])
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_1/precision"
-                        ].append(
-                            line[f"{experiment_name}_train_test/own_recall/precision"]
-                        )
-                        # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_1/recall"
-                        ].append(
-                            line[f"{experiment_name}_train_test/own_recall/recall"]
-                        )
-                        val_recall[
-                            f"{experiment_name}_val/own_recall_1_{cut}/recall"
-                        ].append(line[f"{experiment_name}_val/own_recall_{cut}/recall"])
-                        val_precision[
-                            f"{experiment_name}_val/own_recall_1_{cut}/precision"
-                        ].append(
-                            line[f"{experiment_name}_val/own_recall_{cut}/precision"]
-                        )
-                        precision[
-                            f"{experiment_name}_train_test/own_recall_1_{cut}/precision"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{cut}/precision"
-                            ]
-                        )
-                        # print(line[f"{experiment_name}_train_test/own_recall_{j}/recall"])
-                        recall[
-                            f"{experiment_name}_train_test/own_recall_1_{cut}/recall"
-                        ].append(
-                            line[
-                                f"{experiment_name}_train_test/own_recall_{cut}/recall"
-                            ]
-                        )
-                        val_loss[metrics_files[i]].append(line["validation_loss"])
-                        loss[metrics_files[i]].append(line["total_loss"])
-                        iteration[metrics_files[i]].append(line["iteration"])
-                    except:
-                        continue
+    metrics_paths = [os.path.join(experiment_dir, f + ".json") for f in metrics_files]
+    metrics_data = [_evaluation_rows(load_metrics(f)) for f in metrics_paths]
 
     # Plot the iteration vs loss for the models
-    for i, metric in enumerate(metrics_data):
-        plt.plot(
-            iteration[metrics_files[i]],
-            loss[metrics_files[i]],
-            label=f"{labels[i]} Train",
-            color=colors[i],
-        )
-        plt.plot(
-            iteration[metrics_files[i]],
-            val_loss[metrics_files[i]],
-            linestyle="dashed",
-            label=f"{labels[i]} Val",
-            color=colors[i],
-        )
-
-    plt.legend(loc="upper right")
-    plt.title(f"Total Training Loss {title}")
-    plt.xlabel("Iteration")
-    plt.ylabel("Total Loss")
-    plt.yscale("log")
-    plt.savefig(os.path.join(output_dir, f"Total_Training_Loss_{title}.png"), dpi=300)
-    plt.clf()
-    plt.cla()
-
-    # Plot recall for the different cuts for the same models
-    for i, metric in enumerate(metrics_data):
-        for j in [1, 2, 5, 10, 100]:
-            for k, cut in enumerate(cuts):
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    recall[f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"],
-                    label=f"{labels[k]} Train",
-                    color=colors[k],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_recall[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"],
-                    label=f"{labels[k]} Val",
-                    linestyle="dashed",
-                    color=colors[k],
-                )
-
-            plt.legend(loc="lower right")
-            plt.title(f"Recall for limit {j}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Recall")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Recall_limit{j}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
+    loss_png = os.path.join(output_dir, f"Total_Training_Loss_{title}.png")
+    # Only redraw if the metrics, or the arguments, changed since the figure was saved
+    loss_key = ("plot_combo_plots", metrics_paths, list(labels), list(colors), dpi)
+    if needs_rebuild(loss_png, *metrics_paths, key=loss_key):
+        for i, metrics in enumerate(metrics_data):
+            iteration = _get_metric(metrics, "iteration")
+            _plot_envelope(
+                iteration,
+                _get_metric(metrics, "total_loss"),
+                label=f"{labels[i]} Train",
+                color=colors[i],
             )
-            plt.clf()
-            plt.cla()
-
-    # Plot precision for different cuts for same models
-    for i, metric in enumerate(metrics_data):
-        for j in [1, 2, 5, 10, 100]:
-            for k, cut in enumerate(cuts):
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    precision[
-                        f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{cut} Train",
-                    # color=colors[i],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_precision[
-                        f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{cut} Val",
-                    linestyle="dashed",
-                    # color=colors[i],
-                )
-
-            plt.legend(loc="lower right")
-            plt.title(f"Precision for limit {j}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Precision")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Precision_limit{j}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
+            _plot_envelope(
+                iteration,
+                _get_metric(metrics, "validation_loss"),
+                linestyle="dashed",
+                label=f"{labels[i]} Val",
+                color=colors[i],
             )
-            plt.clf()
-            plt.cla()
-
-    # Plot recall and precision based on different limits
-    # Plot recall for the different cuts for the same models
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [1, 2, 5, 10, 100]:
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    recall[f"{experiment_name}_train_test/own_recall_{j}_{cut}/recall"],
-                    label=f"{j} Train",
-                    # color=colors[i],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_recall[f"{experiment_name}_val/own_recall_{j}_{cut}/recall"],
-                    label=f"{j} Val",
-                    linestyle="dashed",
-                    # color=colors[i],
-                )
 
-            plt.legend(loc="lower right")
-            plt.title(f"Recall for cut {cut}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Recall")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Recall_cut{cut}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
-            )
-            plt.clf()
-            plt.cla()
-
-    # Plot precision for different cuts for same models
-    for i, metric in enumerate(metrics_data):
-        for cut in cuts:
-            for j in [1, 2, 5, 10, 100]:
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    precision[
-                        f"{experiment_name}_train_test/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{j} Train",
-                    # color=colors[i],
-                )
-                plt.plot(
-                    iteration[metrics_files[i]],
-                    val_precision[
-                        f"{experiment_name}_val/own_recall_{j}_{cut}/precision"
-                    ],
-                    label=f"{j} Val",
-                    linestyle="dashed",
-                    # color=colors[i],
-                )
+        plt.legend(loc="upper right")
+        plt.title(f"Total Training Loss {title}")
+        plt.xlabel("Iteration")
+        plt.ylabel("Total Loss")
+        plt.yscale("log")
+        save_figure(loss_png, dpi=dpi, key=loss_key)
+        plt.clf()
+        plt.cla()
 
-            plt.legend(loc="lower right")
-            plt.title(f"Precision for cut {cut}: {title}, {metrics_files[i]}")
-            plt.xlabel("Iteration")
-            plt.ylabel("Precision")
-            # plt.yscale("log")
-            plt.savefig(
-                os.path.join(
-                    output_dir, f"Precision_cut{cut}_{title}_{metrics_files[i]}.png"
-                ),
-                dpi=300,
-            )
-            plt.clf()
-            plt.cla()
+    # Plot recall and precision for each limit over the cuts, and each cut over the limits
+    _plot_limits_and_cuts(
+        metrics_files,
+        metrics_paths,
+        metrics_data,
+        experiment_name,
+        cuts,
+        labels,
+        title,
+        output_dir,
+        colors,
+        dpi,
+    )
 
     # Plot recall for different models
 
@@ -1310,5 +914,4 @@ def plot_wcs(filename, name, pred, target, aux, comp_catalog):
     plt.ylabel("Dec")
     plt.legend(loc="best")
     plt.savefig(f"{name}_prediction_plot.png", dpi=300)
-    plt.cla()
-    plt.clf()
+    plt.close(fig)
@@ -209,5 +209,4 @@ def visualize_maps(
         f"{title}_{'single' if single else 'multi'}_{'Failed' if correct else 'Success'}_baseline{baselines[0]}.png",
         dpi=300,
     )
-    plt.clf()
-    plt.cla()
+    plt.close(fig)